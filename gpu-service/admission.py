@@ -0,0 +1,280 @@
+"""Token-weighted admission control.
+
+A plain request-count semaphore treats a 1-text MiniLM embed and a 100-pair
+`deberta-xlarge` BERTScore job the same. Here each request is charged an
+estimated cost (estimated tokens x per-model cost factor) against a shared
+capacity budget, so many cheap requests can run next to one expensive one
+while the total in-flight work stays bounded. Each kind of request (or a
+specific model) gets its own lane with its own budget, so a backlog of one
+kind cannot starve the others.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import Iterable
+
+# Rough characters-per-token ratio for English subword tokenizers.
+CHARS_PER_TOKEN = 4
+# Inputs are truncated to the model's max sequence length, so no text costs more than this.
+MAX_SEQ_TOKENS = int(os.environ.get("GPU_MAX_SEQ_TOKENS", "512"))
+# Weight of the newest timing sample in the per-model EWMA.
+CALIBRATION_ALPHA = 0.2
+
+# Relative per-token cost by model size when no timings have been observed yet.
+_PRIOR_FACTORS = (("xlarge", 24.0), ("large", 8.0), ("base", 3.0))
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    """Estimate the tokens the model will see for `texts` (special tokens included)."""
+    return sum(min(MAX_SEQ_TOKENS, len(text) // CHARS_PER_TOKEN + 2) for text in texts)
+
+
+def prior_factor(model: str) -> float:
+    name = model.lower()
+    for marker, factor in _PRIOR_FACTORS:
+        if marker in name:
+            return factor
+    return 1.0
+
+
+class CostModel:
+    """Per-model cost factors, calibrated from observed seconds per token.
+
+    Factors are relative to `reference_model` (normally the default embed
+    model, factor 1.0), which keeps them independent of how fast the host is.
+    Until both the model and the reference have been timed, the configured or
+    name-based prior is used. Prior and calibrated factors are capped at
+    `max_factor`, so that a maximum-size request still fits the capacity that
+    was sized for it; explicit overrides are used as given.
+    """
+
+    def __init__(
+        self, reference_model: str, overrides: dict[str, float] | None = None, max_factor: float | None = None
+    ):
+        self.reference_model = reference_model
+        self.overrides = dict(overrides or {})
+        self.max_factor = max_factor
+        self._seconds_per_token: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, reference_model: str, max_factor: float | None = None) -> "CostModel":
+        raw = os.environ.get("GPU_COST_FACTORS")
+        return cls(reference_model, json.loads(raw) if raw else None, max_factor)
+
+    def factor(self, model: str) -> float:
+        if model in self.overrides:
+            return float(self.overrides[model])
+        with self._lock:
+            spt = self._seconds_per_token.get(model)
+            ref = self._seconds_per_token.get(self.reference_model)
+        if model == self.reference_model:
+            return 1.0
+        factor = spt / ref if spt is not None and ref else prior_factor(model)
+        return min(factor, self.max_factor) if self.max_factor else factor
+
+    def estimate(self, model: str, texts: Iterable[str]) -> tuple[int, float]:
+        """Return `(estimated_tokens, cost_units)` for running `texts` through `model`."""
+        tokens = estimate_tokens(texts)
+        return tokens, tokens * self.factor(model)
+
+    def observe(self, model: str, tokens: int, seconds: float) -> None:
+        """Feed a measured run into the model's seconds-per-token EWMA."""
+        if tokens <= 0 or seconds <= 0:
+            return
+        sample = seconds / tokens
+        with self._lock:
+            prev = self._seconds_per_token.get(model)
+            self._seconds_per_token[model] = (
+                sample if prev is None else (1 - CALIBRATION_ALPHA) * prev + CALIBRATION_ALPHA * sample
+            )
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            models = set(self._seconds_per_token) | set(self.overrides)
+        return {model: round(self.factor(model), 3) for model in sorted(models)}
+
+
+class CapacityTooSmall(Exception):
+    """The request's cost exceeds the whole budget, so it can never be admitted."""
+
+
+class QueueFull(Exception):
+    """The request would have to wait, but `max_queue` requests are already waiting."""
+
+
+class CapacityBudget:
+    """Weighted, FIFO-fair semaphore over cost units, with optional caps on job count and queue length."""
+
+    def __init__(self, capacity: float, max_jobs: int | None = None, max_queue: int | None = None):
+        self.capacity = float(capacity)
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.in_use = 0.0
+        self.jobs = 0
+        self._waiters: deque[tuple[float, asyncio.Future]] = deque()
+
+    @property
+    def available(self) -> float:
+        return max(0.0, self.capacity - self.in_use)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, cost: float) -> bool:
+        if self.max_jobs is not None and self.jobs >= self.max_jobs:
+            return False
+        return self.in_use + cost <= self.capacity
+
+    def _take(self, cost: float) -> None:
+        self.in_use += cost
+        self.jobs += 1
+
+    def _wake(self) -> None:
+        while self._waiters:
+            cost, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(cost):
+                return
+            self._waiters.popleft()
+            self._take(cost)
+            fut.set_result(True)
+
+    async def acquire(self, cost: float, timeout: float) -> None:
+        """Reserve `cost` units, waiting up to `timeout` seconds in FIFO order.
+
+        Raises `CapacityTooSmall` if `cost` exceeds the total capacity,
+        `QueueFull` if it would wait behind `max_queue` others and
+        `asyncio.TimeoutError` if the units do not free up in time.
+        """
+        if cost > self.capacity:
+            raise CapacityTooSmall(f"estimated cost {cost:.0f} exceeds capacity {self.capacity:.0f}")
+        if not self._waiters and self._fits(cost):
+            self._take(cost)
+            return
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            raise QueueFull(f"{self.queued} request(s) already waiting")
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (cost, fut)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=timeout)
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                # Granted just as we gave up: hand the units back.
+                self.release(cost)
+            else:
+                fut.cancel()
+                try:
+                    self._waiters.remove(entry)
+                except ValueError:
+                    pass
+                self._wake()
+            raise
+
+    def release(self, cost: float) -> None:
+        self.in_use = max(0.0, self.in_use - cost)
+        self.jobs = max(0, self.jobs - 1)
+        self._wake()
+
+
+class Lane:
+    """One execution lane: its own budget, queue limit and admission timeout."""
+
+    def __init__(
+        self,
+        name: str,
+        capacity: float,
+        max_jobs: int | None = None,
+        max_queue: int | None = None,
+        timeout: float = 1.0,
+    ):
+        self.name = name
+        self.budget = CapacityBudget(capacity, max_jobs=max_jobs, max_queue=max_queue)
+        self.timeout = timeout
+
+
+_LANE_KEYS = {"capacity_units": "capacity", "max_jobs": "max_jobs", "max_queue": "max_queue", "timeout_s": "timeout"}
+
+
+class LaneRouter:
+    """Admit each request on its own lane, optionally under a budget shared by all lanes.
+
+    A request of `kind` (e.g. "embed") for `model` runs on lane
+    `"<kind>:<model>"` if one is configured, else on lane `"<kind>"`, which
+    is created with the default settings on first use. A slow BERTScore model
+    filling its lane therefore never blocks admission on the embed lane;
+    only the optional global budget is shared.
+    """
+
+    def __init__(
+        self,
+        defaults: dict,
+        lanes: dict[str, dict] | None = None,
+        global_budget: CapacityBudget | None = None,
+        kinds: Iterable[str] = (),
+    ):
+        self.defaults = dict(defaults)
+        self.global_budget = global_budget
+        self._lanes: dict[str, Lane] = {}
+        for name, spec in (lanes or {}).items():
+            unknown = set(spec) - set(_LANE_KEYS)
+            if unknown:
+                raise ValueError(f"lane {name!r}: unknown setting(s) {sorted(unknown)}")
+            self._lanes[name] = Lane(name, **{**self.defaults, **{_LANE_KEYS[k]: v for k, v in spec.items()}})
+        for kind in kinds:
+            self._lanes.setdefault(kind, Lane(kind, **self.defaults))
+
+    @classmethod
+    def from_env(
+        cls, capacity: float, max_jobs: int | None, timeout: float, kinds: Iterable[str] = ()
+    ) -> "LaneRouter":
+        """Lanes from `GPU_LANES` (JSON, name -> settings) plus `GPU_GLOBAL_CAPACITY_UNITS`/`GPU_GLOBAL_MAX_JOBS`."""
+        raw = os.environ.get("GPU_LANES")
+        global_capacity = float(os.environ.get("GPU_GLOBAL_CAPACITY_UNITS", "0"))
+        global_jobs = int(os.environ.get("GPU_GLOBAL_MAX_JOBS", "0"))
+        global_budget = None
+        if global_capacity or global_jobs:
+            global_budget = CapacityBudget(global_capacity or float("inf"), max_jobs=global_jobs or None)
+        return cls(
+            {"capacity": capacity, "max_jobs": max_jobs, "timeout": timeout},
+            json.loads(raw) if raw else None,
+            global_budget,
+            kinds,
+        )
+
+    def select(self, kind: str, model: str) -> Lane:
+        for name in (f"{kind}:{model}", kind):
+            lane = self._lanes.get(name)
+            if lane is not None:
+                return lane
+        lane = self._lanes[kind] = Lane(kind, **self.defaults)
+        return lane
+
+    def lanes(self) -> list[Lane]:
+        return list(self._lanes.values())
+
+    async def acquire(self, lane: Lane, cost: float, timeout: float) -> None:
+        """Reserve `cost` on `lane`, then on the global budget, within one `timeout`."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await lane.budget.acquire(cost, timeout=timeout)
+        if self.global_budget is None:
+            return
+        try:
+            await self.global_budget.acquire(cost, timeout=max(0.0, timeout - (loop.time() - start)))
+        except BaseException:
+            lane.budget.release(cost)
+            raise
+
+    def release(self, lane: Lane, cost: float) -> None:
+        if self.global_budget is not None:
+            self.global_budget.release(cost)
+        lane.budget.release(cost)
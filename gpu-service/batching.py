@@ -0,0 +1,94 @@
+"""Micro-batching of small requests that arrive close together.
+
+A streaming client sends many one-sentence embeds in quick succession. Sending
+each through the compute path on its own pays admission, job bookkeeping and
+a forward pass per sentence. `MicroBatcher` holds submissions for the same key
+(for example `("embed", model)`) for a few milliseconds, runs them as one
+batch and hands each caller back its own slice of the result.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Sequence
+
+
+class MicroBatcher:
+    """Merge concurrent submissions per key into batches of at most `max_items`.
+
+    `run(key, items)` must return a sequence indexable along its first axis
+    with one entry per item. A batch runs once `max_items` are pending or
+    `window` seconds after its first submission, whichever comes first. If a
+    batch fails, every submission in it receives the exception.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Hashable, list], Awaitable[Sequence[Any]]],
+        max_items: int,
+        window: float,
+    ):
+        self.run = run
+        self.max_items = max_items
+        self.window = window
+        self._pending: dict[Hashable, list[tuple[list, asyncio.Future]]] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def pending(self, key: Hashable) -> int:
+        return sum(len(items) for items, _ in self._pending.get(key, ()))
+
+    async def submit(self, key: Hashable, items: list) -> Sequence[Any]:
+        """Queue `items` under `key` and return their results, in order."""
+        loop = asyncio.get_running_loop()
+        if self.pending(key) + len(items) > self.max_items:
+            self._flush(key)
+        fut = loop.create_future()
+        self._pending.setdefault(key, []).append((items, fut))
+        if self.pending(key) >= self.max_items:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await fut
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, key: Hashable, batch: list[tuple[list, asyncio.Future]]) -> None:
+        merged = [item for items, _ in batch for item in items]
+        try:
+            results = await self.run(key, merged)
+        except Exception as exc:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        except BaseException:
+            for _, fut in batch:
+                fut.cancel()
+            raise
+        start = 0
+        for items, fut in batch:
+            if not fut.done():
+                fut.set_result(results[start:start + len(items)])
+            start += len(items)
+
+    async def close(self) -> None:
+        """Cancel pending timers and running batches (their submitters see CancelledError)."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for batch in self._pending.values():
+            for _, fut in batch:
+                fut.cancel()
+        self._pending.clear()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
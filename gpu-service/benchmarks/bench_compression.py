@@ -0,0 +1,84 @@
+"""Benchmark: CPU cost per MB and size reduction of gzip/zstd on service payloads.
+
+Payloads are an `/embed` response (float32 vectors encoded by
+``serialization.encode_json``) and a `/bertscore` request (English-like text).
+The last column estimates the net time saved per MB on a link of ``--mbps``
+(transfer time saved minus compress and decompress time).
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_compression.py --rows 1000 --dims 384 --mbps 50
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import compression  # noqa: E402
+from compression import compress, decompress, supported_encodings  # noqa: E402
+from serialization import encode_json  # noqa: E402
+
+_WORDS = (
+    "the model returns a score for each candidate and reference pair while the agent keeps "
+    "summarizing retrieved documents into short answers with citations and follow up questions"
+).split()
+
+
+def _payloads(rows: int, dims: int, pairs: int) -> dict[str, bytes]:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rows, dims), dtype=np.float32)
+    texts = [" ".join(rng.choice(_WORDS, size=200)) for _ in range(2 * pairs)]
+    return {
+        "embed response": encode_json({"embeddings": vectors, "model": "bench", "dimensions": dims}),
+        "bertscore request": json.dumps({"candidates": texts[:pairs], "references": texts[pairs:]}).encode(),
+    }
+
+
+def _best(fn, repeat: int) -> tuple[float, bytes]:
+    best, out = float("inf"), b""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--pairs", type=int, default=100)
+    parser.add_argument("--gzip-levels", type=int, nargs="+", default=[1, 5, 9])
+    parser.add_argument("--zstd-levels", type=int, nargs="+", default=[1, 3, 9])
+    parser.add_argument("--mbps", type=float, default=50.0, help="link speed in megabits per second")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    configs = [("gzip", level) for level in args.gzip_levels]
+    if "zstd" in supported_encodings():
+        configs += [("zstd", level) for level in args.zstd_levels]
+    seconds_per_mb_on_link = 8 / args.mbps
+
+    print(f"{'payload':>18} {'MB':>6} {'codec':>7} {'ratio':>6} {'comp ms/MB':>11} {'decomp ms/MB':>13} {'net ms/MB':>10}")
+    for name, data in _payloads(args.rows, args.dims, args.pairs).items():
+        mb = len(data) / 1e6
+        for encoding, level in configs:
+            compression.GZIP_LEVEL = compression.ZSTD_LEVEL = level
+            t_comp, packed = _best(lambda: compress(data, encoding), args.repeat)
+            t_decomp, _ = _best(lambda: decompress(packed, encoding, limit=len(data)), args.repeat)
+            ratio = len(data) / len(packed)
+            saved = (1 - 1 / ratio) * seconds_per_mb_on_link
+            net = saved - (t_comp + t_decomp) / mb
+            print(
+                f"{name:>18} {mb:>6.2f} {encoding + '-' + str(level):>7} {ratio:>6.2f} "
+                f"{t_comp / mb * 1000:>11.2f} {t_decomp / mb * 1000:>13.2f} {net * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: find the best replicas x threads split for a model on this CPU host.
+
+For every split of the usable cores into R replicas of T intra-op threads
+(R x T = cores by default), the same batches run through a `CpuReplicaPool`
+and throughput is reported in items/s. Put the winning split into
+`GPU_CPU_REPLICAS` / `GPU_CPU_THREADS`. Small models usually prefer several
+narrow replicas; large models prefer fewer, wider ones.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_cpu_replicas.py --kind embed --model all-MiniLM-L6-v2 --items 1024
+    python benchmarks/bench_cpu_replicas.py --kind bertscore --model roberta-large --splits 1x8 2x4 4x2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cpu_replicas import CpuReplicaPool, allowed_cores, numa_nodes  # noqa: E402
+
+_WORDS = (
+    "the model returns a score for each candidate and reference pair while the agent keeps "
+    "summarizing retrieved documents into short answers with citations and follow up questions"
+).split()
+
+
+def _texts(n: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    return [" ".join(rng.choice(_WORDS, size=int(rng.integers(8, 64)))) for _ in range(n)]
+
+
+def _splits(cores: int, requested: list[str] | None) -> list[tuple[int, int]]:
+    if requested:
+        return [tuple(int(x) for x in split.lower().split("x")) for split in requested]
+    return [(r, cores // r) for r in range(1, cores + 1) if cores % r == 0]
+
+
+def _load(kind: str, model: str):
+    if kind == "embed":
+        from sentence_transformers import SentenceTransformer
+
+        embedder = SentenceTransformer(model, device="cpu")
+        return embedder, lambda m, batch: m.encode(batch, convert_to_numpy=True)
+
+    from bert_score import BERTScorer
+
+    scorer = BERTScorer(model_type=model, device="cpu", lang="en")
+    return scorer, lambda m, batch: m.score(batch, batch[::-1])
+
+
+async def _measure(pool: CpuReplicaPool, loaded, fn, batches: list[list[str]]) -> float:
+    # Warm every replica (thread start, weight-sharing copy, first-call allocations).
+    await asyncio.gather(*(pool.map("bench", loaded, fn, batches[:1]) for _ in range(pool.size)))
+    t0 = time.perf_counter()
+    await pool.map("bench", loaded, fn, batches)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=["embed", "bertscore"], default="embed")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--items", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--cores", type=int, default=len(allowed_cores()))
+    parser.add_argument("--splits", nargs="+", help="explicit RxT splits, e.g. 1x8 2x4 4x2")
+    parser.add_argument("--no-pin", action="store_true", help="do not pin replicas to core sets")
+    args = parser.parse_args()
+
+    loaded, fn = _load(args.kind, args.model)
+    texts = _texts(args.items)
+    batches = [texts[i:i + args.batch] for i in range(0, len(texts), args.batch)]
+    nodes = numa_nodes(allowed_cores()[:args.cores])
+    print(f"{args.kind}:{args.model} - {args.items} items in batches of {args.batch}, "
+          f"{args.cores} core(s) over {len(nodes)} NUMA node(s), torch {torch.__version__}")
+
+    print(f"{'replicas':>8} {'threads':>8} {'seconds':>8} {'items/s':>9}")
+    results = []
+    for replicas, threads in _splits(args.cores, args.splits):
+        pool = CpuReplicaPool(replicas, threads=threads, pin=not args.no_pin, nodes=nodes)
+        try:
+            seconds = asyncio.run(_measure(pool, loaded, fn, batches))
+        finally:
+            pool.close()
+        rate = args.items / seconds
+        results.append((rate, replicas, threads))
+        print(f"{replicas:>8} {threads:>8} {seconds:>8.2f} {rate:>9.1f}")
+
+    rate, replicas, threads = max(results)
+    print(f"best: GPU_CPU_REPLICAS={replicas} GPU_CPU_THREADS={threads} ({rate:.1f} items/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark: layer-truncated BERTScore model vs the full model.
+
+Loads the scorer twice: as the service does (layers above `num_layers`
+dropped, pooler removed) and untruncated (every layer kept, scores read from
+the same layer via `all_layers`). Reports resident weight size, scoring
+latency and the largest P/R/F1 difference between the two, which should be
+zero up to float noise.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_layer_truncation.py --model microsoft/deberta-xlarge-mnli
+    python benchmarks/bench_layer_truncation.py --model roberta-large --num-layers 10 --pairs 256
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from layers import default_layers, layer_report, strip_unused  # noqa: E402
+from residency import module_bytes  # noqa: E402
+
+_WORDS = (
+    "the model returns a score for each candidate and reference pair while the agent keeps "
+    "summarizing retrieved documents into short answers with citations and follow up questions"
+).split()
+
+
+def _pairs(n: int) -> tuple[list[str], list[str]]:
+    rng = np.random.default_rng(0)
+    texts = [" ".join(rng.choice(_WORDS, size=int(rng.integers(8, 48)))) for _ in range(2 * n)]
+    return texts[:n], texts[n:]
+
+
+def _time(fn, repeats: int) -> float:
+    fn()  # warm-up
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - t0) / repeats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="microsoft/deberta-xlarge-mnli")
+    parser.add_argument("--num-layers", type=int, default=None, help="scoring layer (default: bert_score's)")
+    parser.add_argument("--pairs", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    from bert_score import BERTScorer
+
+    layer = args.num_layers or default_layers(args.model)
+    if layer is None:
+        parser.error(f"bert_score has no default layer for {args.model}; pass --num-layers")
+    cands, refs = _pairs(args.pairs)
+
+    truncated = BERTScorer(model_type=args.model, num_layers=layer, device=args.device, lang="en")
+    report = layer_report(truncated, args.model, strip_unused(truncated))
+    trunc_scores = torch.stack(truncated.score(cands, refs))
+    trunc_s = _time(lambda: truncated.score(cands, refs), args.repeats)
+    trunc_mb = module_bytes(truncated._model) / 2**20
+    del truncated
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    full = BERTScorer(model_type=args.model, num_layers=layer, all_layers=True, device=args.device, lang="en")
+    full_scores = torch.stack(full.score(cands, refs))[:, layer]  # hidden state index = layer
+    full_s = _time(lambda: full.score(cands, refs), args.repeats)
+    full_mb = module_bytes(full._model) / 2**20
+
+    print(f"{args.model} on {args.device} - layer {layer} of {report['total_layers'] if report else '?'}, "
+          f"{args.pairs} pairs")
+    print(f"{'model':>10} {'weights MB':>11} {'seconds':>8}")
+    print(f"{'full':>10} {full_mb:>11.1f} {full_s:>8.3f}")
+    print(f"{'truncated':>10} {trunc_mb:>11.1f} {trunc_s:>8.3f}")
+    print(f"saved {full_mb - trunc_mb:.1f} MB ({(1 - trunc_mb / full_mb) * 100:.0f}%), "
+          f"{(1 - trunc_s / full_s) * 100:.0f}% faster")
+    print(f"max |P/R/F1 difference| vs untruncated: {float((trunc_scores - full_scores).abs().max()):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark: model load time from a cold HF cache, a warm HF cache and a local snapshot.
+
+Each measurement runs in a fresh Python process so nothing is shared through
+module caches. "cold" points HF_HOME at an empty temp directory (needs network
+access), "warm" uses the normal HF cache, and "snapshot" loads from a
+`GPU_SNAPSHOT_DIR` store that is frozen on first use. Run "snapshot" twice to
+see the page-cache-warm number.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_model_load.py --kind embed --model all-MiniLM-L6-v2
+    python benchmarks/bench_model_load.py --kind bertscore --model roberta-large --modes warm snapshot
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(HERE, "..")
+
+_CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {service_dir!r})
+import torch
+from memory import rss_bytes
+from snapshots import SnapshotStore
+from bert_score import BERTScorer
+from sentence_transformers import SentenceTransformer
+kind, model, mode, snapshot_dir, device = {kind!r}, {model!r}, {mode!r}, {snapshot_dir!r}, torch.device({device!r})
+rss0 = rss_bytes() or 0
+t0 = time.perf_counter()
+if mode == "snapshot":
+    store = SnapshotStore(snapshot_dir)
+    if kind == "embed":
+        loaded = store.load_embedder(model, SentenceTransformer, device)
+    else:
+        loaded = store.load_bertscorer(model, BERTScorer, device)
+    if loaded is None:
+        raise SystemExit("snapshot missing - the freeze step failed")
+elif kind == "embed":
+    SentenceTransformer(model, device=str(device))
+else:
+    BERTScorer(model_type=model, device=str(device), lang="en")
+print(json.dumps({{"seconds": time.perf_counter() - t0, "rss_mb": ((rss_bytes() or 0) - rss0) / 2**20}}))
+"""
+
+_FREEZE = """
+import sys
+sys.path.insert(0, {service_dir!r})
+from snapshots import SnapshotStore
+from bert_score import BERTScorer
+from sentence_transformers import SentenceTransformer
+store = SnapshotStore({snapshot_dir!r})
+if {kind!r} == "embed":
+    store.freeze_embedder({model!r}, SentenceTransformer({model!r}, device="cpu"))
+else:
+    store.freeze_bertscorer({model!r}, BERTScorer(model_type={model!r}, device="cpu", lang="en"))
+"""
+
+
+def _run(code: str, env: dict) -> dict:
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=["embed", "bertscore"], default="embed")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--modes", nargs="+", default=["cold", "warm", "snapshot", "snapshot"],
+                        choices=["cold", "warm", "snapshot"])
+    parser.add_argument("--snapshot-dir", default=os.path.join(tempfile.gettempdir(), "gpu-bridge-snapshots"))
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    fmt = dict(service_dir=SERVICE_DIR, kind=args.kind, model=args.model, snapshot_dir=args.snapshot_dir)
+    if "snapshot" in args.modes:
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", _FREEZE.format(**fmt)], check=True, capture_output=True)
+        print(f"froze {args.kind}:{args.model} into {args.snapshot_dir} ({time.perf_counter() - t0:.1f}s incl. load)")
+
+    print(f"{'mode':>9} {'load s':>8} {'RSS +MB':>9}")
+    for mode in args.modes:
+        env = dict(os.environ)
+        tmp = None
+        if mode == "cold":
+            tmp = tempfile.TemporaryDirectory()
+            env["HF_HOME"] = tmp.name
+        elif mode == "snapshot":
+            env["HF_HUB_OFFLINE"] = env["TRANSFORMERS_OFFLINE"] = "1"
+        try:
+            result = _run(_CHILD.format(mode=mode, device=args.device, **fmt), env)
+        finally:
+            if tmp is not None:
+                tmp.cleanup()
+        print(f"{mode:>9} {result['seconds']:>8.2f} {result['rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark: /embed response serialization time per MB.
+
+Compares the legacy path (``tolist()`` + ``EmbedResponse`` validation +
+FastAPI's JSON encoding) against ``serialization.encode_json``.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_serialization.py --rows 100 1000 10000 --dims 384 1024
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from models import EmbedResponse  # noqa: E402
+from serialization import encode_json, orjson  # noqa: E402
+
+
+def _legacy(arr: np.ndarray) -> bytes:
+    resp = EmbedResponse(embeddings=arr.tolist(), model="bench", dimensions=arr.shape[1])
+    # FastAPI re-validates the returned model against response_model, then encodes it.
+    resp = EmbedResponse.model_validate(resp.model_dump())
+    return json.dumps(jsonable_encoder(resp), separators=(",", ":")).encode("utf-8")
+
+
+def _fast(arr: np.ndarray) -> bytes:
+    return encode_json({"embeddings": arr, "model": "bench", "dimensions": arr.shape[1]})
+
+
+def _time(fn, arr: np.ndarray, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn(arr)
+        best = min(best, time.perf_counter() - t0)
+        size = len(body)
+    return best, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--dims", type=int, nargs="+", default=[384, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"encoder: {'orjson ' + orjson.__version__ if orjson else 'stdlib json'}")
+    print(f"{'rows':>7} {'dims':>5} {'MB':>8} {'legacy ms':>10} {'fast ms':>9} {'legacy ms/MB':>13} {'fast ms/MB':>11} {'speedup':>8}")
+    for rows in args.rows:
+        for dims in args.dims:
+            arr = rng.standard_normal((rows, dims), dtype=np.float32)
+            legacy_s, legacy_size = _time(_legacy, arr, args.repeat)
+            fast_s, _ = _time(_fast, arr, args.repeat)
+            mb = legacy_size / 1024 / 1024
+            print(
+                f"{rows:>7} {dims:>5} {mb:>8.2f} {legacy_s * 1000:>10.1f} {fast_s * 1000:>9.1f} "
+                f"{legacy_s * 1000 / mb:>13.1f} {fast_s * 1000 / mb:>11.1f} {legacy_s / fast_s:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
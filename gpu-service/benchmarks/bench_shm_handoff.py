@@ -0,0 +1,72 @@
+"""Benchmark: `/embed` result handoff as JSON vs a shared-memory segment.
+
+Times both ends of each path for a (rows, dims) float32 result, without the
+model: JSON encode on the service plus parse into an array on the client, vs
+writing the `.npy` segment plus mapping and copying it out on the client.
+The HTTP round trip of the body (JSON only) comes on top.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_shm_handoff.py
+    python benchmarks/bench_shm_handoff.py --rows 1000 10000 100000 --dims 1024
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from serialization import encode_json  # noqa: E402
+from shared_results import SHM_DIR, SharedResultStore  # noqa: E402
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _time(fn, repeats: int) -> float:
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--dims", type=int, default=768)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    loads = orjson.loads if orjson is not None else json.loads
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(SHM_DIR) if os.path.isdir("/dev/shm") else None) as root:
+        store = SharedResultStore(root, ttl=60, budget_bytes=2**34)
+        print(f"segments under {root}, dims={args.dims}")
+        print(f"{'rows':>8} {'MB':>8} {'json ms':>9} {'shm ms':>8} {'speedup':>8}")
+        for rows in args.rows:
+            vectors = np.random.default_rng(0).standard_normal((rows, args.dims), dtype=np.float32)
+
+            def via_json() -> np.ndarray:
+                return np.asarray(loads(encode_json({"embeddings": vectors}))["embeddings"], dtype=np.float32)
+
+            def via_shm() -> np.ndarray:
+                lease = store.put(vectors)
+                out = np.fromfile(lease["path"], dtype=lease["dtype"], offset=lease["offset"])
+                store.release(lease["handle"])
+                return out.reshape(lease["shape"])
+
+            json_s = _time(via_json, args.repeats)
+            shm_s = _time(via_shm, args.repeats)
+            print(f"{rows:>8} {vectors.nbytes / 2**20:>8.1f} {json_s * 1e3:>9.1f} {shm_s * 1e3:>8.1f} "
+                  f"{json_s / shm_s:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark: BERTScore with and without the token-embedding cache on a repeat-heavy loop.
+
+Simulates an evaluation loop: a fixed set of references scored over and over
+against candidates drawn from a pool where `--repeat` of them were seen
+before. Reports pairs/s for plain `BERTScorer.score`, the cache in float16
+and float32, and the largest F1 difference from the uncached scores.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_token_cache.py --model roberta-large
+    python benchmarks/bench_token_cache.py --model microsoft/deberta-xlarge-mnli --rounds 20 --repeat 0.9
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from token_cache import TokenEmbeddingCache  # noqa: E402
+
+_WORDS = (
+    "the model returns a score for each candidate and reference pair while the agent keeps "
+    "summarizing retrieved documents into short answers with citations and follow up questions"
+).split()
+
+
+def _sentence(rng) -> str:
+    return " ".join(rng.choice(_WORDS, size=int(rng.integers(8, 40))))
+
+
+def _rounds(n_rounds: int, pairs: int, repeat: float) -> list[tuple[list[str], list[str]]]:
+    rng = np.random.default_rng(0)
+    refs = [_sentence(rng) for _ in range(pairs)]
+    seen = [_sentence(rng) for _ in range(pairs)]
+    rounds = []
+    for _ in range(n_rounds):
+        cands = [seen[i] if rng.random() < repeat else _sentence(rng) for i in range(pairs)]
+        rounds.append((cands, refs))
+    return rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="roberta-large")
+    parser.add_argument("--num-layers", type=int, default=None)
+    parser.add_argument("--pairs", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--repeat", type=float, default=0.8, help="share of candidates seen in earlier rounds")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    from bert_score import BERTScorer
+
+    scorer = BERTScorer(model_type=args.model, num_layers=args.num_layers, device=args.device, lang="en")
+    rounds = _rounds(args.rounds, args.pairs, args.repeat)
+    total = args.rounds * args.pairs
+    print(f"{args.model} on {args.device} - {args.rounds} rounds x {args.pairs} pairs, repeat={args.repeat}")
+
+    t0 = time.perf_counter()
+    plain = [scorer.score(c, r)[2] for c, r in rounds]
+    base = time.perf_counter() - t0
+    print(f"{'mode':>10} {'seconds':>8} {'pairs/s':>9} {'speedup':>8} {'max |dF1|':>10}")
+    print(f"{'uncached':>10} {base:>8.2f} {total / base:>9.1f} {1.0:>8.1f} {0.0:>10.2e}")
+
+    for name, dtype in (("float16", torch.float16), ("float32", torch.float32)):
+        cache = TokenEmbeddingCache(2**30, dtype)
+        t0 = time.perf_counter()
+        cached = [cache.score(scorer, args.model, c, r)[2] for c, r in rounds]
+        seconds = time.perf_counter() - t0
+        diff = max(float((a - b).abs().max()) for a, b in zip(cached, plain))
+        print(f"{name:>10} {seconds:>8.2f} {total / seconds:>9.1f} {base / seconds:>8.1f} {diff:>10.2e}")
+        print(f"{'':>10} hit ratio {cache.status()['hit_ratio']:.2f}, {cache.bytes / 2**20:.1f} MB cached")
+
+
+if __name__ == "__main__":
+    main()
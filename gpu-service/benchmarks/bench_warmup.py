@@ -0,0 +1,84 @@
+"""Benchmark: first-request latency after a model load, without and with warmup.
+
+Each measurement runs in a fresh Python process, because kernel selection,
+autotuning results and the allocator pool are per process. "cold" loads the
+model and immediately times one request. "warm" runs `warm_model` over the
+warmup grid first, then times the same request. The request shape should be
+one the grid covers (or is covered by, for the allocator). A steady-state
+line, the same request repeated in the warm process, shows the floor.
+
+Usage (from the gpu-service directory):
+    python benchmarks/bench_warmup.py --kind embed --model all-MiniLM-L6-v2 --device cuda
+    python benchmarks/bench_warmup.py --kind bertscore --model roberta-large --batch-size 8 --tokens 128
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(HERE, "..")
+
+_CHILD = """
+import json, sys, time
+sys.path.insert(0, {service_dir!r})
+import torch
+from warmup import synthetic_texts, warm_model, warmup_grid
+from bert_score import BERTScorer
+from sentence_transformers import SentenceTransformer
+kind, model, mode, device = {kind!r}, {model!r}, {mode!r}, torch.device({device!r})
+if kind == "embed":
+    loaded = SentenceTransformer(model, device=str(device))
+else:
+    loaded = BERTScorer(model_type=model, device=str(device), lang="en")
+warmup_s = 0.0
+if mode == "warm":
+    report = warm_model(kind, loaded, device, warmup_grid({batch_sizes!r}, {seq_tokens!r}))
+    warmup_s = report["seconds"]
+# Different words than the warmup batches, so nothing downstream can be a cache hit.
+texts = [" ".join(reversed(text.split())) for text in synthetic_texts({batch_size}, {tokens})]
+
+def request():
+    t0 = time.perf_counter()
+    if kind == "embed":
+        loaded.encode(texts, batch_size=len(texts), show_progress_bar=False)
+    else:
+        loaded.score(texts, texts[::-1], batch_size=len(texts))
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - t0) * 1000
+
+first_ms = request()
+steady_ms = sorted(request() for _ in range(5))[2]
+print(json.dumps({{"warmup_s": warmup_s, "first_ms": first_ms, "steady_ms": steady_ms}}))
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=["embed", "bertscore"], default="embed")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=32, help="shape of the timed first request")
+    parser.add_argument("--tokens", type=int, default=128)
+    parser.add_argument("--grid-batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--grid-seq-tokens", type=int, nargs="+", default=[16, 128, 512])
+    args = parser.parse_args()
+
+    print(f"{args.kind}:{args.model} on {args.device}, first request {args.batch_size} x {args.tokens} tokens")
+    print(f"{'mode':>5} {'warmup s':>9} {'first ms':>9} {'steady ms':>10}")
+    for mode in ("cold", "warm"):
+        code = _CHILD.format(
+            service_dir=SERVICE_DIR, kind=args.kind, model=args.model, mode=mode, device=args.device,
+            batch_sizes=args.grid_batch_sizes, seq_tokens=args.grid_seq_tokens,
+            batch_size=args.batch_size, tokens=args.tokens,
+        )
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{mode:>5} {result['warmup_s']:>9.2f} {result['first_ms']:>9.1f} {result['steady_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
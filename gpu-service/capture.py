@@ -0,0 +1,215 @@
+"""Sampled capture of live `/embed` and `/bertscore` traffic for replay.
+
+Synthetic benchmarks miss the real mix of text lengths, batch sizes, models
+and arrival bursts. With `GPU_CAPTURE_FILE` set, `CaptureMiddleware` appends
+a `GPU_CAPTURE_SAMPLE` fraction of requests to a gzipped JSON Lines trace.
+Each line holds the arrival time, path, request body, `X-Deadline-Ms`,
+response status and server-side duration. `replay.py` re-fires the trace.
+
+`GPU_CAPTURE_TEXTS` controls what is kept of the texts:
+
+- `full`: the texts as sent.
+- `hash` (default): a keyed hash and the length of each text. Repeats stay
+  recognizable, so replay reproduces deduplication and cache hits. The key
+  is `GPU_CAPTURE_SALT`, or random per process, so hashes cannot be matched
+  against guessed texts.
+- `redact`: only the length of each text.
+
+Records go through a queue to a writer thread, so the event loop only pays
+for a body copy. The trace is flushed every `FLUSH_SECONDS`, so it stays
+readable while the service is running.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from serialization import encode_json
+
+logger = logging.getLogger("gpu-service")
+
+CAPTURE_FILE = os.environ.get("GPU_CAPTURE_FILE", "")
+CAPTURE_SAMPLE = float(os.environ.get("GPU_CAPTURE_SAMPLE", "1.0"))
+CAPTURE_TEXTS = os.environ.get("GPU_CAPTURE_TEXTS", "hash").lower()
+CAPTURE_SALT = os.environ.get("GPU_CAPTURE_SALT", "")
+
+TEXT_MODES = ("full", "hash", "redact")
+# Request fields holding texts, per captured path; everything else is kept as sent.
+TEXT_FIELDS = {"/embed": ("texts",), "/bertscore": ("candidates", "references")}
+DEADLINE_HEADER = b"x-deadline-ms"
+FLUSH_SECONDS = 1.0
+
+
+def scrub_texts(value: Any, mode: str, salt: bytes) -> Any:
+    """Replace every string in `value` (a text or nested lists of texts) according to `mode`."""
+    if isinstance(value, str):
+        if mode == "full":
+            return value
+        if mode == "hash":
+            digest = hmac.new(salt, value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+            return {"sha": digest, "len": len(value)}
+        return {"len": len(value)}
+    if isinstance(value, list):
+        return [scrub_texts(item, mode, salt) for item in value]
+    return value
+
+
+class TrafficCapture:
+    """Samples requests and appends them to a gzipped JSONL trace from a writer thread."""
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        sample: float = CAPTURE_SAMPLE,
+        texts: str = CAPTURE_TEXTS,
+        salt: str = CAPTURE_SALT,
+        seed: int | None = None,
+    ):
+        if texts not in TEXT_MODES:
+            raise ValueError(f"GPU_CAPTURE_TEXTS must be one of {', '.join(TEXT_MODES)}, got {texts!r}")
+        self.path = path
+        self.sample = sample
+        self.texts = texts
+        self.salt = salt.encode("utf-8") if salt else os.urandom(16)
+        self.paths = frozenset(TEXT_FIELDS)
+        self.captured = 0
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._file = gzip.open(path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "TrafficCapture | None":
+        if not CAPTURE_FILE or CAPTURE_SAMPLE <= 0:
+            return None
+        capture = cls(CAPTURE_FILE)
+        logger.info(
+            f"[capture] recording {capture.sample:.0%} of {', '.join(sorted(capture.paths))} "
+            f"to {CAPTURE_FILE} (texts: {capture.texts})"
+        )
+        return capture
+
+    def sampled(self) -> bool:
+        return self.sample >= 1.0 or self._random.random() < self.sample
+
+    def record(self, path: str, arrived: float, body: bytes, status: int, seconds: float, deadline: str | None) -> None:
+        self._queue.put((path, arrived, body, status, seconds, deadline))
+
+    def _encode(self, path: str, arrived: float, body: bytes, status: int, seconds: float, deadline: str | None):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None  # not JSON, so nothing a replay could send
+        if not isinstance(payload, dict):
+            return None
+        for field in TEXT_FIELDS[path]:
+            if field in payload:
+                payload[field] = scrub_texts(payload[field], self.texts, self.salt)
+        entry = {"t": round(arrived, 4), "path": path, "status": status, "ms": round(seconds * 1000, 2), "body": payload}
+        if deadline is not None:
+            entry["deadline_ms"] = deadline
+        return encode_json(entry) + b"\n"
+
+    def _write_loop(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_SECONDS)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                try:
+                    line = self._encode(*item)
+                except Exception as exc:  # one bad record must not stop the capture
+                    logger.warning(f"[capture] dropped a record: {exc}")
+                    line = None
+                if line is None:
+                    self.dropped += 1
+                else:
+                    self._file.write(line)
+                    self.captured += 1
+            if time.monotonic() - last_flush >= FLUSH_SECONDS:
+                self._file.flush()
+                last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_trace(path: str | os.PathLike) -> list[dict]:
+    """All complete records of a trace; a tail cut off by a crash is ignored."""
+    records = []
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                if line.endswith(b"\n"):
+                    records.append(json.loads(line))
+        except (EOFError, gzip.BadGzipFile):
+            pass
+    return records
+
+
+class CaptureMiddleware:
+    """ASGI middleware: hand sampled `/embed` and `/bertscore` requests to `app.state.capture`.
+
+    Runs inside `CompressionMiddleware`, so it sees decoded bodies. A no-op
+    when capture is off.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        capture = getattr(scope["app"].state, "capture", None) if "app" in scope else None
+        if (
+            capture is None
+            or scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in capture.paths
+            or not capture.sampled()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        t0 = time.perf_counter()
+        chunks: list[bytes] = []
+        status = 500
+
+        async def tee_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def status_send(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, tee_receive, status_send)
+        finally:
+            if status != 401:  # unauthenticated traffic is not part of the workload
+                deadline = dict(scope["headers"]).get(DEADLINE_HEADER)
+                capture.record(
+                    scope["path"], arrived, b"".join(chunks), status, time.perf_counter() - t0,
+                    deadline.decode("latin-1") if deadline is not None else None,
+                )
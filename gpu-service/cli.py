@@ -0,0 +1,310 @@
+"""Offline bulk embedding and BERTScore over JSONL or Parquet files.
+
+Corpus backfills run here instead of through thousands of HTTP calls: the
+models are loaded with the service's own loaders (snapshots included), embeds
+go through the same tokenize/forward/copy pipeline, and input is streamed
+block by block. Results are written into a memory-mapped `.npy` file. A
+`<out>.ckpt.json` file records how many rows are done, so a killed run picks
+up where its last checkpoint left off.
+
+Usage (from the gpu-service directory):
+    python gpu_service.py embed-file corpus.jsonl --out vectors.npy
+    python gpu_service.py bertscore-file pairs.parquet --out scores.npy \\
+        --candidate-field candidate --reference-field reference
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import numpy as np
+import torch
+
+from dedup import dedupe
+from layers import bertscore_key
+from pipeline import embed_stages, run_pipeline
+
+CHECKPOINT_SUFFIX = ".ckpt.json"
+
+
+class InputError(Exception):
+    """The input file cannot be read as requested."""
+
+
+def _is_parquet(path: Path) -> bool:
+    return path.suffix.lower() in (".parquet", ".pq")
+
+
+def _parquet_file(path: Path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise InputError("Parquet input needs pyarrow (pip install pyarrow)") from exc
+    return pq.ParquetFile(path)
+
+
+def count_rows(path: Path) -> int:
+    """Number of input rows (non-blank lines for JSONL, row count from metadata for Parquet)."""
+    if _is_parquet(path):
+        return _parquet_file(path).metadata.num_rows
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def iter_rows(path: Path, fields: Sequence[str], skip: int = 0) -> Iterator[tuple[str, ...]]:
+    """Stream `fields` of each row, after skipping the first `skip` rows.
+
+    A JSONL line may also be a bare JSON string when a single field is read.
+    """
+    seen = 0
+    if _is_parquet(path):
+        for batch in _parquet_file(path).iter_batches(columns=list(fields)):
+            columns = [batch.column(name).to_pylist() for name in fields]
+            for row in zip(*columns):
+                seen += 1
+                if seen > skip:
+                    yield row
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            seen += 1
+            if seen <= skip:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str) and len(fields) == 1:
+                yield (record,)
+                continue
+            try:
+                yield tuple(str(record[name]) for name in fields)
+            except (KeyError, TypeError) as exc:
+                raise InputError(f"{path}:{lineno}: missing field {exc}") from exc
+
+
+def _blocks(rows: Iterator[tuple], size: int) -> Iterator[list[tuple]]:
+    block: list[tuple] = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class Checkpoint:
+    """Progress file next to the output; it exists only while a run is incomplete."""
+
+    def __init__(self, out: Path, params: dict):
+        self.path = out.with_name(out.name + CHECKPOINT_SUFFIX)
+        self.params = params
+
+    def load(self) -> int | None:
+        """Rows already done by an earlier run with the same parameters, or None."""
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("params") != self.params:
+            raise InputError(
+                f"{self.path} belongs to a run with different parameters "
+                f"({data.get('params')}); use --overwrite to start over"
+            )
+        return int(data["done"])
+
+    def save(self, done: int) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"params": self.params, "done": done, "updated_at": time.time()}))
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class Progress:
+    """Prints rows done, throughput and ETA to stderr at most every `interval` seconds."""
+
+    def __init__(self, total: int, done: int, interval: float = 2.0):
+        self.total = total
+        self.start_done = done
+        self.t0 = time.perf_counter()
+        self.interval = interval
+        self._last = 0.0
+
+    def rate(self, done: int) -> float:
+        return (done - self.start_done) / max(time.perf_counter() - self.t0, 1e-9)
+
+    def update(self, done: int, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rate = self.rate(done)
+        eta = (self.total - done) / rate if rate > 0 else float("inf")
+        print(
+            f"{done}/{self.total} rows ({done / max(self.total, 1) * 100:.1f}%) - "
+            f"{rate:.1f} rows/s - ETA {eta:.0f}s",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def _reopen_output(out: Path, rows: int) -> np.memmap:
+    mm = np.lib.format.open_memmap(out, mode="r+")
+    if mm.shape[0] != rows:
+        raise InputError(f"{out} has {mm.shape[0]} rows, expected {rows}; use --overwrite to start over")
+    return mm
+
+
+def _prepare(args: argparse.Namespace, kind: str, fields: Sequence[str]) -> tuple[int, Checkpoint, int | None]:
+    total = count_rows(args.input)
+    params = {"kind": kind, "input": str(args.input.resolve()), "rows": total, "model": args.model, "fields": list(fields)}
+    if getattr(args, "num_layers", None) is not None:
+        params["num_layers"] = args.num_layers
+    ckpt = Checkpoint(args.out, params)
+    if args.overwrite:
+        ckpt.clear()
+        done = None
+    else:
+        done = ckpt.load()
+        if done is None and args.out.exists():
+            raise InputError(f"{args.out} already exists and has no checkpoint; use --overwrite to replace it")
+    return total, ckpt, done
+
+
+def _service_state(args: argparse.Namespace):
+    """Build service state (device, loaders, snapshot store) without starting the HTTP app."""
+    from fastapi import FastAPI
+
+    import gpu_service
+    from device import get_device
+    from snapshots import apply_offline_mode
+
+    apply_offline_mode()
+    from bert_score import BERTScorer
+    from sentence_transformers import SentenceTransformer
+
+    device = torch.device(args.device) if args.device else get_device()
+    app = FastAPI()
+    gpu_service._init_state(app, device, BERTScorer, SentenceTransformer)
+    return gpu_service, app
+
+
+async def _embed_block(texts: list[str], stages, batch_size: int) -> np.ndarray:
+    unique, inverse = dedupe(texts)
+    chunks = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+    vectors = await run_pipeline(chunks, stages)
+    return np.concatenate(vectors, axis=0)[inverse]
+
+
+def _score_block(scorer, pairs: list[tuple[str, str]], batch_size: int) -> np.ndarray:
+    unique, inverse = dedupe(pairs)
+    parts = []
+    for start in range(0, len(unique), batch_size):
+        chunk = unique[start:start + batch_size]
+        P, R, F1 = scorer.score([c for c, _ in chunk], [r for _, r in chunk])
+        parts.append(torch.stack([P, R, F1]).cpu().numpy())
+    return np.concatenate(parts, axis=1)[:, inverse].T
+
+
+async def _run(args: argparse.Namespace, kind: str) -> int:
+    fields = [args.field] if kind == "embed" else [args.candidate_field, args.reference_field]
+    total, ckpt, done = _prepare(args, kind, fields)
+    resume = done is not None
+    done = done or 0
+    if resume:
+        print(f"resuming {args.out} at row {done}/{total}", file=sys.stderr)
+
+    service, app = _service_state(args)
+    if kind == "embed":
+        model = args.model or service.DEFAULT_EMBED_MODEL
+        stages = embed_stages(service._load_embedder(app, model), app.state.device)
+    else:
+        model = bertscore_key(args.model or service.DEFAULT_BERTSCORE_MODEL, args.num_layers)
+        scorer = service._load_bertscorer(app, model)
+
+    # The output is created once the first block shows the embedding width.
+    out = _reopen_output(args.out, total) if resume else None
+    progress = Progress(total, done, interval=args.log_every)
+    last_ckpt = done
+    try:
+        for block in _blocks(iter_rows(args.input, fields, skip=done), args.block_size):
+            if kind == "embed":
+                result = await _embed_block([row[0] for row in block], stages, args.batch_size)
+            else:
+                result = await asyncio.to_thread(_score_block, scorer, block, args.batch_size)
+            if out is None:
+                out = np.lib.format.open_memmap(args.out, mode="w+", dtype=np.float32, shape=(total, result.shape[1]))
+                ckpt.save(0)  # so a run stopped before its first checkpoint can still be resumed
+            out[done:done + len(block)] = result
+            done += len(block)
+            if done - last_ckpt >= args.checkpoint_rows:
+                out.flush()
+                ckpt.save(done)
+                last_ckpt = done
+            progress.update(done)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # asyncio.run turns Ctrl-C into cancelling this task; save progress and exit like SIGINT would.
+        if out is not None:
+            out.flush()
+            ckpt.save(done)
+        print(f"interrupted at row {done}/{total}; rerun the same command to resume", file=sys.stderr)
+        return 130
+
+    if out is None:  # empty input
+        out = np.lib.format.open_memmap(args.out, mode="w+", dtype=np.float32, shape=(0, 0 if kind == "embed" else 3))
+    out.flush()
+    ckpt.clear()
+    progress.update(done, force=True)
+    print(f"wrote {args.out} {tuple(out.shape)} ({progress.rate(done):.1f} rows/s)", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="gpu_service.py", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p: argparse.ArgumentParser, batch_env: str, batch_default: str) -> None:
+        p.add_argument("input", type=Path, help="JSONL or Parquet (.parquet) input file")
+        p.add_argument("--out", type=Path, required=True, help="output .npy file (float32, memory-mapped)")
+        p.add_argument("--model", default=None, help="model name (default: the service's default model)")
+        p.add_argument("--device", default=None, help="torch device (default: auto-detect like the service)")
+        p.add_argument("--batch-size", type=int, default=int(os.environ.get(batch_env, batch_default)))
+        p.add_argument("--block-size", type=int, default=4096, help="rows read and written per block")
+        p.add_argument("--checkpoint-rows", type=int, default=10_000, help="checkpoint at least this often")
+        p.add_argument("--log-every", type=float, default=2.0, help="seconds between progress lines")
+        p.add_argument("--overwrite", action="store_true", help="discard existing output and checkpoint")
+
+    embed = sub.add_parser("embed-file", help="embed one text per row into an (N, dims) array")
+    common(embed, "GPU_EMBED_BATCH", "32")
+    embed.add_argument("--field", default="text", help="JSONL key / Parquet column holding the text")
+
+    score = sub.add_parser("bertscore-file", help="score candidate/reference pairs into an (N, 3) P/R/F1 array")
+    common(score, "GPU_BERTSCORE_BATCH", "16")
+    score.add_argument("--candidate-field", default="candidate")
+    score.add_argument("--reference-field", default="reference")
+    score.add_argument("--num-layers", type=int, default=None, help="scoring layer (default: bert_score's per-model layer)")
+    return parser
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    kind = "embed" if args.command == "embed-file" else "bertscore"
+    try:
+        return asyncio.run(_run(args, kind))
+    except InputError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
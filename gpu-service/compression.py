@@ -0,0 +1,225 @@
+"""gzip/zstd compression of request and response bodies.
+
+The GPU host often sits across a slow link from its callers, where moving a
+200-pair BERTScore request or a large `/embed` response takes longer than
+computing it. `CompressionMiddleware` decodes `Content-Encoding: gzip|zstd`
+request bodies and compresses responses with the best encoding the caller
+lists in `Accept-Encoding`. Small replies (health, status) are sent as-is,
+and so are Server-Sent Events streams, which must reach the client as each
+event is written.
+"""
+
+import asyncio
+import gzip
+import io
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from serialization import SERIALIZE_THREAD_BYTES
+
+try:  # Optional; without it only gzip is offered and accepted.
+    import zstandard
+except ImportError:  # pragma: no cover - exercised only when zstandard is missing
+    zstandard = None
+
+COMPRESSION_ENABLED = os.environ.get("GPU_COMPRESSION", "1").lower() not in ("0", "false", "no")
+# Responses smaller than this are not worth the CPU time or the extra headers.
+MIN_COMPRESS_BYTES = int(os.environ.get("GPU_COMPRESS_MIN_BYTES", "1024"))
+# Higher levels barely shrink float JSON further but cost several times the CPU (see benchmarks/bench_compression.py).
+GZIP_LEVEL = int(os.environ.get("GPU_GZIP_LEVEL", "1"))
+ZSTD_LEVEL = int(os.environ.get("GPU_ZSTD_LEVEL", "3"))
+# Upper bound on a decompressed request body, so a small compressed payload cannot expand without limit.
+MAX_REQUEST_BYTES = int(os.environ.get("GPU_MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+
+
+class BodyTooLarge(Exception):
+    """The decompressed request body exceeds the configured limit."""
+
+
+class UnsupportedEncoding(ValueError):
+    """The request's `Content-Encoding` is not one this build can decode."""
+
+
+_DECODE_ERRORS: tuple[type[Exception], ...] = (ValueError, OSError, zlib.error)
+if zstandard is not None:
+    _DECODE_ERRORS += (zstandard.ZstdError,)
+
+
+def supported_encodings() -> list[str]:
+    """Encodings this build can produce, in order of preference."""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    raise UnsupportedEncoding(f"unsupported encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str, limit: int = MAX_REQUEST_BYTES) -> bytes:
+    """Decode `data`, raising `BodyTooLarge` as soon as the output exceeds `limit` bytes."""
+    if encoding == "gzip":
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = decoder.decompress(data, limit + 1)
+        if len(out) > limit or decoder.unconsumed_tail:
+            raise BodyTooLarge(f"decompressed body exceeds {limit} bytes")
+        if not decoder.eof:
+            raise ValueError("truncated gzip body")
+        return out
+    if encoding == "zstd" and zstandard is not None:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            out = reader.read(limit + 1)
+        if len(out) > limit:
+            raise BodyTooLarge(f"decompressed body exceeds {limit} bytes")
+        return out
+    raise UnsupportedEncoding(f"unsupported encoding: {encoding}")
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Pick the preferred supported encoding the client accepts (q=0 excludes one)."""
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI middleware: decode compressed request bodies, compress large responses."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = MIN_COMPRESS_BYTES,
+        max_request_bytes: int = MAX_REQUEST_BYTES,
+        enabled: bool = COMPRESSION_ENABLED,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.max_request_bytes = max_request_bytes
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        if encoding != "identity":
+            try:
+                scope, receive = await self._decoded_request(scope, receive, encoding)
+            except BodyTooLarge as exc:
+                await PlainTextResponse(str(exc), status_code=413)(scope, receive, send)
+                return
+            except _DECODE_ERRORS as exc:
+                status = 415 if isinstance(exc, UnsupportedEncoding) else 400
+                await PlainTextResponse(f"Cannot decode request body: {exc}", status_code=status)(scope, receive, send)
+                return
+
+        response_encoding = negotiate(headers.get("accept-encoding", "")) if self.enabled else None
+        if response_encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, response_encoding, self.minimum_size))
+
+    async def _decoded_request(self, scope: Scope, receive: Receive, encoding: str) -> tuple[Scope, Receive]:
+        chunks = []
+        more = True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            more = message.get("more_body", False)
+        raw = b"".join(chunks)
+        if len(raw) > SERIALIZE_THREAD_BYTES:
+            body = await asyncio.to_thread(decompress, raw, encoding, self.max_request_bytes)
+        else:
+            body = decompress(raw, encoding, self.max_request_bytes)
+
+        new_headers = MutableHeaders(scope=dict(scope))
+        del new_headers["content-encoding"]
+        new_headers["content-length"] = str(len(body))
+        scope = {**scope, "headers": new_headers.raw}
+
+        sent = False
+
+        async def decoded_receive() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return scope, decoded_receive
+
+
+class _CompressingSend:
+    """Wraps `send`: buffers a single-message response body and compresses it if large enough."""
+
+    def __init__(self, send: Send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Message | None = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith(("text/event-stream", "application/zip"))
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        start, self.start = self.start, None
+        if start is None:  # later chunks of a streamed body we decided not to compress
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        if message.get("more_body", False) or len(body) < self.minimum_size:
+            # Streaming bodies pass through unchanged; only the service's single-shot JSON replies are compressed.
+            self.passthrough = True
+            await self.send(start)
+            await self.send(message)
+            return
+
+        if len(body) > SERIALIZE_THREAD_BYTES:
+            compressed = await asyncio.to_thread(compress, body, self.encoding)
+        else:
+            compressed = compress(body, self.encoding)
+        headers = MutableHeaders(raw=list(start["headers"]))
+        headers["content-encoding"] = self.encoding
+        headers["content-length"] = str(len(compressed))
+        headers.add_vary_header("Accept-Encoding")
+        await self.send({**start, "headers": headers.raw})
+        await self.send({"type": "http.response.body", "body": compressed})
@@ -0,0 +1,278 @@
+"""CPU execution mode: explicit thread settings, core pinning and model replicas.
+
+On a CPU-only host every request used to run through `asyncio.to_thread` into
+one shared intra-op pool at torch's default size. Concurrent requests then
+fight over the same cores and throughput swings with load. `CpuReplicaPool`
+runs N replicas instead. Each replica is one worker thread pinned to its own
+set of cores (split per NUMA node where the host has several), with its own
+intra-op thread count. Replicas share the model weights and each keeps a
+private copy of the rest (tokenizer state), so N replicas cost little more
+memory than one. A dispatcher sends each batch to the least-busy replica.
+"""
+
+import asyncio
+import copy
+import glob
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Sequence
+
+import torch
+
+from pipeline import PipelineStats
+from residency import torch_module
+
+logger = logging.getLogger("gpu-service")
+
+CPU_REPLICAS = int(os.environ.get("GPU_CPU_REPLICAS", "1"))
+# Intra-op threads per replica (or for the whole process with one replica); 0 = cores / replicas.
+CPU_THREADS = int(os.environ.get("GPU_CPU_THREADS", "0"))
+# Inter-op threads for the process; 0 keeps torch's default.
+CPU_INTEROP_THREADS = int(os.environ.get("GPU_CPU_INTEROP_THREADS", "0"))
+CPU_PIN = os.environ.get("GPU_CPU_PIN", "1").lower() not in ("0", "false", "no")
+
+
+def parse_cpulist(text: str) -> list[int]:
+    """Parse a kernel cpulist such as `0-3,8,10-11`."""
+    cores: list[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cores.extend(range(int(lo), int(hi or lo) + 1))
+    return cores
+
+
+def allowed_cores() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cores: Sequence[int] | None = None) -> list[list[int]]:
+    """Usable cores grouped by NUMA node (one group when the topology is unknown)."""
+    usable = set(cores if cores is not None else allowed_cores())
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        try:
+            with open(path) as f:
+                node = [c for c in parse_cpulist(f.read()) if c in usable]
+        except (OSError, ValueError):
+            continue
+        if node:
+            nodes.append(node)
+    return nodes or [sorted(usable)]
+
+
+def core_sets(replicas: int, nodes: Sequence[Sequence[int]]) -> list[list[int]]:
+    """Split cores into `replicas` disjoint sets, keeping each set inside one NUMA node.
+
+    Replicas are dealt round-robin across nodes and each node's cores are
+    divided evenly among its replicas. With more replicas than cores, sets
+    necessarily overlap (each replica still gets one core).
+    """
+    per_node: list[list[int]] = [[] for _ in nodes]
+    for i in range(replicas):
+        per_node[i % len(nodes)].append(i)
+    sets: list[list[int]] = [[] for _ in range(replicas)]
+    for node, members in zip(nodes, per_node):
+        if not members:
+            continue
+        size = max(1, len(node) // len(members))
+        for j, replica in enumerate(members):
+            start = (j * size) % len(node)
+            sets[replica] = list(node[start:start + size])
+    return sets
+
+
+def configure_threads(intra: int = CPU_THREADS, inter: int = CPU_INTEROP_THREADS) -> None:
+    """Apply process-wide intra-/inter-op thread settings (call before the first model runs)."""
+    if intra > 0:
+        torch.set_num_threads(intra)
+    if inter > 0:
+        try:
+            torch.set_num_interop_threads(inter)
+        except RuntimeError as exc:  # only allowed before any inter-op work has started
+            logger.warning(f"[cpu] could not set inter-op threads to {inter}: {exc}")
+    logger.info(f"[cpu] intra-op threads={torch.get_num_threads()} inter-op threads={torch.get_num_interop_threads()}")
+
+
+def share_weights_copy(loaded: Any) -> Any:
+    """Deep-copy a model object but keep its parameters and buffers shared with the original."""
+    module = torch_module(loaded)
+    memo: dict[int, Any] = {}
+    if module is not None:
+        for t in (*module.parameters(), *module.buffers()):
+            memo[id(t)] = t
+    return copy.deepcopy(loaded, memo)
+
+
+class Replica:
+    """One pinned worker thread plus its private copies of the models it has run."""
+
+    def __init__(self, index: int, cores: list[int], threads: int, pin: bool):
+        self.index = index
+        self.cores = cores
+        self.threads = threads
+        self.pin = pin
+        self.inflight = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self._models: dict[Hashable, tuple[Any, Any]] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"cpu-replica-{index}", initializer=self._init_thread
+        )
+
+    @property
+    def name(self) -> str:
+        return f"replica-{self.index}"
+
+    def _init_thread(self) -> None:
+        if self.pin and self.cores and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, self.cores)  # 0 = this thread on Linux
+            except OSError as exc:
+                logger.warning(f"[cpu] {self.name}: could not pin to cores {self.cores}: {exc}")
+        # OpenMP thread counts are per calling thread, so this sizes this replica's pool only.
+        torch.set_num_threads(self.threads)
+
+    def model(self, key: Hashable, loaded: Any) -> Any:
+        """This replica's instance of `loaded` (the original on replica 0, a weight-sharing copy elsewhere)."""
+        if self.index == 0:
+            return loaded
+        cached = self._models.get(key)
+        if cached is None or cached[0] is not loaded:
+            cached = (loaded, share_weights_copy(loaded))
+            self._models[key] = cached
+        return cached[1]
+
+    def call(
+        self, key: Hashable, loaded: Any, fn: Callable[[Any, Any], Any], item: Any, stats: PipelineStats | None
+    ) -> Any:
+        model = self.model(key, loaded)
+        t0 = time.perf_counter()
+        try:
+            return fn(model, item)
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.busy_seconds += elapsed
+            if stats is not None:
+                stats.add(self.name, elapsed)
+
+
+class CpuReplicaPool:
+    """Dispatch model calls across pinned CPU replicas, least-busy first."""
+
+    def __init__(self, replicas: int, threads: int = 0, pin: bool = True, nodes: Sequence[Sequence[int]] | None = None):
+        nodes = nodes or numa_nodes()
+        sets = core_sets(replicas, nodes)
+        self.replicas = [
+            Replica(i, cores, threads or max(1, len(cores)), pin) for i, cores in enumerate(sets)
+        ]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CpuReplicaPool | None":
+        if CPU_REPLICAS <= 1:
+            return None
+        pool = cls(CPU_REPLICAS, threads=CPU_THREADS, pin=CPU_PIN)
+        for replica in pool.replicas:
+            logger.info(f"[cpu] {replica.name}: cores={replica.cores} threads={replica.threads}")
+        return pool
+
+    @property
+    def size(self) -> int:
+        return len(self.replicas)
+
+    def names(self) -> list[str]:
+        return [replica.name for replica in self.replicas]
+
+    def _pick(self) -> Replica:
+        with self._lock:
+            replica = min(self.replicas, key=lambda r: (r.inflight, r.completed))
+            replica.inflight += 1
+            return replica
+
+    async def run(
+        self,
+        key: Hashable,
+        loaded: Any,
+        fn: Callable[[Any, Any], Any],
+        item: Any,
+        stats: PipelineStats | None = None,
+    ) -> Any:
+        """Run `fn(model, item)` on the least-busy replica, where `model` is its copy of `loaded`."""
+        replica = self._pick()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                replica.executor, replica.call, key, loaded, fn, item, stats
+            )
+        finally:
+            with self._lock:
+                replica.inflight -= 1
+                replica.completed += 1
+
+    async def map(
+        self,
+        key: Hashable,
+        loaded: Any,
+        fn: Callable[[Any, Any], Any],
+        items: Sequence[Any],
+        stats: PipelineStats | None = None,
+        on_item: Callable[[int], None] | None = None,
+    ) -> list[Any]:
+        """Run `fn(model, item)` for every item, at most one per replica at a time; results in order.
+
+        `stats` records busy time per replica under the names from `names()`,
+        so `/status` utilization shows how evenly the replicas were used.
+        """
+        stats = stats or PipelineStats(self.names())
+        gate = asyncio.Semaphore(self.size)
+        results: list[Any] = [None] * len(items)
+
+        async def drive(idx: int, item: Any) -> None:
+            try:
+                stats.started_items += 1
+                results[idx] = await self.run(key, loaded, fn, item, stats)
+                stats.completed_items += 1
+                if on_item is not None:
+                    on_item(idx)
+            finally:
+                gate.release()
+
+        tasks: list[asyncio.Task] = []
+        try:
+            for idx, item in enumerate(items):
+                await gate.acquire()
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                tasks.append(asyncio.ensure_future(drive(idx, item)))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            stats.finished = time.perf_counter()
+        return results
+
+    def status(self) -> list[dict]:
+        return [
+            {
+                "name": replica.name,
+                "cores": replica.cores,
+                "threads": replica.threads,
+                "inflight": replica.inflight,
+                "completed": replica.completed,
+                "busy_seconds": round(replica.busy_seconds, 3),
+            }
+            for replica in self.replicas
+        ]
+
+    def close(self) -> None:
+        for replica in self.replicas:
+            replica.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,228 @@
+"""Deduplication of repeated inputs within and across requests.
+
+Agent traffic repeats itself: the same text appears several times in one
+`texts` list, and several clients send the identical request at once.
+`dedupe` collapses repeats inside a request, and `InflightCoalescer` lets
+concurrent identical requests share one computation. Retries carry an
+`Idempotency-Key`; `IdempotencyStore` remembers finished results under it
+for a short TTL, so a retry that arrives after the original has finished
+gets the same result without recomputing it.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Sequence
+
+import numpy as np
+
+from serialization import payload_nbytes
+
+IDEMPOTENCY_TTL = float(os.environ.get("GPU_IDEMPOTENCY_TTL", "300"))
+IDEMPOTENCY_MB = float(os.environ.get("GPU_IDEMPOTENCY_MB", "256"))
+# How long a keyed computation outlives its last caller, waiting for a retry to join it
+IDEMPOTENCY_GRACE = float(os.environ.get("GPU_IDEMPOTENCY_GRACE_MS", "2000")) / 1000
+
+
+def dedupe(items: Sequence[Hashable]) -> tuple[list, np.ndarray]:
+    """Return `(unique, inverse)` such that `unique[inverse[i]] == items[i]`.
+
+    `unique` keeps first-occurrence order, so a list without repeats comes
+    back unchanged.
+    """
+    positions: dict[Hashable, int] = {}
+    unique: list = []
+    inverse = np.empty(len(items), dtype=np.int64)
+    for i, item in enumerate(items):
+        pos = positions.get(item)
+        if pos is None:
+            pos = len(unique)
+            positions[item] = pos
+            unique.append(item)
+        inverse[i] = pos
+    return unique, inverse
+
+
+def payload_key(kind: str, model: str, payload: Any) -> str:
+    """Stable hash identifying a request by endpoint, model and JSON payload."""
+    blob = json.dumps([kind, model, payload], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CallerGone(Exception):
+    """Raised to a waiter that stopped waiting (client disconnected or deadline passed)."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "linger", "expiry")
+
+    def __init__(self, task: asyncio.Task, linger: float = 0.0):
+        self.task = task
+        self.waiters = 0
+        self.linger = linger
+        self.expiry: asyncio.TimerHandle | None = None
+
+    def expire(self) -> None:
+        self.expiry = None
+        if self.waiters == 0:
+            self.task.cancel()
+
+
+class InflightCoalescer:
+    """Share one running computation between concurrent callers with the same key.
+
+    The computation runs as its own task. Each caller awaits it through
+    `asyncio.shield`, so one caller going away does not cancel the work for
+    the others; the task is cancelled only when its last waiter is gone.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        watch: Callable[[], Awaitable[str | None]] | None = None,
+        poll_interval: float = 0.1,
+        linger: float = 0.0,
+    ) -> tuple[Any, bool]:
+        """Return `(result, shared)`; `shared` is True when another caller started the work.
+
+        If `watch` is given it is polled every `poll_interval` seconds while
+        waiting; a non-empty return value (the reason) makes this caller stop
+        waiting with `CallerGone`. With `linger`, a computation this call
+        starts is cancelled only if no new waiter joins within `linger`
+        seconds after its last waiter leaves.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()), linger)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task, k=key, f=flight: self._forget(k, f))
+
+        flight.waiters += 1
+        if flight.expiry is not None:
+            flight.expiry.cancel()
+            flight.expiry = None
+        try:
+            if watch is None:
+                return await asyncio.shield(flight.task), shared
+            while True:
+                done, _ = await asyncio.wait({flight.task}, timeout=poll_interval)
+                if done:
+                    return flight.task.result(), shared
+                reason = await watch()
+                if reason:
+                    raise CallerGone(reason)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                if flight.linger > 0:
+                    flight.expiry = asyncio.get_running_loop().call_later(flight.linger, flight.expire)
+                else:
+                    flight.task.cancel()
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request."""
+
+
+class _Memo:
+    __slots__ = ("payload_key", "result", "seconds", "nbytes", "expires")
+
+    def __init__(self, payload_key: str, result: Any, seconds: float, nbytes: int, expires: float):
+        self.payload_key = payload_key
+        self.result = result
+        self.seconds = seconds
+        self.nbytes = nbytes
+        self.expires = expires
+
+
+class IdempotencyStore:
+    """Results by idempotency key, kept for `ttl` seconds within a byte budget (oldest evicted first).
+
+    `claim` binds a key to the request's payload hash when the request
+    starts, so reusing a key for a different request is refused even while
+    the first one is still running.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, budget_bytes: int | None = None):
+        self.ttl = ttl
+        self.budget_bytes = int(IDEMPOTENCY_MB * 2**20) if budget_bytes is None else budget_bytes
+        self._results: OrderedDict[str, _Memo] = OrderedDict()
+        self._pending: dict[str, tuple[str, float]] = {}
+        self.bytes = 0
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyStore | None":
+        if IDEMPOTENCY_MB <= 0 or IDEMPOTENCY_TTL <= 0:
+            return None
+        return cls()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._results:
+            key, memo = next(iter(self._results.items()))
+            if memo.expires > now:
+                break
+            self._drop(key)
+        for key in [k for k, (_, expires) in self._pending.items() if expires <= now]:
+            del self._pending[key]
+
+    def _drop(self, key: str) -> None:
+        memo = self._results.pop(key)
+        self.bytes -= memo.nbytes
+
+    def claim(self, key: str, payload_key: str) -> _Memo | None:
+        """Return the finished result for `key`, else mark `key` as running `payload_key`.
+
+        Raises `IdempotencyConflict` if `key` is bound to another payload.
+        """
+        self._expire()
+        memo = self._results.get(key)
+        pending = self._pending.get(key)
+        bound = memo.payload_key if memo is not None else (pending[0] if pending else None)
+        if bound is not None and bound != payload_key:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+        if memo is not None:
+            return memo
+        self._pending[key] = (payload_key, time.monotonic() + self.ttl)
+        return None
+
+    def put(self, key: str, payload_key: str, result: Any, seconds: float) -> None:
+        self._pending.pop(key, None)
+        if key in self._results:
+            return
+        nbytes = payload_nbytes(result)
+        if nbytes > self.budget_bytes:
+            return
+        self._results[key] = _Memo(payload_key, result, seconds, nbytes, time.monotonic() + self.ttl)
+        self.bytes += nbytes
+        while self.bytes > self.budget_bytes:
+            self._drop(next(iter(self._results)))
+
+    def discard(self, key: str) -> None:
+        """Forget a key whose request failed, so a retry computes it again."""
+        self._pending.pop(key, None)
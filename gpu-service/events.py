@@ -0,0 +1,78 @@
+"""In-process event bus backing the Server-Sent Events endpoints."""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Callable
+
+# Per-subscriber buffer; a subscriber that falls this far behind loses its oldest events.
+SUBSCRIBER_QUEUE_SIZE = 256
+# Idle streams send an SSE comment this often so proxies keep the connection open.
+HEARTBEAT_SECONDS = 15.0
+
+
+class EventBus:
+    """Fan-out of job/queue events to any number of SSE subscribers."""
+
+    def __init__(self):
+        self._subscribers: set[asyncio.Queue] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: dict[str, Any]) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+
+def is_job_event(data: dict[str, Any], job_id: str) -> bool:
+    return data.get("job", {}).get("id") == job_id
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Encode one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_stream(
+    bus: EventBus,
+    initial: Callable[[], list[tuple[str, Any]]],
+    job_id: str | None = None,
+    heartbeat: float = HEARTBEAT_SECONDS,
+    queue: asyncio.Queue | None = None,
+) -> AsyncIterator[str]:
+    """Yield the `initial()` snapshot events, then live bus events (optionally for one job only).
+
+    `initial` is evaluated after subscribing, so no event falls between the
+    snapshot and the live stream. Pass `queue` to continue a subscription the
+    caller already holds. A job-scoped stream ends after that job's
+    `job_finished` event.
+    """
+    queue = queue if queue is not None else bus.subscribe()
+    try:
+        for event, data in initial():
+            yield format_sse(event, data)
+            if job_id is not None and event == "job_finished":
+                return
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if job_id is not None and not is_job_event(data, job_id):
+                continue
+            yield format_sse(event, data)
+            if job_id is not None and event == "job_finished":
+                return
+    finally:
+        bus.unsubscribe(queue)
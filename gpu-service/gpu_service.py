@@ -1,29 +1,79 @@
 """FastAPI GPU service - BERTScore + Embeddings (v0.2)."""
 
 import asyncio
+import json
 import logging
 import os
+import re
+import sys
 import time
 import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
+import numpy as np
 import torch
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 
+from admission import MAX_SEQ_TOKENS, CapacityBudget, CapacityTooSmall, CostModel, Lane, LaneRouter, QueueFull, prior_factor
+from batching import MicroBatcher
+from capture import CaptureMiddleware, TrafficCapture
+from compression import CompressionMiddleware, supported_encodings
+from cpu_replicas import CpuReplicaPool, configure_threads
+from dedup import (
+    IDEMPOTENCY_GRACE,
+    CallerGone,
+    IdempotencyConflict,
+    IdempotencyStore,
+    InflightCoalescer,
+    dedupe,
+    payload_key,
+)
 from device import get_device, get_device_info
+from events import EventBus, is_job_event, sse_stream
+from idf import CorpusRegistry, UnknownCorpus, score_with_idf
+from layers import bertscore_key, layer_report, parse_bertscore_key, strip_unused
+from load import LoadMonitor
+from memory import TRACEMALLOC_ENABLED, MemoryHistory, MemoryProbe, start_tracemalloc
+from metrics import Metrics
 from models import (
+    MAX_BATCH_SIZE,
     BertScoreRequest,
     BertScoreResponse,
+    CorpusInfo,
+    CorpusList,
+    CorpusRequest,
     EmbedRequest,
     EmbedResponse,
+    EmbedShmResponse,
     HealthResponse,
     InfoResponse,
+    LoadResponse,
     JobStatus,
+    LaneStatus,
+    MemoryStatsResponse,
+    MetricsResponse,
     QueueStatus,
+    ReadyResponse,
+    RerankRequest,
+    RerankResponse,
     StatusResponse,
+    WsMessage,
 )
+from multiref import best_reference, chunk_candidates, flatten_references, is_multi
+from pipeline import PipelineStats, embed_stages, run_pipeline
+from profiling import ProfileCapture, ProfilerBusy
+from residency import ResidencyManager
+from serialization import FastJSONResponse, encode_json, render_json
+from shared_results import SegmentBudgetExceeded, SharedResultStore, UnknownSegment, is_local_client
+from snapshots import SnapshotStore, apply_offline_mode
+from token_cache import TokenEmbeddingCache, cacheable
+from warmup import Readiness, warm_model, warmup_grid
 
 logging.basicConfig(
     level=logging.INFO,
@@ -46,41 +96,118 @@ def _vram_mb() -> str:
     return f"{used} MB / {total} MB VRAM"
 
 
-# --- Concurrency guard ---
+# --- Cancellation ---
+# Remaining time budget (milliseconds) the caller is willing to wait for this request.
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+# --- Job tracking ---
+# Optional caller-chosen job id, so a client can follow its own job on /jobs/{id}/events.
+JOB_ID_HEADER = "X-Job-Id"
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# How long `/jobs/{id}/events` waits for a job that has not started yet before answering 404.
+JOB_SUBSCRIBE_WAIT = float(os.environ.get("GPU_JOB_SUBSCRIBE_WAIT_MS", "5000")) / 1000
+
+# --- Admission control ---
+# Capacity is expressed in cost units (estimated tokens x per-model cost factor). By default it
+# holds GPU_MAX_CONCURRENT worst-case requests for the default BERTScore model, so cheap requests
+# can run alongside. GPU_MAX_JOBS caps the number of jobs regardless of cost. These are the
+# defaults for every lane (one per request kind unless GPU_LANES says otherwise).
 MAX_CONCURRENT = int(os.environ.get("GPU_MAX_CONCURRENT", "2"))
-semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+MAX_JOBS = int(os.environ.get("GPU_MAX_JOBS", "16"))
+# Tokens of the largest admissible request: a full /bertscore batch, candidates plus references.
+MAX_REQUEST_TOKENS = 2 * MAX_BATCH_SIZE * MAX_SEQ_TOKENS
+CAPACITY_UNITS = float(os.environ.get("GPU_CAPACITY_UNITS", "0")) or (
+    MAX_CONCURRENT * MAX_REQUEST_TOKENS * prior_factor(DEFAULT_BERTSCORE_MODEL)
+)
+ADMISSION_TIMEOUT = 1.0
+
+# --- WebSocket streaming ---
+# Messages a connection may have in flight; past this the server stops reading from the socket.
+WS_MAX_INFLIGHT = int(os.environ.get("GPU_WS_MAX_INFLIGHT", "32"))
+# How long a message waits for others with the same model so they can share one GPU batch.
+WS_BATCH_WINDOW = float(os.environ.get("GPU_WS_BATCH_WINDOW_MS", "5")) / 1000
+WS_POLICY_VIOLATION = 1008
+# How long a /ws/embed client without an X-API-Key header has to send its auth message
+WS_AUTH_TIMEOUT = 10.0
 
 # --- Auth ---
 API_KEY = os.environ.get("API_KEY")
 
 
+def _max_cost_factor(router: LaneRouter) -> float:
+    """Largest cost factor at which a maximum-size request still fits the default lane and global budgets.
+
+    Without this cap, calibration could push a slow model's factor past what the
+    capacity was sized for and turn its largest requests into permanent 413s.
+    """
+    capacity = router.defaults["capacity"]
+    if router.global_budget is not None:
+        capacity = min(capacity, router.global_budget.capacity)
+    # Shaved a little so `tokens * factor` cannot round above the capacity.
+    return capacity / MAX_REQUEST_TOKENS * (1 - 1e-9)
+
+
+def _init_state(app: FastAPI, device: torch.device, bertscorer_factory, embedder_factory) -> None:
+    """Populate `app.state` with the model factories and empty caches/registries."""
+    app.state.device = device
+    app.state.BERTScorer = bertscorer_factory
+    app.state.SentenceTransformer = embedder_factory
+    app.state.bertscore_cache = {}
+    app.state.embed_cache = {}
+    app.state.active_jobs = {}
+    app.state.coalescer = InflightCoalescer()
+    app.state.idempotency = IdempotencyStore.from_env()
+    app.state.metrics = Metrics()
+    app.state.events = EventBus()
+    app.state.memory = MemoryHistory()
+    app.state.lanes = LaneRouter.from_env(
+        CAPACITY_UNITS, MAX_JOBS, ADMISSION_TIMEOUT, kinds=("embed", "bertscore")
+    )
+    app.state.cost_model = CostModel.from_env(
+        reference_model=DEFAULT_EMBED_MODEL, max_factor=_max_cost_factor(app.state.lanes)
+    )
+    app.state.snapshots = SnapshotStore.from_env()
+    app.state.residency = ResidencyManager(device)
+    app.state.cpu_pool = CpuReplicaPool.from_env() if device.type == "cpu" else None
+    app.state.corpora = CorpusRegistry()
+    app.state.token_cache = TokenEmbeddingCache.from_env()
+    app.state.layer_reports = {}
+    app.state.shared_results = SharedResultStore.from_env()
+    app.state.load = LoadMonitor(device)
+    app.state.warmup_grid = warmup_grid(device=device)
+    app.state.profiler = ProfileCapture(device)
+    app.state.capture = TrafficCapture.from_env()
+    app.state.readiness = Readiness([("bertscore", DEFAULT_BERTSCORE_MODEL), ("embed", DEFAULT_EMBED_MODEL)])
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize service state and warm default models."""
     device = get_device()
-    app.state.device = device
 
+    apply_offline_mode()
     from bert_score import BERTScorer
     from sentence_transformers import SentenceTransformer
 
-    app.state.BERTScorer = BERTScorer
-    app.state.SentenceTransformer = SentenceTransformer
-    app.state.bertscore_cache = {}
-    app.state.embed_cache = {}
-    app.state.active_jobs = {}
+    if device.type == "cpu":
+        configure_threads()
+    _init_state(app, device, BERTScorer, SentenceTransformer)
+    if TRACEMALLOC_ENABLED:
+        start_tracemalloc()
+        logger.info("tracemalloc enabled - host allocation hotspots are reported on /memory")
 
     logger.info(f"Warming default BERTScore model: {DEFAULT_BERTSCORE_MODEL} ...")
     t0 = time.time()
-    app.state.bertscore_cache[DEFAULT_BERTSCORE_MODEL] = BERTScorer(
-        model_type=DEFAULT_BERTSCORE_MODEL,
-        device=str(device),
-        lang="en",
-    )
+    scorer = _load_and_warm(app, "bertscore", DEFAULT_BERTSCORE_MODEL)
+    app.state.bertscore_cache[DEFAULT_BERTSCORE_MODEL] = scorer
+    app.state.residency.register("bertscore", DEFAULT_BERTSCORE_MODEL, scorer)
     logger.info(f"BERTScore warm ready ({time.time()-t0:.1f}s) - {_vram_mb()}")
 
     logger.info(f"Warming default embed model: {DEFAULT_EMBED_MODEL} ...")
     t0 = time.time()
-    app.state.embed_cache[DEFAULT_EMBED_MODEL] = SentenceTransformer(DEFAULT_EMBED_MODEL, device=str(device))
+    embedder = _load_and_warm(app, "embed", DEFAULT_EMBED_MODEL)
+    app.state.embed_cache[DEFAULT_EMBED_MODEL] = embedder
+    app.state.residency.register("embed", DEFAULT_EMBED_MODEL, embedder)
     logger.info(f"Embed warm ready ({time.time()-t0:.1f}s) - {_vram_mb()}")
 
     logger.info("=" * 55)
@@ -89,7 +216,27 @@ async def lifespan(app: FastAPI):
     logger.info(f"  Models : bertscore:{DEFAULT_BERTSCORE_MODEL}, embed:{DEFAULT_EMBED_MODEL}")
     logger.info(f"  VRAM   : {_vram_mb()}")
     logger.info("=" * 55)
+
+    residency = app.state.residency
+    sweeper = None
+    if residency.enabled:
+        logger.info(f"Offloading models idle for {residency.idle_seconds:.0f}s")
+        sweeper = asyncio.create_task(residency.run(lambda kind, model: _model_busy(app, kind, model)))
+    shared = app.state.shared_results
+    shm_sweeper = asyncio.create_task(shared.run()) if shared is not None else None
+    load_refresher = asyncio.create_task(app.state.load.run(app.state.lanes))
     yield
+    load_refresher.cancel()
+    if sweeper is not None:
+        sweeper.cancel()
+    if shm_sweeper is not None:
+        shm_sweeper.cancel()
+        shared.close()
+    residency.close()
+    if app.state.capture is not None:
+        app.state.capture.close()
+    if app.state.cpu_pool is not None:
+        app.state.cpu_pool.close()
 
 
 app = FastAPI(title="OpenClaw GPU Bridge Service", version="0.2.0", lifespan=lifespan)
@@ -102,178 +249,1088 @@ def _loaded_models(request: Request) -> list[str]:
     ]
 
 
+def _model_busy(app: FastAPI, kind: str, model: str) -> bool:
+    return any(job["type"] == kind and job["model"] == model for job in app.state.active_jobs.values())
+
+
 def _to_iso(ts: float) -> str:
     return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
 
 
-async def _get_bertscorer(request: Request, model_type: str):
+def _freeze(freeze, model: str, loaded) -> None:
+    try:
+        freeze(model, loaded)
+    except Exception as exc:  # a failed snapshot must not fail the load
+        logger.warning(f"[snapshot] could not freeze {model}: {exc}")
+
+
+def _load_bertscorer(app: FastAPI, key: str):
+    """Load a BERTScorer from its local snapshot if there is one, else by name (then freeze it).
+
+    `key` is a model name, or `<model>@<num_layers>` for a non-default scoring layer.
+    """
+    store = app.state.snapshots
+    device = app.state.device
+    scorer = store.load_bertscorer(key, app.state.BERTScorer, device) if store is not None else None
+    if scorer is None:
+        model_type, num_layers = parse_bertscore_key(key)
+        layers = {"num_layers": num_layers} if num_layers is not None else {}
+        scorer = app.state.BERTScorer(model_type=model_type, device=str(device), lang="en", **layers)
+        stripped = strip_unused(scorer)
+        if store is not None and store.auto_freeze:
+            _freeze(store.freeze_bertscorer, key, scorer)
+    else:
+        stripped = strip_unused(scorer)
+    report = layer_report(scorer, key, stripped)
+    if report is not None:
+        app.state.layer_reports[key] = report
+        logger.info(
+            f"[model-load] {key}: scoring layer {report['num_layers']} of {report['total_layers']}, "
+            f"{report['size_mb']:.0f} MB resident, {report['saved_mb']:.0f} MB of unused layers/heads dropped"
+        )
+    return scorer
+
+
+def _load_embedder(app: FastAPI, model_name: str):
+    """Load a SentenceTransformer from its local snapshot if there is one, else by name (then freeze it)."""
+    store = app.state.snapshots
+    device = app.state.device
+    if store is not None:
+        embedder = store.load_embedder(model_name, app.state.SentenceTransformer, device)
+        if embedder is not None:
+            return embedder
+    embedder = app.state.SentenceTransformer(model_name, device=str(device))
+    if store is not None and store.auto_freeze:
+        _freeze(store.freeze_embedder, model_name, embedder)
+    return embedder
+
+
+def _load_and_warm(app: FastAPI, kind: str, key: str):
+    """Load a model, then prime it over the warmup grid before it is cached and reported ready."""
+    readiness = app.state.readiness
+    readiness.mark(kind, key, "loading")
+    try:
+        model = _load_bertscorer(app, key) if kind == "bertscore" else _load_embedder(app, key)
+        readiness.mark(kind, key, "warming")
+        report = warm_model(kind, model, app.state.device, app.state.warmup_grid)
+    except Exception:
+        readiness.forget(kind, key)
+        raise
+    if report is not None:
+        slowest = max(report["shapes"], key=lambda shape: shape["warm_ms"])
+        logger.info(
+            f"[warmup] {kind}:{key} primed {len(report['shapes'])} shape(s) in {report['seconds']:.1f}s, "
+            f"warm {slowest['warm_ms']:.0f} ms at batch {slowest['batch_size']} x {slowest['tokens']} tokens"
+        )
+    readiness.mark(kind, key, "ready", report)
+    return model
+
+
+async def _get_bertscorer(request: HTTPConnection, model_type: str):
     cache = request.app.state.bertscore_cache
     if model_type in cache:
+        await request.app.state.residency.ensure_resident("bertscore", model_type)
         return cache[model_type]
 
     logger.info(f"[model-load] Loading BERTScore model on-demand: {model_type} - {_vram_mb()}")
     t0 = time.time()
-    scorer = await asyncio.to_thread(
-        request.app.state.BERTScorer,
-        model_type=model_type,
-        device=str(request.app.state.device),
-        lang="en",
-    )
+    scorer = await asyncio.to_thread(_load_and_warm, request.app, "bertscore", model_type)
     cache[model_type] = scorer
+    request.app.state.residency.register("bertscore", model_type, scorer)
     logger.info(f"[model-load] BERTScore model ready in {time.time()-t0:.2f}s: {model_type} - {_vram_mb()}")
     return scorer
 
 
-async def _get_embedder(request: Request, model_name: str):
+async def _get_embedder(request: HTTPConnection, model_name: str):
     cache = request.app.state.embed_cache
     if model_name in cache:
+        await request.app.state.residency.ensure_resident("embed", model_name)
         return cache[model_name]
 
     logger.info(f"[model-load] Loading embed model on-demand: {model_name} - {_vram_mb()}")
     t0 = time.time()
-    embedder = await asyncio.to_thread(
-        request.app.state.SentenceTransformer,
-        model_name,
-        device=str(request.app.state.device),
-    )
+    embedder = await asyncio.to_thread(_load_and_warm, request.app, "embed", model_name)
     cache[model_name] = embedder
+    request.app.state.residency.register("embed", model_name, embedder)
     logger.info(f"[model-load] Embed model ready in {time.time()-t0:.2f}s: {model_name} - {_vram_mb()}")
     return embedder
 
 
+def _parse_deadline(request: Request) -> float | None:
+    """Return the monotonic deadline from `X-Deadline-Ms` (remaining budget in ms), if any."""
+    raw = request.headers.get(DEADLINE_HEADER)
+    if raw is None:
+        return None
+    try:
+        budget_ms = float(raw)
+    except ValueError as exc:
+        raise HTTPException(400, f"{DEADLINE_HEADER} must be a number of milliseconds") from exc
+    if budget_ms <= 0:
+        raise HTTPException(504, "Deadline exceeded before the request was started")
+    return time.monotonic() + budget_ms / 1000
+
+
+def _client_watch(request: Request, deadline: float | None):
+    """Build the coalescer watch callback: reports a deadline miss or a client disconnect."""
+    async def watch() -> str | None:
+        if deadline is not None and time.monotonic() >= deadline:
+            return "deadline"
+        if await request.is_disconnected():
+            return "disconnected"
+        return None
+    return watch
+
+
+async def _admit(request: HTTPConnection, kind: str, model: str, cost: float, deadline: float | None) -> Lane:
+    """Reserve `cost` units on the request's lane, or fail with 413 (never fits) / 503 (busy)."""
+    router = request.app.state.lanes
+    lane = router.select(kind, model)
+    timeout = lane.timeout
+    if deadline is not None:
+        timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+    try:
+        await router.acquire(lane, cost, timeout=timeout)
+    except CapacityTooSmall as exc:
+        request.app.state.metrics.inc("rejected_oversized")
+        raise HTTPException(
+            413,
+            f"Request too large: estimated cost {cost:.0f} units exceeds GPU capacity of "
+            f"{_capacity_for(router, lane):.0f} units - split the batch",
+        ) from exc
+    except (asyncio.TimeoutError, QueueFull) as exc:
+        request.app.state.metrics.inc("rejected_busy")
+        reason = "queue full" if isinstance(exc, QueueFull) else "busy"
+        raise HTTPException(
+            503,
+            f"GPU {reason} - retry later (lane {lane.name}: estimated cost {cost:.0f} units, "
+            f"{lane.budget.available:.0f} of {lane.budget.capacity:.0f} available)",
+            headers={"Retry-After": "5"},
+        ) from exc
+    return lane
+
+
+def _capacity_for(router: LaneRouter, lane: Lane) -> float:
+    if router.global_budget is None:
+        return lane.budget.capacity
+    return min(lane.budget.capacity, router.global_budget.capacity)
+
+
+def _record_cancellation(request: HTTPConnection, job_id: str, wasted: int, saved: int) -> None:
+    metrics = request.app.state.metrics
+    metrics.inc("cancelled_jobs")
+    metrics.inc("cancelled_items_wasted", wasted)
+    metrics.inc("cancelled_items_saved", saved)
+    logger.info(f"[cancel] job={job_id} cancelled - {wasted} item(s) computed for nothing, {saved} skipped")
+
+
+def _memoized(store: IdempotencyStore, idem_key: str, key: str, factory):
+    """Wrap `factory` so its result is stored under `idem_key` even if every caller has left."""
+    async def run():
+        t0 = time.monotonic()
+        try:
+            payload = await factory()
+        except BaseException:
+            store.discard(idem_key)
+            raise
+        store.put(idem_key, key, payload, time.monotonic() - t0)
+        return payload
+
+    return run
+
+
+async def _await_shared(request: Request, key: str, factory, deadline: float | None) -> tuple[dict, bool]:
+    """Run or join the computation for `key`, giving up when the client goes away.
+
+    With an `Idempotency-Key` header, a finished result for that key is returned from the
+    idempotency store, and the computation outlives this caller by `IDEMPOTENCY_GRACE`
+    seconds, so a retry of a timed-out request joins it instead of starting it again.
+    It is cancelled if no retry arrives in that window.
+    """
+    app = request.app
+    metrics = app.state.metrics
+    store = app.state.idempotency
+    idem = request.headers.get("Idempotency-Key") if store is not None else None
+    if idem:
+        idem = f"{request.url.path}:{idem}"
+        try:
+            memo = store.claim(idem, key)
+        except IdempotencyConflict as exc:
+            raise HTTPException(422, str(exc)) from exc
+        if memo is not None:
+            metrics.inc("idempotent_replays")
+            metrics.inc("idempotent_seconds_saved", memo.seconds)
+            return memo.result, True
+        factory = _memoized(store, idem, key, factory)
+    t0 = time.monotonic()
+    try:
+        payload, shared = await app.state.coalescer.run(
+            key,
+            factory,
+            watch=_client_watch(request, deadline),
+            linger=IDEMPOTENCY_GRACE if idem else 0.0,
+        )
+    except CallerGone as exc:
+        metrics.inc(f"abandoned_requests_{exc.reason}")
+        if exc.reason == "deadline":
+            raise HTTPException(504, "Deadline exceeded") from exc
+        raise HTTPException(499, "Client closed request") from exc
+    except BaseException:
+        if idem:
+            store.discard(idem)
+        raise
+    if idem:
+        if shared:
+            metrics.inc("idempotent_attached")
+        # Also covers joining a computation started without the key, which stores nothing itself.
+        store.put(idem, key, payload, time.monotonic() - t0)
+    return payload, shared
+
+
+def _record_dedup(request: HTTPConnection, items: int, shared: bool) -> None:
+    metrics = request.app.state.metrics
+    metrics.inc("dedup_items_submitted", items)
+    if shared:
+        metrics.inc("coalesced_requests")
+
+
 # --- Middleware: API key auth ---
-@app.middleware("http")
-async def auth_middleware(request: Request, call_next):
-    if API_KEY and request.url.path != "/health":
-        key = request.headers.get("X-API-Key")
-        if key != API_KEY:
-            return JSONResponse(status_code=401, content={"detail": "Unauthorized"})
-    return await call_next(request)
+class AuthMiddleware:
+    """ASGI middleware: reject HTTP requests without the right `X-API-Key` (WebSockets check it themselves).
+
+    A plain ASGI middleware rather than `@app.middleware("http")`: Starlette's
+    BaseHTTPMiddleware hides `http.disconnect` from the endpoint, so
+    `request.is_disconnected()` would never report a client that went away.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if API_KEY and scope["type"] == "http" and scope["path"] not in ("/health", "/ready"):
+            if Headers(scope=scope).get("X-API-Key") != API_KEY:
+                await JSONResponse(status_code=401, content={"detail": "Unauthorized"})(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(AuthMiddleware)
+
+
+# Sees decoded bodies and the final status (including auth rejections) of sampled requests.
+app.add_middleware(CaptureMiddleware)
+# Outermost, so request bodies are decoded before auth/routing and every reply can be compressed.
+app.add_middleware(CompressionMiddleware)
 
 
 # --- Endpoints ---
 
 @app.get("/health", response_model=HealthResponse)
 async def health(request: Request):
-    return HealthResponse(status="ok", device=str(request.app.state.device))
+    return HealthResponse(
+        status="ok", device=str(request.app.state.device), request_encodings=supported_encodings()
+    )
+
+
+@app.get("/ready", response_model=ReadyResponse)
+async def ready(request: Request):
+    """`200` once the default models are loaded and warmed, `503` before; lists every model's warmup."""
+    readiness = request.app.state.readiness
+    body = ReadyResponse(ready=readiness.is_ready(), models=readiness.status())
+    return JSONResponse(status_code=200 if body.ready else 503, content=body.model_dump())
 
 
 @app.get("/info", response_model=InfoResponse)
 async def info(request: Request):
     di = get_device_info(request.app.state.device)
     di["loaded_models"] = _loaded_models(request)
+    residency = request.app.state.residency
+    di["offload_idle_seconds"] = residency.idle_seconds if residency.enabled else None
+    di["residency"] = residency.status()
+    pool = request.app.state.cpu_pool
+    di["cpu_replicas"] = pool.status() if pool is not None else []
+    cache = request.app.state.token_cache
+    di["token_cache"] = cache.status() if cache is not None else None
+    di["bertscore_layers"] = list(request.app.state.layer_reports.values())
+    shared = request.app.state.shared_results
+    di["shared_results"] = shared.status() if shared is not None else None
     return InfoResponse(**di)
 
 
-@app.get("/status", response_model=StatusResponse)
-async def status(request: Request):
-    in_flight = len(request.app.state.active_jobs)
-    queue = QueueStatus(
-        max_concurrent=MAX_CONCURRENT,
+@app.get("/metrics", response_model=MetricsResponse)
+async def metrics(request: Request):
+    m = request.app.state.metrics
+    return MetricsResponse(counters=m.snapshot(), dedup_ratio=m.dedup_ratio())
+
+
+@app.get("/memory", response_model=MemoryStatsResponse)
+async def memory(request: Request):
+    """Peak memory per finished job and a per-model fit of peak MB against tokens."""
+    history = request.app.state.memory
+    return MemoryStatsResponse(
+        device=str(request.app.state.device),
+        tracemalloc=TRACEMALLOC_ENABLED,
+        models=history.stats(),
+        recent=history.recent(),
+        hotspots=history.top_hotspots(),
+    )
+
+
+def _lane_status(name: str, budget: CapacityBudget, timeout: float | None = None) -> LaneStatus:
+    finite = budget.capacity != float("inf")
+    return LaneStatus(
+        name=name,
+        capacity_units=round(budget.capacity, 1) if finite else None,
+        in_use_units=round(budget.in_use, 1),
+        available_units=round(budget.available, 1) if finite else None,
+        jobs=budget.jobs,
+        max_jobs=budget.max_jobs,
+        queued=budget.queued,
+        max_queue=budget.max_queue,
+        timeout_s=timeout,
+    )
+
+
+def _queue_status(app: FastAPI) -> QueueStatus:
+    router = app.state.lanes
+    lanes = [_lane_status(lane.name, lane.budget, lane.timeout) for lane in router.lanes()]
+    shared = router.global_budget
+    global_status = _lane_status("global", shared) if shared is not None else None
+    in_flight = len(app.state.active_jobs)
+    if global_status is not None:
+        capacity = global_status.capacity_units
+        in_use = global_status.in_use_units
+        available = global_status.available_units
+    else:
+        capacity = sum(lane.capacity_units or 0.0 for lane in lanes)
+        in_use = sum(lane.in_use_units for lane in lanes)
+        available = sum(lane.available_units or 0.0 for lane in lanes)
+    return QueueStatus(
+        max_concurrent=MAX_JOBS,
         in_flight=in_flight,
-        available_slots=max(0, MAX_CONCURRENT - in_flight),
-        waiting_estimate=max(0, in_flight - MAX_CONCURRENT),
+        available_slots=max(0, MAX_JOBS - in_flight),
+        waiting_estimate=sum(lane.queued for lane in lanes) + (shared.queued if shared is not None else 0),
+        capacity_units=capacity,
+        in_use_units=in_use,
+        available_units=available,
+        cost_factors=app.state.cost_model.snapshot(),
+        lanes=lanes,
+        global_budget=global_status,
     )
+
+
+@app.get("/load", response_model=LoadResponse)
+async def load(request: Request):
+    """Background-refreshed load snapshot for client-side balancing; `If-None-Match` gets `304` while unchanged."""
+    body, etag = request.app.state.load.current(request.app.state.lanes)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(content=body, headers=headers)
+
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 5.0):
+    """Profile the live process for `seconds` and return a zip of a torch Chrome trace and Python stack samples."""
+    if not API_KEY and not is_local_client(request.client.host if request.client else None):
+        raise HTTPException(403, "profiling needs API_KEY to be set, or a client on the service host")
+    capture = request.app.state.profiler
+    if not 0 < seconds <= capture.max_seconds:
+        raise HTTPException(422, f"seconds must be in (0, {capture.max_seconds:g}]")
+    try:
+        data = await capture.capture(seconds)
+    except ProfilerBusy as exc:
+        raise HTTPException(409, str(exc)) from exc
+    name = f"gpu-profile-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.zip"
+    return Response(
+        content=data, media_type="application/zip", headers={"Content-Disposition": f'attachment; filename="{name}"'}
+    )
+
+
+@app.get("/status", response_model=StatusResponse)
+async def status(request: Request):
+    queue = _queue_status(request.app)
     jobs = [JobStatus(**job) for job in request.app.state.active_jobs.values()]
     return StatusResponse(queue=queue, active_jobs=jobs)
 
 
-@app.post("/bertscore", response_model=BertScoreResponse)
-async def bertscore(req: BertScoreRequest, request: Request):
-    if len(req.candidates) != len(req.references):
-        raise HTTPException(400, "candidates and references must have equal length")
+@app.get("/status/stream")
+async def status_stream(request: Request):
+    """Server-Sent Events: a `status` snapshot, then every job start/progress/finish."""
+    def initial():
+        snapshot = StatusResponse(
+            queue=_queue_status(request.app),
+            active_jobs=[JobStatus(**job) for job in request.app.state.active_jobs.values()],
+        )
+        return [("status", snapshot.model_dump())]
 
-    try:
-        await asyncio.wait_for(semaphore.acquire(), timeout=1.0)
-    except asyncio.TimeoutError as exc:
-        raise HTTPException(503, "GPU busy - retry later", headers={"Retry-After": "5"}) from exc
+    return StreamingResponse(
+        sse_stream(request.app.state.events, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events for one job; the stream ends with its `job_finished` event.
+
+    A job that has not started yet is waited for up to `JOB_SUBSCRIBE_WAIT`
+    seconds, so a client can subscribe before sending the request with that
+    `X-Job-Id`.
+    """
+    active_jobs = request.app.state.active_jobs
+    bus = request.app.state.events
+    queue = bus.subscribe()  # before waiting, so a job that starts and ends meanwhile is not missed
+    backlog: list[tuple[str, dict]] = []
+    if job_id not in active_jobs:
+        deadline = time.monotonic() + JOB_SUBSCRIBE_WAIT
+        while job_id not in active_jobs and not any(is_job_event(data, job_id) for _, data in backlog):
+            try:
+                backlog.append(await asyncio.wait_for(queue.get(), max(0.0, deadline - time.monotonic())))
+            except asyncio.TimeoutError:
+                bus.unsubscribe(queue)
+                raise HTTPException(404, f"Unknown or finished job: {job_id}") from None
+
+    def initial():
+        seen = [(event, data) for event, data in backlog if is_job_event(data, job_id)]
+        job = active_jobs.get(job_id)
+        if job is not None:
+            return [*seen, ("job_progress", {"job": dict(job), "queue": _queue_status(request.app).model_dump()})]
+        return seen or [("job_finished", {"job": {"id": job_id}, "outcome": "unknown"})]
+
+    return StreamingResponse(
+        sse_stream(bus, initial, job_id=job_id, queue=queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _job_id(request: HTTPConnection) -> str:
+    """Use the caller's `X-Job-Id` (so it can subscribe to `/jobs/{id}/events`) or a fresh UUID."""
+    job_id = request.headers.get(JOB_ID_HEADER)
+    if job_id is None:
+        return str(uuid.uuid4())
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        raise HTTPException(400, f"{JOB_ID_HEADER} must be 1-64 characters of [A-Za-z0-9_-]")
+    if job_id in request.app.state.active_jobs:
+        raise HTTPException(409, f"Job {job_id} is already running")
+    return job_id
+
+
+def _publish_job(app: FastAPI, event: str, job: dict, **extra) -> None:
+    if not len(app.state.events):  # nobody is listening, so skip building the queue snapshot
+        return
+    app.state.events.publish(event, {"job": dict(job), "queue": _queue_status(app).model_dump(), **extra})
 
-    job_id = str(uuid.uuid4())
-    request.app.state.active_jobs[job_id] = {
+
+def _start_job(app: FastAPI, job_id: str, job_type: str, items: int, model: str, cost: float) -> dict:
+    job = {
         "id": job_id,
-        "type": "bertscore",
+        "type": job_type,
         "started_at": _to_iso(time.time()),
-        "items": len(req.candidates),
-        "model": req.model_type or DEFAULT_BERTSCORE_MODEL,
+        "items": items,
+        "model": model,
         "progress": 0.0,
+        "cost": round(cost, 1),
     }
+    app.state.active_jobs[job_id] = job
+    app.state.load.job_started(job_id)
+    _publish_job(app, "job_started", job)
+    return job
+
+
+def _report_progress(app: FastAPI, job_id: str, done: int, total: int, t0: float, **fields) -> None:
+    """Update progress, throughput and ETA for a job and notify stream subscribers."""
+    job = app.state.active_jobs.get(job_id)
+    if job is None:
+        return
+    elapsed = max(time.time() - t0, 1e-6)
+    rate = done / elapsed
+    job["progress"] = done / total if total else 1.0
+    job["items_per_sec"] = round(rate, 2)
+    job["eta_seconds"] = round((total - done) / rate, 2) if rate > 0 else None
+    job.update(fields)
+    _publish_job(app, "job_progress", job)
+
+
+def _finish_job(app: FastAPI, job_id: str, outcome: str, probe: MemoryProbe | None = None, tokens: int = 0) -> None:
+    """Close a job; a successful job's peak memory goes into the rolling memory history."""
+    job = app.state.active_jobs.pop(job_id, None)
+    if job is None:
+        return
+    app.state.load.job_finished(job_id, job["type"], outcome == "done")
+    app.state.residency.touch(job["type"], job["model"])
+    if probe is not None:
+        job["peak_memory_mb"] = probe.stop()
+        if outcome == "done":
+            app.state.memory.record(
+                job["type"], job["model"], job["items"], tokens, job["peak_memory_mb"], probe.hotspots
+            )
+    _publish_job(app, "job_finished", job, outcome=outcome)
+
 
+async def _score_fn(request: HTTPConnection, scorer, model: str, idf_corpus: str | None):
+    """`fn(scorer, cands, refs) -> (P, R, F1)`, IDF-weighted by `idf_corpus` when one is given.
+
+    With the token-embedding cache enabled, sentences seen before skip the forward pass.
+    Without it, a cache for this job alone still encodes each of its sentences once, instead of
+    once per sub-batch they appear in (a reference shared by many candidates, say).
+    """
+    idf = None
+    if idf_corpus is not None:
+        try:
+            # IDF depends only on the tokenizer, so every layer variant of a model shares one table.
+            model_type, _ = parse_bertscore_key(model)
+            table = await request.app.state.corpora.table(idf_corpus, model_type, scorer._tokenizer)
+        except UnknownCorpus as exc:  # deleted since the request was accepted
+            raise HTTPException(404, f"Unknown IDF corpus: {idf_corpus}") from exc
+        idf = table.idf_dict(scorer._tokenizer)
+    cache = request.app.state.token_cache or TokenEmbeddingCache.for_job()
+    if cache is not None and cacheable(scorer):
+        return lambda s, cands, refs: cache.score(s, model, cands, refs, idf)
+    if idf is None:
+        return lambda s, cands, refs: s.score(cands, refs)
+    return lambda s, cands, refs: score_with_idf(s, cands, refs, idf)
+
+
+async def _run_bertscore(
+    request: HTTPConnection,
+    candidates: list[str],
+    references: list[str],
+    model: str,
+    deadline: float | None = None,
+    job_id: str | None = None,
+    idf_corpus: str | None = None,
+) -> dict:
+    """Score unique candidate/reference pairs within the admission budget and fan results out.
+
+    With `idf_corpus`, tokens are weighted by that registered corpus's IDF table.
+    """
+    app = request.app
+    metrics = app.state.metrics
+    if idf_corpus is not None and not app.state.corpora.exists(idf_corpus):
+        raise HTTPException(404, f"Unknown IDF corpus: {idf_corpus}")
+    job_id = job_id or _job_id(request)
+    pairs, inverse = dedupe(list(zip(candidates, references)))
+    unique_cands = [cand for cand, _ in pairs]
+    unique_refs = [ref for _, ref in pairs]
+    n = len(pairs)
+    batch_size = max(1, int(os.environ.get("GPU_BERTSCORE_BATCH", "16")))
+    started = 0
+    stats: PipelineStats | None = None
+    cost_model = app.state.cost_model
+    # Each distinct sentence is encoded once (see _score_fn), however many pairs it appears in.
+    tokens, cost = cost_model.estimate(model, dict.fromkeys([*unique_cands, *unique_refs]))
+    lane = await _admit(request, "bertscore", model, cost, deadline)
+
+    _start_job(app, job_id, "bertscore", len(candidates), model, cost)
+    outcome = "failed"
+    probe: MemoryProbe | None = None
     try:
-        scorer = await _get_bertscorer(request, req.model_type or DEFAULT_BERTSCORE_MODEL)
-        n = len(req.candidates)
-        logger.info(f"[bertscore] job={job_id} start {n} pair(s), model={req.model_type} - {_vram_mb()}")
+        scorer = await _get_bertscorer(request, model)
+        score = await _score_fn(request, scorer, model, idf_corpus)
+        probe = MemoryProbe(app.state.device, trace=TRACEMALLOC_ENABLED).start()
+        logger.info(
+            f"[bertscore] job={job_id} start {len(candidates)} pair(s) ({n} unique), model={model} - {_vram_mb()}"
+        )
         t0 = time.time()
 
-        P, R, F1 = await asyncio.to_thread(scorer.score, req.candidates, req.references)
-        request.app.state.active_jobs[job_id]["progress"] = 1.0
+        pool = app.state.cpu_pool
+        if pool is not None:
+            batches = [
+                (unique_cands[start:start + batch_size], unique_refs[start:start + batch_size])
+                for start in range(0, n, batch_size)
+            ]
+            stats = PipelineStats(pool.names())
+
+            def _on_batch(idx: int) -> None:
+                done = min(n, stats.completed_items * batch_size)
+                _report_progress(app, job_id, done, n, t0, peak_memory_mb=probe.peak_mb())
+
+            parts = await pool.map(
+                ("bertscore", model),
+                scorer,
+                lambda replica, batch: torch.stack(score(replica, *batch)).cpu().numpy(),
+                batches,
+                stats=stats,
+                on_item=_on_batch,
+            )
+        else:
+            parts = []
+            for start in range(0, n, batch_size):
+                stop = min(n, start + batch_size)
+                started = stop
+                P, R, F1 = await asyncio.to_thread(score, scorer, unique_cands[start:stop], unique_refs[start:stop])
+                parts.append(torch.stack([P, R, F1]).cpu().numpy())
+                _report_progress(app, job_id, stop, n, t0, peak_memory_mb=probe.peak_mb())
+                if n > batch_size:
+                    logger.info(f"[bertscore] job={job_id} batch {stop}/{n} pair(s) - {_vram_mb()}")
+
+        cost_model.observe(model, tokens, time.time() - t0)
+        scores = np.concatenate(parts, axis=1)[:, inverse] if parts else np.empty((3, 0))
+        P, R, F1 = scores[0], scores[1], scores[2]
+        metrics.inc("dedup_items_computed", n)
 
         elapsed = time.time() - t0
-        avg_f1 = sum(F1.tolist()) / len(F1)
+        avg_f1 = float(F1.mean()) if len(F1) else 0.0
         logger.info(f"[bertscore] job={job_id} done in {elapsed:.2f}s - avg F1={avg_f1:.4f} - {_vram_mb()}")
 
-        return BertScoreResponse(
-            precision=P.tolist(),
-            recall=R.tolist(),
-            f1=F1.tolist(),
-            model=req.model_type or DEFAULT_BERTSCORE_MODEL,
-        )
+        outcome = "done"
+        return {"precision": P, "recall": R, "f1": F1, "model": model}
+    except asyncio.CancelledError:
+        # The sub-batch already handed to scorer.score still finishes in its thread.
+        outcome = "cancelled"
+        if stats is not None:
+            started = min(n, stats.started_items * batch_size)
+        _record_cancellation(request, job_id, wasted=started, saved=n - started)
+        raise
     finally:
-        request.app.state.active_jobs.pop(job_id, None)
-        semaphore.release()
+        _finish_job(app, job_id, outcome, probe, tokens)
+        app.state.lanes.release(lane, cost)
 
 
-@app.post("/embed", response_model=EmbedResponse)
-async def embed(req: EmbedRequest, request: Request):
-    try:
-        await asyncio.wait_for(semaphore.acquire(), timeout=1.0)
-    except asyncio.TimeoutError as exc:
-        raise HTTPException(503, "GPU busy - retry later", headers={"Retry-After": "5"}) from exc
+async def _run_bertscore_multi(
+    request: HTTPConnection,
+    candidates: list[str],
+    references: list[list[str]],
+    model: str,
+    deadline: float | None = None,
+    job_id: str | None = None,
+    idf_corpus: str | None = None,
+) -> dict:
+    """Score each candidate against all of its references and keep the best-F1 match.
+
+    Candidates are split into jobs of at most `2 * MAX_BATCH_SIZE` distinct sentences
+    (`<id>-1`, `<id>-2`, ... when there is more than one), each admitted on its own, so
+    every request the validator accepts fits the capacity that admission can grant.
+    """
+    chunks = chunk_candidates(candidates, references, 2 * MAX_BATCH_SIZE)
+    job_id = job_id or _job_id(request)
+    parts, bests = [], []
+    for i, chunk in enumerate(chunks, start=1):
+        cands, refs, offsets = flatten_references(candidates[chunk], references[chunk])
+        payload = await _run_bertscore(
+            request, cands, refs, model, deadline, job_id if len(chunks) == 1 else f"{job_id}-{i}", idf_corpus
+        )
+        scores, best = best_reference(np.stack([payload["precision"], payload["recall"], payload["f1"]]), offsets)
+        parts.append(scores)
+        bests.append(best)
+    scores = np.concatenate(parts, axis=1) if parts else np.empty((3, 0))
+    best = np.concatenate(bests) if bests else np.empty(0, dtype=np.int64)
+    return {"precision": scores[0], "recall": scores[1], "f1": scores[2], "model": model, "best_reference": best}
 
-    job_id = str(uuid.uuid4())
-    request.app.state.active_jobs[job_id] = {
-        "id": job_id,
-        "type": "embed",
-        "started_at": _to_iso(time.time()),
-        "items": len(req.texts),
-        "model": req.model or DEFAULT_EMBED_MODEL,
-        "progress": 0.0,
-    }
 
+@app.post("/bertscore", response_model=BertScoreResponse)
+async def bertscore(req: BertScoreRequest, request: Request):
+    if len(req.candidates) != len(req.references):
+        raise HTTPException(400, "candidates and references must have equal length")
+
+    model = bertscore_key(req.model_type or DEFAULT_BERTSCORE_MODEL, req.num_layers)
+    deadline = _parse_deadline(request)
+    key = payload_key("bertscore", model, [req.candidates, req.references, req.idf_corpus])
+    run = _run_bertscore_multi if is_multi(req.references) else _run_bertscore
+    payload, shared = await _await_shared(
+        request,
+        key,
+        lambda: run(request, req.candidates, req.references, model, deadline, idf_corpus=req.idf_corpus),
+        deadline,
+    )
+    _record_dedup(request, len(req.candidates), shared)
+    return await render_json(payload)
+
+
+async def _run_embed(
+    request: HTTPConnection, texts: list[str], model: str, deadline: float | None = None, job_id: str | None = None
+) -> dict:
+    """Embed the unique texts within the admission budget and fan vectors back out."""
+    app = request.app
+    metrics = app.state.metrics
+    job_id = job_id or _job_id(request)
+    unique, inverse = dedupe(texts)
+    n = len(unique)
+    batch_size = max(1, int(os.environ.get("GPU_EMBED_BATCH", "32")))
+    stats: PipelineStats | None = None
+    cost_model = app.state.cost_model
+    tokens, cost = cost_model.estimate(model, unique)
+    lane = await _admit(request, "embed", model, cost, deadline)
+
+    _start_job(app, job_id, "embed", len(texts), model, cost)
+    outcome = "failed"
+    probe: MemoryProbe | None = None
     try:
-        embedder = await _get_embedder(request, req.model or DEFAULT_EMBED_MODEL)
-        n = len(req.texts)
-        logger.info(f"[embed] job={job_id} start {n} text(s), model={req.model} - {_vram_mb()}")
+        embedder = await _get_embedder(request, model)
+        probe = MemoryProbe(app.state.device, trace=TRACEMALLOC_ENABLED).start()
+        logger.info(f"[embed] job={job_id} start {len(texts)} text(s) ({n} unique), model={model} - {_vram_mb()}")
         t0 = time.time()
 
-        batch_size = max(1, int(os.environ.get("GPU_EMBED_BATCH", "32")))
-        chunks = [req.texts[i:i + batch_size] for i in range(0, n, batch_size)]
-        vectors = []
+        chunks = [unique[i:i + batch_size] for i in range(0, n, batch_size)]
+        pool = app.state.cpu_pool
+        stages = embed_stages(embedder, app.state.device) if pool is None else []
+        stats = PipelineStats(pool.names() if pool is not None else [name for name, _ in stages])
 
-        for idx, chunk in enumerate(chunks, start=1):
-            vecs = await asyncio.to_thread(embedder.encode, chunk, convert_to_numpy=True)
-            vectors.append(vecs)
-            progress = idx / len(chunks)
-            request.app.state.active_jobs[job_id]["progress"] = progress
-            logger.info(f"[embed] job={job_id} batch {idx}/{len(chunks)} ({progress*100:.0f}%) - {_vram_mb()}")
+        def _on_batch(idx: int) -> None:
+            completed = stats.completed_items
+            done = min(n, completed * batch_size)
+            _report_progress(
+                app, job_id, done, n, t0, stage_utilization=stats.utilization(), peak_memory_mb=probe.peak_mb()
+            )
+            logger.info(
+                f"[embed] job={job_id} batch {completed}/{len(chunks)} ({completed / len(chunks) * 100:.0f}%) - {_vram_mb()}"
+            )
 
-        import numpy as np
+        if pool is not None:
+            vectors = await pool.map(
+                ("embed", model),
+                embedder,
+                lambda replica, chunk: replica.encode(chunk, convert_to_numpy=True),
+                chunks,
+                stats=stats,
+                on_item=_on_batch,
+            )
+        else:
+            vectors = await run_pipeline(chunks, stages, stats=stats, on_item=_on_batch)
 
-        merged = np.concatenate(vectors, axis=0) if vectors else np.empty((0, 0))
+        merged = np.concatenate(vectors, axis=0)[inverse] if vectors else np.empty((0, 0))
+        metrics.inc("dedup_items_computed", n)
         elapsed = time.time() - t0
+        cost_model.observe(model, tokens, elapsed)
         dims = int(merged.shape[1]) if merged.size else 0
 
+        utilization = stats.utilization()
+        app.state.active_jobs[job_id]["stage_utilization"] = utilization
         logger.info(f"[embed] job={job_id} done in {elapsed:.2f}s - {dims}d vectors - {_vram_mb()}")
-        return EmbedResponse(
-            embeddings=merged.tolist(),
-            model=req.model or DEFAULT_EMBED_MODEL,
-            dimensions=dims,
+        if len(utilization) > 1:
+            summary = ", ".join(f"{name}={util*100:.0f}%" for name, util in utilization.items())
+            logger.info(f"[embed] job={job_id} stage utilization: {summary} (bottleneck: {stats.bottleneck()})")
+        outcome = "done"
+        return {"embeddings": merged, "model": model, "dimensions": dims}
+    except asyncio.CancelledError:
+        # Batches already handed to the pipeline still finish in their threads.
+        outcome = "cancelled"
+        wasted = min(n, stats.started_items * batch_size) if stats is not None else 0
+        _record_cancellation(request, job_id, wasted=wasted, saved=n - wasted)
+        raise
+    finally:
+        _finish_job(app, job_id, outcome, probe, tokens)
+        app.state.lanes.release(lane, cost)
+
+
+def _shared_results(request: Request) -> SharedResultStore:
+    store = request.app.state.shared_results
+    if store is None:
+        raise HTTPException(400, "shared-memory output is disabled (GPU_SHM_MAX_MB=0)")
+    if not is_local_client(request.client.host if request.client else None):
+        raise HTTPException(403, "shared-memory output is only available to clients on the service host")
+    return store
+
+
+@app.post("/embed", response_model=EmbedResponse | EmbedShmResponse)
+async def embed(req: EmbedRequest, request: Request):
+    model = req.model or DEFAULT_EMBED_MODEL
+    store = _shared_results(request) if req.output == "shm" else None
+    deadline = _parse_deadline(request)
+    key = payload_key("embed", model, req.texts)
+    payload, shared = await _await_shared(
+        request, key, lambda: _run_embed(request, req.texts, model, deadline), deadline
+    )
+    _record_dedup(request, len(req.texts), shared)
+    if store is None:
+        return await render_json(payload)
+    try:
+        # Each caller gets its own lease, also when the computation was shared.
+        vectors = np.asarray(payload["embeddings"], dtype=np.float32)
+        lease = await asyncio.to_thread(store.put, vectors)
+    except SegmentBudgetExceeded as exc:
+        raise HTTPException(507, str(exc)) from exc
+    return await render_json({**lease, "model": payload["model"], "dimensions": payload["dimensions"]})
+
+
+@app.delete("/shm/{handle}", status_code=204)
+async def release_shared_result(handle: str, request: Request):
+    """End the lease on a shared-memory `/embed` result once the client has read it."""
+    store = request.app.state.shared_results
+    try:
+        if store is not None:
+            await asyncio.to_thread(store.release, handle)
+            return Response(status_code=204)
+    except UnknownSegment:
+        pass
+    raise HTTPException(404, f"Unknown or expired segment: {handle}")
+
+
+async def _corpus_info(app: FastAPI, corpus_id: str, created: bool = False) -> CorpusInfo:
+    try:
+        return CorpusInfo(**await asyncio.to_thread(app.state.corpora.info, corpus_id), created=created)
+    except UnknownCorpus as exc:
+        raise HTTPException(404, f"Unknown IDF corpus: {corpus_id}") from exc
+
+
+@app.post("/corpora", response_model=CorpusInfo)
+async def register_corpus(req: CorpusRequest, request: Request):
+    """Store a reference corpus by content hash and compute its IDF table for `model_type`."""
+    corpora = request.app.state.corpora
+    model = req.model_type or DEFAULT_BERTSCORE_MODEL
+    corpus_id, created = await asyncio.to_thread(corpora.register, req.texts)
+    scorer = await _get_bertscorer(request, model)
+    t0 = time.time()
+    await corpora.table(corpus_id, model, scorer._tokenizer)
+    logger.info(
+        f"[idf] corpus {corpus_id} {'registered' if created else 'already known'} "
+        f"({len(req.texts)} document(s)), IDF for {model} ready in {time.time()-t0:.2f}s"
+    )
+    return await _corpus_info(request.app, corpus_id, created)
+
+
+@app.get("/corpora", response_model=CorpusList)
+async def list_corpora(request: Request):
+    ids = await asyncio.to_thread(request.app.state.corpora.ids)
+    return CorpusList(corpora=[await _corpus_info(request.app, corpus_id) for corpus_id in ids])
+
+
+@app.get("/corpora/{corpus_id}", response_model=CorpusInfo)
+async def get_corpus(corpus_id: str, request: Request):
+    return await _corpus_info(request.app, corpus_id)
+
+
+@app.delete("/corpora/{corpus_id}", response_model=CorpusInfo)
+async def delete_corpus(corpus_id: str, request: Request):
+    info = await _corpus_info(request.app, corpus_id)
+    await asyncio.to_thread(request.app.state.corpora.delete, corpus_id)
+    return info
+
+
+def _top_k_similar(query: np.ndarray, candidates: np.ndarray, k: int, device: torch.device) -> tuple[np.ndarray, np.ndarray]:
+    """Indices and cosine similarities of the `k` candidate vectors closest to `query`, computed on `device`."""
+    q = torch.nn.functional.normalize(torch.as_tensor(query, dtype=torch.float32).to(device), dim=0)
+    c = torch.nn.functional.normalize(torch.as_tensor(candidates, dtype=torch.float32).to(device), dim=1)
+    values, indices = torch.topk(c @ q, min(k, len(candidates)))
+    return indices.cpu().numpy(), values.cpu().numpy()
+
+
+async def _run_rerank(
+    request: HTTPConnection,
+    query: str,
+    candidates: list[str],
+    model: str,
+    embed_model: str,
+    top_k: int,
+    deadline: float | None = None,
+    job_id: str | None = None,
+) -> dict:
+    """Embed everything, keep the `top_k` nearest candidates, then rank those by BERTScore F1.
+
+    Each stage is its own job (`<id>-prefilter`, `<id>-score`) admitted on its
+    own lane, so the BERTScore model is only held for the shortlist.
+    """
+    app = request.app
+    job_id = job_id or _job_id(request)
+    t0 = time.perf_counter()
+    # Both stages count toward dedup_items_computed, so count what they are handed too.
+    _record_dedup(request, 1 + len(candidates), False)
+    embedded = await _run_embed(request, [query, *candidates], embed_model, deadline, job_id=f"{job_id}-prefilter")
+    t1 = time.perf_counter()
+    vectors = embedded["embeddings"]
+    if candidates:
+        order, similarity = await asyncio.to_thread(
+            _top_k_similar, vectors[0], vectors[1:], top_k, app.state.device
         )
+    else:
+        order, similarity = np.empty(0, dtype=np.int64), np.empty(0)
+    t2 = time.perf_counter()
+    shortlist = [candidates[i] for i in order]
+    if shortlist:
+        _record_dedup(request, len(shortlist), False)
+        scored = await _run_bertscore(
+            request, shortlist, [query] * len(shortlist), model, deadline, job_id=f"{job_id}-score"
+        )
+    else:
+        scored = {"precision": np.empty(0), "recall": np.empty(0), "f1": np.empty(0)}
+    t3 = time.perf_counter()
+
+    f1 = np.asarray(scored["f1"])
+    results = [
+        {
+            "index": int(order[i]),
+            "score": float(f1[i]),
+            "precision": float(scored["precision"][i]),
+            "recall": float(scored["recall"][i]),
+            "embed_score": float(similarity[i]),
+        }
+        for i in np.argsort(-f1, kind="stable")
+    ]
+    timings = {
+        "embed": (t1 - t0) * 1000,
+        "prefilter": (t2 - t1) * 1000,
+        "bertscore": (t3 - t2) * 1000,
+        "total": (t3 - t0) * 1000,
+    }
+    logger.info(
+        f"[rerank] job={job_id} {len(candidates)} candidate(s) -> {len(shortlist)} shortlisted in "
+        f"{timings['total']:.0f}ms (embed {timings['embed']:.0f}ms, prefilter {timings['prefilter']:.1f}ms, "
+        f"bertscore {timings['bertscore']:.0f}ms)"
+    )
+    return {
+        "results": results,
+        "model": model,
+        "embed_model": embed_model,
+        "candidates": len(candidates),
+        "shortlisted": len(shortlist),
+        "timings_ms": {name: round(ms, 2) for name, ms in timings.items()},
+    }
+
+
+@app.post("/rerank", response_model=RerankResponse)
+async def rerank(req: RerankRequest, request: Request):
+    model = bertscore_key(req.model_type or DEFAULT_BERTSCORE_MODEL, req.num_layers)
+    embed_model = req.embed_model or DEFAULT_EMBED_MODEL
+    deadline = _parse_deadline(request)
+    key = payload_key("rerank", f"{embed_model}>{model}", [req.query, req.candidates, req.top_k])
+    payload, shared = await _await_shared(
+        request,
+        key,
+        lambda: _run_rerank(request, req.query, req.candidates, model, embed_model, req.top_k, deadline),
+        deadline,
+    )
+    if shared:
+        request.app.state.metrics.inc("coalesced_requests")
+    return await render_json(payload)
+
+
+async def _ws_auth_message(websocket: WebSocket) -> bool:
+    """Check a first `{"type": "auth", "api_key": ...}` message, for clients that cannot set headers.
+
+    The key is not accepted as a query parameter: URLs end up in access and
+    proxy logs.
+    """
+    try:
+        body = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+    except WebSocketDisconnect:
+        return False
+    except (asyncio.TimeoutError, ValueError):
+        body = None
+    if isinstance(body, dict) and body.get("type") == "auth" and body.get("api_key") == API_KEY:
+        return True
+    await websocket.close(code=WS_POLICY_VIOLATION)
+    return False
+
+
+@app.websocket("/ws/embed")
+async def ws_embed(websocket: WebSocket):
+    """Pipelined embed/bertscore requests over one authenticated connection.
+
+    Authenticate with the `X-API-Key` header or, without it, an auth message
+    sent first. Each further text message is a tagged request; replies carry the same tag and are
+    sent as soon as they are ready, so they may arrive out of order. Messages
+    for the same model that arrive within `WS_BATCH_WINDOW` share one batch.
+    Once `WS_MAX_INFLIGHT` messages are pending the server stops reading, so a
+    client that sends faster than the GPU drains is slowed down by TCP flow
+    control instead of growing a queue here.
+    """
+    key = websocket.headers.get("X-API-Key")
+    if API_KEY and key is not None and key != API_KEY:
+        await websocket.close(code=WS_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    if API_KEY and key is None and not await _ws_auth_message(websocket):
+        return
+    app = websocket.app
+    metrics = app.state.metrics
+    send_lock = asyncio.Lock()
+    slots = asyncio.Semaphore(WS_MAX_INFLIGHT)
+    tasks: set[asyncio.Task] = set()
+
+    async def run_batch(batch_key: tuple[str, str, str | None], items: list):
+        kind, model, idf_corpus = batch_key
+        metrics.inc("ws_batches")
+        _record_dedup(websocket, len(items), False)
+        if kind == "embed":
+            payload = await _run_embed(websocket, items, model, job_id=str(uuid.uuid4()))
+            return payload["embeddings"]
+        cands, refs = [c for c, _ in items], [r for _, r in items]
+        payload = await _run_bertscore(
+            websocket, cands, refs, model, job_id=str(uuid.uuid4()), idf_corpus=idf_corpus
+        )
+        return np.stack([payload["precision"], payload["recall"], payload["f1"]], axis=1)
+
+    batcher = MicroBatcher(run_batch, max_items=MAX_BATCH_SIZE, window=WS_BATCH_WINDOW)
+
+    async def reply(message: dict) -> None:
+        data = encode_json(message).decode("utf-8")
+        async with send_lock:
+            try:
+                await websocket.send_text(data)
+            except (WebSocketDisconnect, RuntimeError):
+                pass  # the receive loop notices the disconnect and cleans up
+
+    async def handle(raw: str) -> None:
+        tag = None
+        try:
+            try:
+                body = json.loads(raw)
+            except ValueError as exc:
+                raise HTTPException(400, f"Invalid JSON: {exc}") from exc
+            if isinstance(body, dict):
+                tag = body.get("tag")
+            msg = WsMessage.validate_python(body)
+            if msg.type == "embed":
+                if msg.output != "json":
+                    raise HTTPException(400, "shared-memory output is only available on POST /embed")
+                model = msg.model or DEFAULT_EMBED_MODEL
+                vectors = await batcher.submit(("embed", model, None), msg.texts)
+                dims = int(vectors.shape[1]) if vectors.size else 0
+                await reply({"tag": tag, "type": "embed", "embeddings": vectors, "model": model, "dimensions": dims})
+            else:
+                if len(msg.candidates) != len(msg.references):
+                    raise HTTPException(400, "candidates and references must have equal length")
+                model = bertscore_key(msg.model_type or DEFAULT_BERTSCORE_MODEL, msg.num_layers)
+                multi = is_multi(msg.references)
+                if multi:
+                    cands, refs, offsets = flatten_references(msg.candidates, msg.references)
+                else:
+                    cands, refs = msg.candidates, msg.references
+                scores = await batcher.submit(("bertscore", model, msg.idf_corpus), list(zip(cands, refs)))
+                message = {"tag": tag, "type": "bertscore"}
+                if multi:
+                    columns, best = best_reference(scores.T, offsets)
+                    message.update(precision=columns[0], recall=columns[1], f1=columns[2], best_reference=best)
+                else:
+                    message.update(precision=scores[:, 0], recall=scores[:, 1], f1=scores[:, 2])
+                message["model"] = model
+                await reply(message)
+        except ValidationError as exc:
+            await reply({"tag": tag, "status": 422, "error": exc.errors(include_url=False, include_context=False)})
+        except HTTPException as exc:
+            await reply({"tag": tag, "status": exc.status_code, "error": exc.detail})
+        except Exception as exc:
+            logger.exception(f"[ws] message {tag!r} failed")
+            await reply({"tag": tag, "status": 500, "error": str(exc)})
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            raw = await websocket.receive_text()
+            metrics.inc("ws_messages")
+            task = asyncio.ensure_future(handle(raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
     finally:
-        request.app.state.active_jobs.pop(job_id, None)
-        semaphore.release()
+        pending = list(tasks)
+        for task in pending:
+            task.cancel()
+        await batcher.close()
+        await asyncio.gather(*pending, return_exceptions=True)
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:  # offline subcommands, e.g. `embed-file`; see cli.py
+        from cli import main
+
+        sys.exit(main(sys.argv[1:]))
+
     import uvicorn
 
     uvicorn.run(app, host="0.0.0.0", port=8765)
@@ -0,0 +1,230 @@
+"""IDF-weighted BERTScore with a registry of reference corpora.
+
+BERTScore's IDF weighting needs document frequencies over a reference corpus,
+computed with the scoring model's tokenizer. Recomputing them on every call
+would tokenize the whole corpus each time. Clients instead register a corpus
+once. It is stored under `GPU_IDF_DIR` by content hash, and its IDF table is
+computed once per model and kept in memory and on disk. `/bertscore` calls
+then refer to the corpus by that id.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger("gpu-service")
+
+IDF_DIR = os.environ.get("GPU_IDF_DIR") or os.path.join(tempfile.gettempdir(), "gpu-bridge-idf")
+
+TEXTS_FILE = "texts.json"
+META_FILE = "meta.json"
+CORPUS_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class UnknownCorpus(KeyError):
+    """No corpus with this id has been registered."""
+
+
+def corpus_id(texts: list[str]) -> str:
+    """Content hash identifying a corpus (the same texts always get the same id)."""
+    blob = json.dumps(texts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+class IdfTable:
+    """Inverse document frequency per token id, as `bert_score.utils.get_idf_dict` computes it."""
+
+    def __init__(self, documents: int, weights: dict[int, float]):
+        self.documents = documents
+        self.weights = weights
+
+    @classmethod
+    def compute(cls, texts: list[str], tokenizer: Any) -> "IdfTable":
+        from bert_score.utils import get_idf_dict
+
+        # nthreads=0: get_idf_dict would otherwise fork a process pool from a threaded server.
+        idf = get_idf_dict(texts, tokenizer, nthreads=0)
+        return cls(len(texts), {int(token): float(weight) for token, weight in idf.items()})
+
+    @property
+    def default(self) -> float:
+        """Weight of a token that appears in no document."""
+        return math.log(self.documents + 1)
+
+    def idf_dict(self, tokenizer: Any) -> defaultdict:
+        """The `idf_dict` argument for bert_score, with [SEP]/[CLS] zeroed as `bert_score.score` does."""
+        idf = defaultdict(lambda: self.default)
+        idf.update(self.weights)
+        idf[tokenizer.sep_token_id] = 0
+        idf[tokenizer.cls_token_id] = 0
+        return idf
+
+    def to_json(self) -> dict:
+        return {"documents": self.documents, "weights": {str(k): v for k, v in self.weights.items()}}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "IdfTable":
+        return cls(int(data["documents"]), {int(k): float(v) for k, v in data["weights"].items()})
+
+
+def score_with_idf(scorer: Any, cands: list[str], refs: list[str], idf: dict) -> tuple:
+    """`BERTScorer.score` with a per-call IDF dict instead of the scorer's own.
+
+    The scorer is shared by concurrent requests, so its `_idf_dict` cannot be
+    swapped per call; this runs the same computation with `idf` passed in.
+    """
+    from bert_score.utils import bert_cos_score_idf
+
+    preds = bert_cos_score_idf(
+        scorer._model,
+        refs,
+        cands,
+        scorer._tokenizer,
+        idf,
+        device=scorer.device,
+        batch_size=scorer.batch_size,
+        all_layers=scorer.all_layers,
+    ).cpu()
+    if scorer.rescale_with_baseline:
+        preds = (preds - scorer.baseline_vals) / (1 - scorer.baseline_vals)
+    return preds[..., 0], preds[..., 1], preds[..., 2]
+
+
+def _safe(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "._-" else "-" for c in name)
+
+
+class CorpusRegistry:
+    """Reference corpora by content hash, with IDF tables cached per (corpus, model).
+
+    Corpus texts live on disk only; IDF tables are kept in memory and written
+    next to them, so a restarted service reuses every table it computed.
+    """
+
+    def __init__(self, root: str | Path = IDF_DIR):
+        self.root = Path(root)
+        self._tables: dict[tuple[str, str], IdfTable] = {}
+        self._locks: dict[tuple[str, str], asyncio.Lock] = {}
+        self._documents: dict[str, int] = {}
+
+    def _dir(self, cid: str) -> Path:
+        if not CORPUS_ID_PATTERN.fullmatch(cid):  # ids come from URLs; never let one escape the root
+            raise UnknownCorpus(cid)
+        return self.root / cid
+
+    def _table_path(self, cid: str, model: str) -> Path:
+        return self._dir(cid) / f"idf-{_safe(model)}.json"
+
+    def exists(self, cid: str) -> bool:
+        return bool(CORPUS_ID_PATTERN.fullmatch(cid)) and (self._dir(cid) / TEXTS_FILE).is_file()
+
+    def register(self, texts: list[str]) -> tuple[str, bool]:
+        """Store a corpus; returns its id and whether it was new."""
+        cid = corpus_id(texts)
+        if self.exists(cid):
+            return cid, False
+        directory = self._dir(cid)
+        directory.mkdir(parents=True, exist_ok=True)
+        self._save_meta(cid, len(texts))  # before the texts, which are what make the corpus exist
+        tmp = directory / f"{TEXTS_FILE}.tmp"
+        tmp.write_text(json.dumps(texts, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(directory / TEXTS_FILE)
+        return cid, True
+
+    def _save_meta(self, cid: str, documents: int) -> None:
+        tmp = self._dir(cid) / f"{META_FILE}.tmp"
+        tmp.write_text(json.dumps({"documents": documents}), encoding="utf-8")
+        tmp.replace(self._dir(cid) / META_FILE)
+        self._documents[cid] = documents
+
+    def documents(self, cid: str) -> int:
+        """Number of texts in corpus `cid`, from memory or its small metadata file."""
+        count = self._documents.get(cid)
+        if count is not None:
+            return count
+        if not self.exists(cid):
+            raise UnknownCorpus(cid)
+        try:
+            count = int(json.loads((self._dir(cid) / META_FILE).read_text(encoding="utf-8"))["documents"])
+        except (OSError, ValueError, KeyError):
+            # Registered before counts were stored: count once and remember it.
+            self._save_meta(cid, len(self.texts(cid)))
+            return self._documents[cid]
+        self._documents[cid] = count
+        return count
+
+    def texts(self, cid: str) -> list[str]:
+        try:
+            return json.loads((self._dir(cid) / TEXTS_FILE).read_text(encoding="utf-8"))
+        except FileNotFoundError as exc:
+            raise UnknownCorpus(cid) from exc
+
+    def _load_table(self, cid: str, model: str) -> IdfTable | None:
+        path = self._table_path(cid, model)
+        try:
+            return IdfTable.from_json(json.loads(path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as exc:
+            logger.warning(f"[idf] ignoring unreadable table {path}: {exc}")
+            return None
+
+    def _save_table(self, cid: str, model: str, table: IdfTable) -> None:
+        path = self._table_path(cid, model)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(table.to_json()), encoding="utf-8")
+        tmp.replace(path)
+
+    async def table(self, cid: str, model: str, tokenizer: Any) -> IdfTable:
+        """The IDF table of corpus `cid` for `model`: from memory, else disk, else computed once."""
+        key = (cid, model)
+        table = self._tables.get(key)
+        if table is not None:
+            return table
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            table = self._tables.get(key)
+            if table is None:
+                table = await asyncio.to_thread(self._load_or_compute, cid, model, tokenizer)
+                self._tables[key] = table
+        return table
+
+    def _load_or_compute(self, cid: str, model: str, tokenizer: Any) -> IdfTable:
+        table = self._load_table(cid, model)
+        if table is not None:
+            return table
+        texts = self.texts(cid)
+        table = IdfTable.compute(texts, tokenizer)
+        self._save_table(cid, model, table)
+        logger.info(f"[idf] computed IDF for corpus {cid} ({len(texts)} document(s)) with {model}")
+        return table
+
+    def models(self, cid: str) -> list[str]:
+        """Models with an IDF table for `cid` in memory (tables only on disk are loaded on first use)."""
+        return sorted(model for c, model in self._tables if c == cid)
+
+    def info(self, cid: str) -> dict:
+        return {"id": cid, "documents": self.documents(cid), "models": self.models(cid)}
+
+    def ids(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / TEXTS_FILE).is_file())
+
+    def delete(self, cid: str) -> None:
+        if not self.exists(cid):
+            raise UnknownCorpus(cid)
+        for key in [key for key in self._tables if key[0] == cid]:
+            del self._tables[key]
+            self._locks.pop(key, None)
+        self._documents.pop(cid, None)
+        shutil.rmtree(self._dir(cid), ignore_errors=True)
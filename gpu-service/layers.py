@@ -0,0 +1,87 @@
+"""Layer-truncated BERTScore models.
+
+BERTScore reads the hidden states of one intermediate layer (`num_layers`,
+by default bert_score's per-model choice, e.g. 40 of 48 for
+`microsoft/deberta-xlarge-mnli`). `bert_score.utils.get_model` already drops
+the transformer layers above it before the model is moved to the device.
+What it keeps is the pooler head of BERT-style models, which runs on every
+forward pass and whose output BERTScore never reads. `strip_unused` drops
+it, and `layer_report` records how much of the full model is no longer
+resident.
+
+A request may pick another scoring layer. The cached scorer is then keyed
+`<model>@<num_layers>` (see `bertscore_key`), so each layer choice is a
+separate model for caching, admission and snapshots.
+"""
+
+from typing import Any
+
+import torch
+
+from residency import module_bytes, torch_module
+
+# Stored in a truncated snapshot's config so reports still know the full depth.
+TOTAL_LAYERS_ATTR = "bertscore_total_layers"
+
+
+def default_layers(model_type: str) -> int | None:
+    """bert_score's default scoring layer for `model_type`, if it has one."""
+    try:
+        from bert_score.utils import model2layers
+    except ImportError:
+        return None
+    return model2layers.get(model_type)
+
+
+def bertscore_key(model_type: str, num_layers: int | None = None) -> str:
+    """Cache key for a scorer; the default layer keeps the plain model name."""
+    if num_layers is None or num_layers == default_layers(model_type):
+        return model_type
+    return f"{model_type}@{num_layers}"
+
+
+def parse_bertscore_key(key: str) -> tuple[str, int | None]:
+    model_type, sep, layers = key.rpartition("@")
+    if sep and layers.isdigit():
+        return model_type, int(layers)
+    return key, None
+
+
+def _layer_list(module: torch.nn.Module) -> torch.nn.ModuleList | None:
+    encoder = getattr(module, "encoder", None)
+    for owner in (encoder, module, getattr(module, "transformer", None)):
+        layers = getattr(owner, "layer", None) if owner is not None else None
+        if isinstance(layers, torch.nn.ModuleList):
+            return layers
+    return None
+
+
+def strip_unused(scorer: Any) -> int:
+    """Drop the pooler head BERTScore never reads; returns the bytes freed."""
+    module = torch_module(scorer)
+    pooler = getattr(module, "pooler", None) if module is not None else None
+    if not isinstance(pooler, torch.nn.Module):
+        return 0
+    freed = module_bytes(pooler)
+    module.pooler = None
+    return freed
+
+
+def layer_report(scorer: Any, model: str, stripped_bytes: int = 0) -> dict | None:
+    """Scoring layer, full depth, resident size and the estimated size of what was dropped."""
+    module = torch_module(scorer)
+    layers = _layer_list(module) if module is not None else None
+    if layers is None:
+        return None
+    config = getattr(module, "config", None)
+    kept = len(layers)
+    total = getattr(config, TOTAL_LAYERS_ATTR, None) or getattr(config, "num_hidden_layers", kept)
+    total = max(int(total), kept)
+    per_layer = module_bytes(layers[0]) if kept else 0
+    return {
+        "model": model,
+        "num_layers": kept,
+        "total_layers": total,
+        "size_mb": round(module_bytes(module) / 2**20, 1),
+        "saved_mb": round(((total - kept) * per_layer + stripped_bytes) / 2**20, 1),
+    }
@@ -0,0 +1,131 @@
+"""Cheap load signal for client-side load balancing.
+
+`/info` queries the device on every call, and VRAM in use says little about
+how long a new request would wait. `LoadMonitor` keeps a snapshot of what
+does: queued requests and in-flight cost per admission lane, an EWMA of job
+service time per kind and the device's free memory. A background task
+rebuilds it every `GPU_LOAD_REFRESH_MS`, and `/load` serves the pre-encoded
+bytes with an ETag of their content, so an unchanged snapshot costs a
+polling client a `304` and no device calls at all.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import torch
+
+from admission import LaneRouter
+from serialization import encode_json
+
+logger = logging.getLogger("gpu-service")
+
+LOAD_REFRESH_SECONDS = float(os.environ.get("GPU_LOAD_REFRESH_MS", "250")) / 1000
+# Weight of the newest job in the per-kind service-time EWMA.
+SERVICE_TIME_ALPHA = 0.2
+# Free memory is reported in steps of this many MB so that jitter does not change the ETag.
+MEMORY_STEP_MB = 64
+
+
+def memory_headroom(device: torch.device) -> dict:
+    """Free and total memory (MB) of `device`: VRAM on CUDA, available host RAM otherwise."""
+    free = total = None
+    if device.type == "cuda":
+        free, total = torch.cuda.mem_get_info(device)
+    else:
+        try:
+            with open("/proc/meminfo") as f:
+                fields = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f}
+            free, total = fields["MemAvailable"], fields["MemTotal"]
+        except (OSError, KeyError, ValueError, IndexError):
+            try:
+                import psutil
+            except ImportError:
+                return {"free_mb": None, "total_mb": None}
+            vm = psutil.virtual_memory()
+            free, total = vm.available, vm.total
+    free_mb = int(free / 2**20) // MEMORY_STEP_MB * MEMORY_STEP_MB
+    return {"free_mb": free_mb, "total_mb": int(total / 2**20)}
+
+
+class LoadMonitor:
+    """Pre-encoded load snapshot plus the job timings it summarizes."""
+
+    def __init__(self, device: torch.device, interval: float = LOAD_REFRESH_SECONDS):
+        self.device = device
+        self.interval = interval
+        self._started: dict[str, float] = {}
+        self._service_s: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._body: bytes | None = None
+        self.etag: str | None = None
+        self.refreshed_at = 0.0
+
+    def job_started(self, job_id: str) -> None:
+        self._started[job_id] = time.monotonic()
+
+    def job_finished(self, job_id: str, kind: str, ok: bool) -> None:
+        """Fold a finished job into its kind's service-time EWMA (failed and cancelled jobs are skipped)."""
+        t0 = self._started.pop(job_id, None)
+        if t0 is None or not ok:
+            return
+        sample = time.monotonic() - t0
+        with self._lock:
+            prev = self._service_s.get(kind)
+            self._service_s[kind] = (
+                sample if prev is None else (1 - SERVICE_TIME_ALPHA) * prev + SERVICE_TIME_ALPHA * sample
+            )
+
+    def snapshot(self, router: LaneRouter) -> dict:
+        lanes = []
+        for lane in router.lanes():
+            budget = lane.budget
+            lanes.append({
+                "name": lane.name,
+                "queued": budget.queued,
+                "jobs": budget.jobs,
+                "in_use_units": round(budget.in_use, 1),
+                "capacity_units": round(budget.capacity, 1) if budget.capacity != float("inf") else None,
+            })
+        shared = router.global_budget
+        capacity = sum(lane["capacity_units"] or 0.0 for lane in lanes)
+        in_use = sum(lane["in_use_units"] for lane in lanes)
+        if shared is not None and shared.capacity != float("inf"):
+            capacity, in_use = shared.capacity, shared.in_use
+        with self._lock:
+            service_ms = {kind: round(seconds * 1000, 1) for kind, seconds in sorted(self._service_s.items())}
+        return {
+            "queued": sum(lane["queued"] for lane in lanes) + (shared.queued if shared is not None else 0),
+            "jobs": sum(lane["jobs"] for lane in lanes),
+            "in_use_units": round(in_use, 1),
+            "capacity_units": round(capacity, 1),
+            "utilization": round(min(1.0, in_use / capacity), 3) if capacity else 0.0,
+            "service_ms": service_ms,
+            "memory": memory_headroom(self.device),
+            "lanes": lanes,
+        }
+
+    def refresh(self, router: LaneRouter) -> None:
+        body = encode_json(self.snapshot(router))
+        if body != self._body:
+            self._body = body
+            self.etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        self.refreshed_at = time.monotonic()
+
+    def current(self, router: LaneRouter) -> tuple[bytes, str]:
+        """The latest snapshot and its ETag, rebuilt here only if the background refresh is not keeping up."""
+        if self._body is None or time.monotonic() - self.refreshed_at > 2 * self.interval:
+            self.refresh(router)
+        return self._body, self.etag
+
+    async def run(self, router: LaneRouter) -> None:
+        """Background refresh; cancel the task to stop it."""
+        while True:
+            try:
+                self.refresh(router)
+            except Exception as exc:  # keep serving the previous snapshot
+                logger.warning(f"[load] refresh failed: {exc}")
+            await asyncio.sleep(self.interval)
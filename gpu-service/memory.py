@@ -0,0 +1,177 @@
+"""Per-job peak memory accounting.
+
+`MemoryProbe` measures how much memory one job pushed the process to: peak
+device allocation on CUDA (via the allocator's peak counters) or peak RSS
+growth on CPU (via a sampling thread). `MemoryHistory` keeps a rolling window
+of those measurements together with the request shape, so batch limits can be
+derived from data. With `GPU_TRACEMALLOC=1`, probes also diff `tracemalloc`
+snapshots to find host-side allocation hotspots in the request path.
+"""
+
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict, deque
+
+import torch
+
+HISTORY_SIZE = int(os.environ.get("GPU_MEMORY_HISTORY", "512"))
+RSS_SAMPLE_SECONDS = float(os.environ.get("GPU_MEMORY_SAMPLE_MS", "10")) / 1000
+TRACEMALLOC_ENABLED = os.environ.get("GPU_TRACEMALLOC", "0").lower() in ("1", "true", "yes")
+TRACEMALLOC_FRAMES = 10
+HOTSPOTS_PER_JOB = 10
+
+_MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int | None:
+    """Current resident set size of this process, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def start_tracemalloc() -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+class MemoryProbe:
+    """Measure the peak memory growth of one job.
+
+    On CUDA the peak counter is process-wide. It is reset only when a probe
+    starts while no other probe on the device is active, so starting a job
+    never wipes the peaks of jobs already running. A job that overlaps others
+    reports the device's high-water mark since the earliest of them started,
+    minus its own starting allocation: an upper bound on its own growth.
+    """
+
+    # Active CUDA probes per device; guarded by `_active_lock`.
+    _active: dict[torch.device, int] = {}
+    _active_lock = threading.Lock()
+
+    def __init__(self, device: torch.device, trace: bool = False):
+        self.device = device
+        self.trace = trace and tracemalloc.is_tracing()
+        self.baseline = 0
+        self._peak = 0
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._counted = False
+        self.hotspots: list[tuple[str, int]] = []
+
+    def start(self) -> "MemoryProbe":
+        if self.device.type == "cuda":
+            with MemoryProbe._active_lock:
+                if not MemoryProbe._active.get(self.device):
+                    torch.cuda.reset_peak_memory_stats(self.device)
+                MemoryProbe._active[self.device] = MemoryProbe._active.get(self.device, 0) + 1
+                self._counted = True
+            self.baseline = torch.cuda.memory_allocated(self.device)
+        else:
+            self.baseline = rss_bytes() or 0
+            self._peak = self.baseline
+            self._sampler = threading.Thread(target=self._sample, name="memory-probe", daemon=True)
+            self._sampler.start()
+        if self.trace:
+            self._snapshot = tracemalloc.take_snapshot()
+        return self
+
+    def _sample(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            rss = rss_bytes()
+            if rss is not None and rss > self._peak:
+                self._peak = rss
+
+    def peak_mb(self) -> float:
+        """Peak growth above the starting point so far, in MB."""
+        if self.device.type == "cuda":
+            peak = torch.cuda.max_memory_allocated(self.device)
+        else:
+            rss = rss_bytes() or 0
+            peak = max(self._peak, rss)
+        return round(max(0, peak - self.baseline) / _MB, 1)
+
+    def stop(self) -> float:
+        peak = self.peak_mb()
+        if self._counted:
+            with MemoryProbe._active_lock:
+                MemoryProbe._active[self.device] -= 1
+            self._counted = False
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1.0)
+        if self._snapshot is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+            self.hotspots = [
+                (str(stat.traceback[0]), stat.size_diff) for stat in diff[:HOTSPOTS_PER_JOB] if stat.size_diff > 0
+            ]
+        return peak
+
+
+class MemoryHistory:
+    """Rolling window of (request shape, peak memory) records plus aggregated hotspots."""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.records: deque[dict] = deque(maxlen=size)
+        self.hotspots: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, job_type: str, model: str, items: int, tokens: int, peak_mb: float,
+               hotspots: list[tuple[str, int]] | None = None) -> None:
+        with self._lock:
+            self.records.append({
+                "type": job_type,
+                "model": model,
+                "items": items,
+                "tokens": tokens,
+                "peak_mb": peak_mb,
+                "at": time.time(),
+            })
+            for location, size in hotspots or ():
+                self.hotspots[location] += size
+
+    def recent(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            return list(self.records)[-limit:]
+
+    def top_hotspots(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            return [{"location": loc, "bytes": size} for loc, size in self.hotspots.most_common(limit)]
+
+    def stats(self) -> list[dict]:
+        """Per (type, model): peak memory summary and a least-squares fit of MB against tokens."""
+        groups: dict[tuple[str, str], list[dict]] = defaultdict(list)
+        with self._lock:
+            for rec in self.records:
+                groups[(rec["type"], rec["model"])].append(rec)
+
+        result = []
+        for (job_type, model), recs in sorted(groups.items()):
+            xs = [r["tokens"] for r in recs]
+            ys = [r["peak_mb"] for r in recs]
+            n = len(recs)
+            mean_x, mean_y = sum(xs) / n, sum(ys) / n
+            var_x = sum((x - mean_x) ** 2 for x in xs)
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x if var_x else None
+            result.append({
+                "type": job_type,
+                "model": model,
+                "samples": n,
+                "max_tokens": max(xs),
+                "max_peak_mb": max(ys),
+                "mean_peak_mb": round(mean_y, 1),
+                "mb_per_1k_tokens": round(slope * 1000, 3) if slope is not None else None,
+                "intercept_mb": round(mean_y - slope * mean_x, 1) if slope is not None else None,
+            })
+        return result
@@ -0,0 +1,31 @@
+"""In-process service counters exposed on `/metrics`."""
+
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread-safe monotonically increasing counters."""
+
+    def __init__(self):
+        self._counters: dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0.0)
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def dedup_ratio(self) -> float:
+        """Fraction of submitted items that were served without being computed."""
+        submitted = self.get("dedup_items_submitted")
+        if not submitted:
+            return 0.0
+        return round(1.0 - self.get("dedup_items_computed") / submitted, 4)
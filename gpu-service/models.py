@@ -1,30 +1,46 @@
 """Pydantic request/response models."""
 
-from pydantic import BaseModel, Field, field_validator
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 import os
 
 MAX_BATCH_SIZE = int(os.environ.get("GPU_MAX_BATCH_SIZE", "100"))
 MAX_TEXT_LENGTH = int(os.environ.get("GPU_MAX_TEXT_LENGTH", "10000"))
+MAX_RERANK_CANDIDATES = int(os.environ.get("GPU_MAX_RERANK_CANDIDATES", "5000"))
+MAX_CORPUS_DOCUMENTS = int(os.environ.get("GPU_MAX_CORPUS_DOCUMENTS", "100000"))
 
 
 class BertScoreRequest(BaseModel):
     candidates: list[str]
-    references: list[str]
+    # One reference per candidate, or a list of references per candidate (scored against the best one).
+    references: list[str] | list[list[str]]
     lang: str = "en"
     model_type: str = "microsoft/deberta-xlarge-mnli"
+    idf_corpus: str | None = None
+    num_layers: int | None = Field(None, ge=1)
 
     @field_validator("candidates", "references")
     @classmethod
-    def validate_batch_size(cls, v: list[str], info) -> list[str]:
+    def validate_batch_size(cls, v: list, info) -> list:
         if len(v) > MAX_BATCH_SIZE:
             raise ValueError(
                 f"{info.field_name} array length {len(v)} exceeds max batch size of {MAX_BATCH_SIZE}"
             )
-        for i, text in enumerate(v):
-            if len(text) > MAX_TEXT_LENGTH:
-                raise ValueError(
-                    f"{info.field_name}[{i}] length {len(text)} exceeds max text length of {MAX_TEXT_LENGTH}"
-                )
+        for i, item in enumerate(v):
+            if isinstance(item, str):
+                if len(item) > MAX_TEXT_LENGTH:
+                    raise ValueError(
+                        f"{info.field_name}[{i}] length {len(item)} exceeds max text length of {MAX_TEXT_LENGTH}"
+                    )
+                continue
+            if not 1 <= len(item) <= MAX_BATCH_SIZE:
+                raise ValueError(f"{info.field_name}[{i}] must hold 1 to {MAX_BATCH_SIZE} references")
+            for j, text in enumerate(item):
+                if len(text) > MAX_TEXT_LENGTH:
+                    raise ValueError(
+                        f"{info.field_name}[{i}][{j}] length {len(text)} exceeds max text length of {MAX_TEXT_LENGTH}"
+                    )
         return v
 
 
@@ -33,11 +49,15 @@ class BertScoreResponse(BaseModel):
     recall: list[float]
     f1: list[float]
     model: str
+    # Index of the best-matching reference per candidate; only for multi-reference requests.
+    best_reference: list[int] | None = None
 
 
 class EmbedRequest(BaseModel):
     texts: list[str]
     model: str = "all-MiniLM-L6-v2"
+    # "shm": write the vectors to a shared-memory segment and return its handle (local clients only).
+    output: Literal["json", "shm"] = "json"
 
     @field_validator("texts")
     @classmethod
@@ -54,15 +74,228 @@ class EmbedRequest(BaseModel):
         return v
 
 
+class WsEmbedMessage(EmbedRequest):
+    """One tagged embed request on the `/ws/embed` connection."""
+    type: Literal["embed"]
+    tag: str
+
+
+class WsBertScoreMessage(BertScoreRequest):
+    """One tagged BERTScore request on the `/ws/embed` connection."""
+    type: Literal["bertscore"]
+    tag: str
+
+
+WsMessage = TypeAdapter(Annotated[WsEmbedMessage | WsBertScoreMessage, Field(discriminator="type")])
+
+
 class EmbedResponse(BaseModel):
     embeddings: list[list[float]]
     model: str
     dimensions: int
 
 
+class EmbedShmResponse(BaseModel):
+    """`/embed` reply for `output="shm"`: where to map the vectors, and until when."""
+    handle: str
+    path: str
+    shape: list[int]
+    dtype: str
+    offset: int
+    expires_at: float
+    model: str
+    dimensions: int
+
+
+class CorpusRequest(BaseModel):
+    texts: list[str]
+    model_type: str = "microsoft/deberta-xlarge-mnli"
+
+    @field_validator("texts")
+    @classmethod
+    def validate_texts(cls, v: list[str]) -> list[str]:
+        if not v:
+            raise ValueError("texts must not be empty")
+        if len(v) > MAX_CORPUS_DOCUMENTS:
+            raise ValueError(
+                f"texts array length {len(v)} exceeds max corpus size of {MAX_CORPUS_DOCUMENTS}"
+            )
+        for i, text in enumerate(v):
+            if len(text) > MAX_TEXT_LENGTH:
+                raise ValueError(
+                    f"texts[{i}] length {len(text)} exceeds max text length of {MAX_TEXT_LENGTH}"
+                )
+        return v
+
+
+class CorpusInfo(BaseModel):
+    id: str
+    documents: int
+    models: list[str] = Field(default_factory=list)
+    created: bool = False
+
+
+class CorpusList(BaseModel):
+    corpora: list[CorpusInfo] = Field(default_factory=list)
+
+
+class RerankRequest(BaseModel):
+    query: str
+    candidates: list[str]
+    top_k: int = Field(20, ge=1)
+    model_type: str = "microsoft/deberta-xlarge-mnli"
+    num_layers: int | None = Field(None, ge=1)
+    embed_model: str = "all-MiniLM-L6-v2"
+
+    @field_validator("query")
+    @classmethod
+    def validate_query(cls, v: str) -> str:
+        if len(v) > MAX_TEXT_LENGTH:
+            raise ValueError(f"query length {len(v)} exceeds max text length of {MAX_TEXT_LENGTH}")
+        return v
+
+    @field_validator("candidates")
+    @classmethod
+    def validate_candidates(cls, v: list[str]) -> list[str]:
+        if len(v) > MAX_RERANK_CANDIDATES:
+            raise ValueError(
+                f"candidates array length {len(v)} exceeds max rerank candidates of {MAX_RERANK_CANDIDATES}"
+            )
+        for i, text in enumerate(v):
+            if len(text) > MAX_TEXT_LENGTH:
+                raise ValueError(
+                    f"candidates[{i}] length {len(text)} exceeds max text length of {MAX_TEXT_LENGTH}"
+                )
+        return v
+
+    @field_validator("top_k")
+    @classmethod
+    def validate_top_k(cls, v: int) -> int:
+        if v > MAX_BATCH_SIZE:
+            raise ValueError(f"top_k {v} exceeds max batch size of {MAX_BATCH_SIZE}")
+        return v
+
+
+class RerankResult(BaseModel):
+    index: int
+    score: float
+    precision: float
+    recall: float
+    embed_score: float
+
+
+class RerankResponse(BaseModel):
+    results: list[RerankResult]
+    model: str
+    embed_model: str
+    candidates: int
+    shortlisted: int
+    timings_ms: dict[str, float] = Field(default_factory=dict)
+
+
 class HealthResponse(BaseModel):
     status: str = "ok"
     device: str
+    # Content-Encodings accepted on request bodies; clients compress only when listed here
+    request_encodings: list[str] = Field(default_factory=list)
+
+
+class ModelResidency(BaseModel):
+    model: str
+    state: Literal["device", "host", "file"]
+    size_mb: float
+    idle_seconds: float
+    offloads: int = 0
+    promotions: int = 0
+    last_promotion_ms: float | None = None
+    mean_promotion_ms: float | None = None
+
+
+class CpuReplicaStatus(BaseModel):
+    name: str
+    cores: list[int]
+    threads: int
+    inflight: int
+    completed: int
+    busy_seconds: float
+
+
+class BertScoreLayers(BaseModel):
+    model: str
+    num_layers: int
+    total_layers: int
+    size_mb: float
+    saved_mb: float
+
+
+class TokenCacheStatus(BaseModel):
+    entries: int
+    bytes: int
+    budget_bytes: int
+    dtype: str
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+
+
+class SharedResultsStatus(BaseModel):
+    dir: str
+    segments: int
+    bytes: int
+    budget_bytes: int
+    ttl_seconds: float
+    leased: int
+    released: int
+    expired: int
+
+
+class LoadLane(BaseModel):
+    name: str
+    queued: int
+    jobs: int
+    in_use_units: float
+    capacity_units: float | None = None
+
+
+class MemoryHeadroom(BaseModel):
+    free_mb: int | None = None
+    total_mb: int | None = None
+
+
+class LoadResponse(BaseModel):
+    queued: int
+    jobs: int
+    in_use_units: float
+    capacity_units: float
+    utilization: float
+    service_ms: dict[str, float] = Field(default_factory=dict)
+    memory: MemoryHeadroom
+    lanes: list[LoadLane] = Field(default_factory=list)
+
+
+class WarmupShape(BaseModel):
+    batch_size: int
+    tokens: int
+    first_ms: float
+    warm_ms: float
+
+
+class WarmupReport(BaseModel):
+    seconds: float
+    shapes: list[WarmupShape] = Field(default_factory=list)
+
+
+class ModelReadiness(BaseModel):
+    kind: Literal["bertscore", "embed"]
+    model: str
+    state: Literal["loading", "warming", "ready"]
+    warmup: WarmupReport | None = None
+
+
+class ReadyResponse(BaseModel):
+    ready: bool
+    models: list[ModelReadiness] = Field(default_factory=list)
 
 
 class InfoResponse(BaseModel):
@@ -73,6 +306,24 @@ class InfoResponse(BaseModel):
     pytorch_version: str
     cuda_version: str | None = None
     loaded_models: list[str] = Field(default_factory=list)
+    offload_idle_seconds: float | None = None
+    residency: list[ModelResidency] = Field(default_factory=list)
+    cpu_replicas: list[CpuReplicaStatus] = Field(default_factory=list)
+    token_cache: TokenCacheStatus | None = None
+    bertscore_layers: list[BertScoreLayers] = Field(default_factory=list)
+    shared_results: SharedResultsStatus | None = None
+
+
+class LaneStatus(BaseModel):
+    name: str
+    capacity_units: float | None = None
+    in_use_units: float
+    available_units: float | None = None
+    jobs: int
+    max_jobs: int | None = None
+    queued: int
+    max_queue: int | None = None
+    timeout_s: float | None = None
 
 
 class QueueStatus(BaseModel):
@@ -80,6 +331,12 @@ class QueueStatus(BaseModel):
     in_flight: int
     available_slots: int
     waiting_estimate: int
+    capacity_units: float | None = None
+    in_use_units: float | None = None
+    available_units: float | None = None
+    cost_factors: dict[str, float] = Field(default_factory=dict)
+    lanes: list[LaneStatus] = Field(default_factory=list)
+    global_budget: LaneStatus | None = None
 
 
 class JobStatus(BaseModel):
@@ -89,8 +346,51 @@ class JobStatus(BaseModel):
     items: int
     model: str
     progress: float
+    cost: float | None = None
+    items_per_sec: float | None = None
+    eta_seconds: float | None = None
+    stage_utilization: dict[str, float] | None = None
+    peak_memory_mb: float | None = None
 
 
 class StatusResponse(BaseModel):
     queue: QueueStatus
     active_jobs: list[JobStatus] = Field(default_factory=list)
+
+
+class MetricsResponse(BaseModel):
+    counters: dict[str, float] = Field(default_factory=dict)
+    dedup_ratio: float = 0.0
+
+
+class MemoryModelStats(BaseModel):
+    type: str
+    model: str
+    samples: int
+    max_tokens: int
+    max_peak_mb: float
+    mean_peak_mb: float
+    mb_per_1k_tokens: float | None = None
+    intercept_mb: float | None = None
+
+
+class MemoryRecord(BaseModel):
+    type: str
+    model: str
+    items: int
+    tokens: int
+    peak_mb: float
+    at: float
+
+
+class MemoryHotspot(BaseModel):
+    location: str
+    bytes: int
+
+
+class MemoryStatsResponse(BaseModel):
+    device: str
+    tracemalloc: bool = False
+    models: list[MemoryModelStats] = Field(default_factory=list)
+    recent: list[MemoryRecord] = Field(default_factory=list)
+    hotspots: list[MemoryHotspot] = Field(default_factory=list)
@@ -0,0 +1,62 @@
+"""Multi-reference BERTScore.
+
+A candidate scored against K references is conventionally credited with its
+best match. `flatten_references` expands `references: list[list[str]]` into
+candidate-major pairs so they go through the normal pair path (deduplicated,
+batched, and each unique sentence encoded once per job through the
+token-embedding cache). `chunk_candidates` splits a large request into jobs
+that each fit admission. `best_reference` folds the pair scores back into one
+P/R/F1 per candidate, taken from the reference with the highest F1.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def is_multi(references: Sequence) -> bool:
+    return any(not isinstance(ref, str) for ref in references)
+
+
+def flatten_references(
+    candidates: Sequence[str], references: Sequence[Sequence[str]]
+) -> tuple[list[str], list[str], np.ndarray]:
+    """Return `(cands, refs, offsets)`; candidate i owns pairs `offsets[i]:offsets[i + 1]`."""
+    cands: list[str] = []
+    refs: list[str] = []
+    for cand, group in zip(candidates, references):
+        cands.extend([cand] * len(group))
+        refs.extend(group)
+    offsets = np.zeros(len(references) + 1, dtype=np.int64)
+    np.cumsum([len(group) for group in references], out=offsets[1:])
+    return cands, refs, offsets
+
+
+def chunk_candidates(
+    candidates: Sequence[str], references: Sequence[Sequence[str]], max_texts: int
+) -> list[slice]:
+    """Split candidates into consecutive runs of at most `max_texts` distinct sentences each.
+
+    A candidate is never split from its references; one that alone exceeds
+    `max_texts` gets a run of its own.
+    """
+    chunks: list[slice] = []
+    start = 0
+    texts: set[str] = set()
+    for i, (cand, group) in enumerate(zip(candidates, references)):
+        mine = {cand, *group}
+        if i > start and len(texts | mine) > max_texts:
+            chunks.append(slice(start, i))
+            start, texts = i, set()
+        texts |= mine
+    if start < len(candidates):
+        chunks.append(slice(start, len(candidates)))
+    return chunks
+
+
+def best_reference(scores: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Reduce `(3, pairs)` P/R/F1 to `(3, candidates)` plus each candidate's best reference index."""
+    best = np.array(
+        [int(np.argmax(scores[2, start:stop])) for start, stop in zip(offsets[:-1], offsets[1:])], dtype=np.int64
+    )
+    return scores[:, offsets[:-1] + best], best
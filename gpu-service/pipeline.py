@@ -0,0 +1,171 @@
+"""Pipelined batch execution for embedding jobs.
+
+`SentenceTransformer.encode` tokenizes on the CPU, runs the model and copies
+the result back to the host strictly in sequence, so the device idles during
+tokenization and host copies. `run_pipeline` splits the work into stages that
+each own a single worker thread: while batch k runs its forward pass, batch
+k+1 is being tokenized and batch k-1 is being copied back.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Sequence
+
+import torch
+
+PIPELINE_ENABLED = os.environ.get("GPU_EMBED_PIPELINE", "1").lower() not in ("0", "false", "no")
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+Stage = tuple[str, Callable[[Any], Any]]
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Return the single-worker executor that runs stage `name`."""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pipeline-{name}")
+            _executors[name] = executor
+        return executor
+
+
+class PipelineStats:
+    """Busy time per stage, used to report utilization and the bottleneck stage."""
+
+    def __init__(self, stage_names: Sequence[str]):
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        self.busy = {name: 0.0 for name in stage_names}
+        self.started_items = 0
+        self.completed_items = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.busy[name] += seconds
+
+    @property
+    def wall(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return max(end - self.started, 1e-9)
+
+    def utilization(self) -> dict[str, float]:
+        """Fraction of wall time each stage spent working (0.0 - 1.0)."""
+        wall = self.wall
+        with self._lock:
+            return {name: round(min(1.0, busy / wall), 3) for name, busy in self.busy.items()}
+
+    def bottleneck(self) -> str | None:
+        if not self.busy:
+            return None
+        with self._lock:
+            return max(self.busy, key=self.busy.get)
+
+
+async def run_pipeline(
+    items: Sequence[Any],
+    stages: Sequence[Stage],
+    stats: PipelineStats | None = None,
+    on_item: Callable[[int], None] | None = None,
+) -> list[Any]:
+    """Push every item through `stages` with the stages overlapping across items.
+
+    Each stage runs on its own single-worker thread, so at most one item is in
+    a given stage at a time. At most `len(stages)` items are in flight, which
+    bounds the memory held by tokenized or not-yet-copied batches. Results are
+    returned in input order; `on_item(index)` is called as each item finishes.
+    """
+    loop = asyncio.get_running_loop()
+    stats = stats or PipelineStats([name for name, _ in stages])
+    gate = asyncio.Semaphore(max(1, len(stages)))
+    results: list[Any] = [None] * len(items)
+
+    def _timed(name: str, fn: Callable[[Any], Any], value: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(value)
+        finally:
+            stats.add(name, time.perf_counter() - t0)
+
+    async def _drive(idx: int, item: Any) -> None:
+        stats.started_items += 1
+        try:
+            value = item
+            for name, fn in stages:
+                value = await loop.run_in_executor(get_executor(name), _timed, name, fn, value)
+            results[idx] = value
+            stats.completed_items += 1
+            if on_item is not None:
+                on_item(idx)
+        finally:
+            gate.release()
+
+    tasks: list[asyncio.Task] = []
+    try:
+        for idx, item in enumerate(items):
+            await gate.acquire()
+            for task in tasks:
+                if task.done() and task.exception() is not None:
+                    raise task.exception()
+            tasks.append(asyncio.ensure_future(_drive(idx, item)))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        stats.finished = time.perf_counter()
+    return results
+
+
+def embed_stages(embedder: Any, device: torch.device) -> list[Stage]:
+    """Build the tokenize -> forward -> copy stages for `embedder`.
+
+    Only real `SentenceTransformer` modules can be split; anything else (for
+    example a remote or mocked encoder) gets a single `encode` stage.
+    """
+    if not PIPELINE_ENABLED or not isinstance(embedder, torch.nn.Module) or not hasattr(embedder, "tokenize"):
+        return [("encode", lambda texts: embedder.encode(texts, convert_to_numpy=True))]
+
+    embedder.eval()
+    preprocess = getattr(embedder, "preprocess", None) or embedder.tokenize
+    use_cuda = device.type == "cuda"
+    copy_stream = torch.cuda.Stream(device=device) if use_cuda else None
+
+    def tokenize(texts: list[str]) -> dict:
+        features = preprocess(texts)
+        if use_cuda:
+            features = {k: v.pin_memory() if isinstance(v, torch.Tensor) else v for k, v in features.items()}
+        return features
+
+    def forward(features: dict) -> tuple[torch.Tensor, Any]:
+        features = {
+            k: v.to(device, non_blocking=True) if isinstance(v, torch.Tensor) else v
+            for k, v in features.items()
+        }
+        with torch.inference_mode():
+            out = embedder(features)["sentence_embedding"]
+        done = None
+        if use_cuda:
+            done = torch.cuda.Event()
+            done.record()
+        return out, done
+
+    def copy(result: tuple[torch.Tensor, Any]):
+        out, done = result
+        if not use_cuda:
+            return out.float().numpy()
+        with torch.cuda.stream(copy_stream):
+            copy_stream.wait_event(done)
+            out.record_stream(copy_stream)
+            host = torch.empty(out.shape, dtype=out.dtype, pin_memory=True)
+            host.copy_(out, non_blocking=True)
+        copy_stream.synchronize()
+        return host.float().numpy()
+
+    return [("tokenize", tokenize), ("forward", forward), ("copy", copy)]
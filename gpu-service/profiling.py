@@ -0,0 +1,167 @@
+"""On-demand profiling of the live service.
+
+`/debug/profile?seconds=N` records what the process does for the next N
+seconds and returns one zip:
+
+- `torch_trace.json`: a `torch.profiler` Chrome trace (open it in Perfetto or
+  `chrome://tracing`). It covers CPU ops on every thread and, on CUDA hosts,
+  the kernels and memcpys.
+- `python_stacks.folded`: wall-clock Python stacks of every thread, sampled
+  at `GPU_PROFILE_SAMPLE_HZ`, in the folded format read by `flamegraph.pl`
+  and speedscope.
+- `summary.txt`: the capture settings and the top ops by self time.
+
+Nothing is installed while no capture runs: the torch profiler and the
+sampler thread exist only for the length of a capture, so the idle cost is
+zero. Only one capture runs at a time.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+logger = logging.getLogger("gpu-service")
+
+PROFILE_MAX_SECONDS = float(os.environ.get("GPU_PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_HZ = float(os.environ.get("GPU_PROFILE_SAMPLE_HZ", "100"))
+# Rows of the op table in summary.txt.
+SUMMARY_ROWS = 30
+
+
+class ProfilerBusy(RuntimeError):
+    """Another capture is already running."""
+
+
+def fold_stack(thread_name: str, frame) -> str:
+    """One sampled stack as `thread;outermost;...;innermost` (folded-stack format)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(name.replace(";", ":") for name in reversed(names))
+
+
+class StackSampler:
+    """Samples every thread's Python stack from a background thread until stopped."""
+
+    def __init__(self, hz: float = PROFILE_SAMPLE_HZ):
+        self.interval = 1.0 / hz
+        self.counts: Counter[str] = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.counts[fold_stack(names.get(ident, f"thread-{ident}"), frame)] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def torch_profiler(device: torch.device) -> tuple[torch.profiler.profile, bool]:
+    """A profiler for CPU (and CUDA) activity; the flag says whether it sees every thread.
+
+    The torch profiler otherwise records only the thread that started it, and
+    model work runs in worker threads. Torch builds without
+    `profile_all_threads` fall back to the capture thread plus CUDA activity.
+    """
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if device.type == "cuda":
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    try:
+        config = torch.profiler._ExperimentalConfig(profile_all_threads=True)
+    except (AttributeError, TypeError):
+        return torch.profiler.profile(activities=activities), False
+    return torch.profiler.profile(activities=activities, experimental_config=config), True
+
+
+class ProfileCapture:
+    """Runs one capture at a time and packages it as a zip."""
+
+    def __init__(
+        self, device: torch.device, max_seconds: float = PROFILE_MAX_SECONDS, sample_hz: float = PROFILE_SAMPLE_HZ
+    ):
+        self.device = device
+        self.max_seconds = max_seconds
+        self.sample_hz = sample_hz
+        self.running = False
+        self.captures = 0
+
+    async def capture(self, seconds: float) -> bytes:
+        if self.running:
+            raise ProfilerBusy("a profile capture is already running")
+        self.running = True
+        loop = asyncio.get_running_loop()
+        # Starting, stopping and exporting a trace can take seconds, so none of it runs on the
+        # event loop. start() and stop() must run on the same thread: one worker does all three.
+        worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu-profiler")
+        try:
+            profiler, all_threads = torch_profiler(self.device)
+            sampler = StackSampler(self.sample_hz)
+            started = time.time()
+            await loop.run_in_executor(worker, profiler.start)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+                await loop.run_in_executor(worker, profiler.stop)
+            self.captures += 1
+            settings = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+                "seconds": seconds,
+                "device": str(self.device),
+                "torch": torch.__version__,
+                "torch_all_threads": all_threads,
+                "stack_samples": sampler.samples,
+                "sample_hz": self.sample_hz,
+            }
+            logger.info(f"[profile] captured {seconds:g}s, {sampler.samples} stack sample(s)")
+            return await loop.run_in_executor(worker, self._package, profiler, sampler, settings)
+        finally:
+            worker.shutdown(wait=False)
+            self.running = False
+
+    def _package(self, profiler: torch.profiler.profile, sampler: StackSampler, settings: dict) -> bytes:
+        with tempfile.TemporaryDirectory() as tmp:
+            trace_path = os.path.join(tmp, "torch_trace.json")
+            profiler.export_chrome_trace(trace_path)
+            sort_by = "self_cuda_time_total" if self.device.type == "cuda" else "self_cpu_time_total"
+            try:
+                table = profiler.key_averages().table(sort_by=sort_by, row_limit=SUMMARY_ROWS)
+            except Exception as exc:  # an empty capture has nothing to tabulate
+                table = f"(no op summary: {exc})"
+            summary = "".join(f"{key}: {value}\n" for key, value in settings.items()) + "\n" + table + "\n"
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.write(trace_path, "torch_trace.json")
+                archive.writestr("python_stacks.folded", sampler.folded())
+                archive.writestr("summary.txt", summary)
+        return buffer.getvalue()
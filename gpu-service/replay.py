@@ -0,0 +1,229 @@
+"""Replay a captured traffic trace against a running service.
+
+Fires the requests of a `GPU_CAPTURE_FILE` trace (see capture.py) at their
+recorded arrival offsets, divided by `--speed`. The replay is open-loop:
+requests go out on schedule whether or not earlier ones have finished, as
+real clients would send them. It reports latency percentiles per endpoint
+next to the server-side times recorded in the trace. Hashed or redacted
+texts are rebuilt as filler text of the same length, seeded by the hash, so
+repeated texts are still repeats and every replay of a trace sends the same
+bytes. Requests that failed validation when captured (4xx) are skipped.
+
+Compare a scheduler or batching change by replaying the same trace before
+and after it.
+
+Usage (from the gpu-service directory, needs httpx from requirements-dev.txt):
+    python replay.py trace.jsonl.gz --url http://127.0.0.1:8765 --json before.json
+    python replay.py trace.jsonl.gz --speed 4 --paths /embed
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Iterator, Sequence
+
+import httpx
+import numpy as np
+
+from capture import read_trace
+
+# Common words, so filler text tokenizes roughly like prose.
+_WORDS = (
+    "the of and to in is was for on that with as by at from it an be this are or which his "
+    "her they have had not but were all one their there been has when who will more no if out "
+    "so said what up its about into than them can only other new some could time these two may "
+    "then do first any my now such like our over man me even most made after also did many "
+    "before must through years where much your way well down should because each just those "
+    "people how too little state good very make world still own see men work long get here "
+    "between both life being under never day same another know while last might us great old"
+).split()
+
+
+def filler(length: int, seed: str) -> str:
+    """Deterministic text of exactly `length` characters."""
+    rng = random.Random(seed)
+    parts: list[str] = []
+    size = 0
+    while size <= length:  # size counts a space after every word
+        word = rng.choice(_WORDS)
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)[:length]
+
+
+def restore_texts(value: Any, redacted: Iterator[int]) -> Any:
+    """Rebuild texts scrubbed by capture: hashed ones from their hash, redacted ones from a counter."""
+    if isinstance(value, dict) and "len" in value:
+        seed = value["sha"] if "sha" in value else f"redacted-{next(redacted)}"
+        return filler(value["len"], seed)
+    if isinstance(value, list):
+        return [restore_texts(item, redacted) for item in value]
+    return value
+
+
+@dataclass
+class ReplayRequest:
+    offset: float  # seconds after the first request, already divided by the speed factor
+    path: str
+    body: dict
+    headers: dict[str, str]
+    captured_ms: float | None
+
+
+@dataclass
+class ReplayResult:
+    path: str
+    status: int  # 0 when no response arrived (connection error or client timeout)
+    latency_ms: float
+    lag_ms: float  # how late the request left relative to its schedule
+
+
+def build_requests(
+    records: Sequence[dict], speed: float = 1.0, paths: Sequence[str] | None = None
+) -> list[ReplayRequest]:
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+    records = [
+        r for r in records
+        if (paths is None or r["path"] in paths) and not 400 <= r.get("status", 200) < 500
+    ]
+    if not records:
+        return []
+    records = sorted(records, key=lambda r: r["t"])
+    t0 = records[0]["t"]
+    redacted = itertools.count()
+    requests = []
+    for record in records:
+        body = {key: restore_texts(value, redacted) for key, value in record["body"].items()}
+        headers = {"X-Deadline-Ms": str(record["deadline_ms"])} if "deadline_ms" in record else {}
+        requests.append(ReplayRequest((record["t"] - t0) / speed, record["path"], body, headers, record.get("ms")))
+    return requests
+
+
+async def replay(
+    requests: Sequence[ReplayRequest], client: httpx.AsyncClient, max_inflight: int | None = None
+) -> list[ReplayResult]:
+    """Send `requests` on their schedule through `client` and time each response."""
+    limit = asyncio.Semaphore(max_inflight) if max_inflight else None
+
+    async def fire(req: ReplayRequest, scheduled: float) -> ReplayResult:
+        if limit is not None:
+            await limit.acquire()
+        try:
+            sent = time.perf_counter()
+            try:
+                resp = await client.post(req.path, json=req.body, headers=req.headers)
+                status = resp.status_code
+            except httpx.HTTPError:
+                status = 0
+            done = time.perf_counter()
+        finally:
+            if limit is not None:
+                limit.release()
+        return ReplayResult(req.path, status, (done - sent) * 1000, max(0.0, (sent - scheduled) * 1000))
+
+    start = time.perf_counter()
+    tasks = []
+    for req in requests:
+        delay = start + req.offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(req, start + req.offset)))
+    return list(await asyncio.gather(*tasks))
+
+
+def _percentiles(values: Sequence[float]) -> dict[str, float | None]:
+    if not len(values):
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": round(float(p50), 1), "p90": round(float(p90), 1), "p99": round(float(p99), 1),
+            "max": round(float(max(values)), 1)}
+
+
+def summarize(requests: Sequence[ReplayRequest], results: Sequence[ReplayResult], wall_seconds: float) -> dict:
+    """Latency distribution per endpoint (successful requests only) plus status counts."""
+    summary = {"requests": len(results), "wall_seconds": round(wall_seconds, 2), "paths": {}}
+    for path in sorted({r.path for r in results}):
+        mine = [r for r in results if r.path == path]
+        statuses: dict[str, int] = {}
+        for r in mine:
+            statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+        captured = [q.captured_ms for q in requests if q.path == path and q.captured_ms is not None]
+        summary["paths"][path] = {
+            "count": len(mine),
+            "ok": sum(200 <= r.status < 300 for r in mine),
+            "statuses": statuses,
+            "latency_ms": _percentiles([r.latency_ms for r in mine if 200 <= r.status < 300]),
+            "captured_ms": _percentiles(captured),
+            "lag_ms": _percentiles([r.lag_ms for r in mine]),
+        }
+    return summary
+
+
+def _print_summary(summary: dict) -> None:
+    print(f"{summary['requests']} request(s) in {summary['wall_seconds']:.1f}s")
+    print(f"{'path':<12} {'count':>6} {'ok':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'capt p50':>9} {'capt p99':>9} {'lag p99':>8}")
+
+    def fmt(value: float | None, width: int) -> str:
+        return f"{value:>{width}.1f}" if value is not None else f"{'-':>{width}}"
+
+    for path, stats in summary["paths"].items():
+        lat, cap, lag = stats["latency_ms"], stats["captured_ms"], stats["lag_ms"]
+        print(f"{path:<12} {stats['count']:>6} {stats['ok']:>6} {fmt(lat['p50'], 8)} {fmt(lat['p90'], 8)} "
+              f"{fmt(lat['p99'], 8)} {fmt(lat['max'], 8)} {fmt(cap['p50'], 9)} {fmt(cap['p99'], 9)} "
+              f"{fmt(lag['p99'], 8)}")
+        errors = {status: n for status, n in stats["statuses"].items() if not status.startswith("2")}
+        if errors:
+            print(f"{'':<12} non-2xx: {errors}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="replay.py", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("trace", help="trace file written by GPU_CAPTURE_FILE")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than captured")
+    parser.add_argument("--paths", nargs="+", default=None, help="only replay these endpoints")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N requests")
+    parser.add_argument("--max-inflight", type=int, default=None, help="cap concurrent requests (default: none)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY"))
+    parser.add_argument("--json", dest="json_out", default=None, help="also write the summary to this file")
+    return parser
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    requests = build_requests(read_trace(args.trace), args.speed, args.paths)[: args.limit]
+    if not requests:
+        raise SystemExit("error: nothing to replay")
+    print(f"replaying {len(requests)} request(s) over {requests[-1].offset:.1f}s at {args.speed:g}x", file=sys.stderr)
+    headers = {"X-API-Key": args.api_key} if args.api_key else {}
+    limits = httpx.Limits(max_connections=args.max_inflight or None)
+    async with httpx.AsyncClient(
+        base_url=args.url, headers=headers, timeout=args.timeout, limits=limits
+    ) as client:
+        t0 = time.perf_counter()
+        results = await replay(requests, client, args.max_inflight)
+        return summarize(requests, results, time.perf_counter() - t0)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    summary = asyncio.run(_run(args))
+    _print_summary(summary)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
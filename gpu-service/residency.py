@@ -0,0 +1,236 @@
+"""Tiered model residency: idle models leave the device and come back on demand.
+
+Models loaded on demand used to stay on the GPU for the life of the process,
+and deleting them means a full reload from disk on the next request. Instead,
+`ResidencyManager` moves a model that has been idle for `GPU_OFFLOAD_IDLE_S`
+seconds to pinned host memory. The next request for it copies the weights
+back to the device, which takes a fraction of a reload. On CPU-only hosts the
+same idle models are spilled to an mmap-backed file under `GPU_OFFLOAD_DIR`,
+so the kernel can drop their pages under memory pressure and read them back
+on the next request.
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import torch
+
+logger = logging.getLogger("gpu-service")
+
+# 0 disables offloading.
+OFFLOAD_IDLE_SECONDS = float(os.environ.get("GPU_OFFLOAD_IDLE_S", "0"))
+OFFLOAD_DIR = os.environ.get("GPU_OFFLOAD_DIR") or os.path.join(tempfile.gettempdir(), "gpu-bridge-offload")
+SWEEP_SECONDS = 5.0
+
+DEVICE, HOST, FILE = "device", "host", "file"
+_ALIGN = 64
+
+
+def torch_module(loaded: Any) -> torch.nn.Module | None:
+    """The `nn.Module` holding a cached model's weights (a BERTScorer keeps it in `_model`)."""
+    if isinstance(loaded, torch.nn.Module):
+        return loaded
+    inner = getattr(loaded, "_model", None)
+    return inner if isinstance(inner, torch.nn.Module) else None
+
+
+def _tensors(module: torch.nn.Module) -> Iterator[torch.Tensor]:
+    # parameters() and buffers() skip duplicates, so tied weights are moved once.
+    yield from module.parameters()
+    yield from module.buffers()
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in _tensors(module))
+
+
+def offload_to_host(module: torch.nn.Module) -> int:
+    """Move every weight to host memory (pinned when CUDA is available); returns bytes moved."""
+    pin = torch.cuda.is_available()
+    moved = 0
+    for t in _tensors(module):
+        host = torch.empty(t.shape, dtype=t.dtype, pin_memory=pin)
+        host.copy_(t.data, non_blocking=pin)
+        t.data = host
+        moved += host.numel() * host.element_size()
+    if pin:
+        torch.cuda.synchronize()
+        torch.cuda.empty_cache()
+    return moved
+
+
+def spill_to_file(module: torch.nn.Module, path: Path) -> int:
+    """Write every weight to `path` and re-point it at a private memory map of that file."""
+    tensors = [t for t in _tensors(module) if t.numel()]
+    offsets = []
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        for t in tensors:
+            pad = -f.tell() % _ALIGN
+            f.write(b"\0" * pad)
+            offsets.append(f.tell())
+            f.write(t.detach().cpu().reshape(-1).contiguous().view(torch.uint8).numpy())
+        size = f.tell()
+    if not tensors:
+        return 0
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=size)
+    for t, offset in zip(tensors, offsets):
+        t.data = torch.empty(0, dtype=t.dtype).set_(storage, offset // t.element_size(), t.shape)
+    return size
+
+
+def promote(module: torch.nn.Module, device: torch.device) -> None:
+    """Bring every weight back onto `device` (into anonymous memory on CPU)."""
+    for t in _tensors(module):
+        if device.type == "cpu":
+            t.data = t.data.clone()
+        else:
+            t.data = t.data.to(device, non_blocking=True)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+class _Resident:
+    def __init__(self, kind: str, name: str, module: torch.nn.Module):
+        self.kind = kind
+        self.name = name
+        self.module = module
+        self.state = DEVICE
+        self.last_used = time.monotonic()
+        self.bytes = module_bytes(module)
+        self.offloads = 0
+        self.promotions = 0
+        self.last_promotion_ms: float | None = None
+        self.total_promotion_ms = 0.0
+        self.lock = asyncio.Lock()
+
+
+class ResidencyManager:
+    """Track cached models and move idle ones between device, host RAM and file.
+
+    A model is offloaded only when it has been idle for `idle_seconds` and
+    `is_busy(kind, name)` reports no running job on it. `ensure_resident` is
+    awaited before every use and brings an offloaded model back first.
+    """
+
+    def __init__(self, device: torch.device, idle_seconds: float = OFFLOAD_IDLE_SECONDS, spill_dir: str = OFFLOAD_DIR):
+        self.device = device
+        self.idle_seconds = idle_seconds
+        self.spill_dir = Path(spill_dir)
+        self._models: dict[tuple[str, str], _Resident] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_seconds > 0
+
+    def register(self, kind: str, name: str, loaded: Any) -> None:
+        module = torch_module(loaded)
+        if module is not None:
+            self._models[(kind, name)] = _Resident(kind, name, module)
+
+    def touch(self, kind: str, name: str) -> None:
+        entry = self._models.get((kind, name))
+        if entry is not None:
+            entry.last_used = time.monotonic()
+
+    async def ensure_resident(self, kind: str, name: str) -> float | None:
+        """Make sure the model is on the device; returns the promotion time in ms if one was needed."""
+        entry = self._models.get((kind, name))
+        if entry is None:
+            return None
+        async with entry.lock:
+            entry.last_used = time.monotonic()
+            if entry.state == DEVICE:
+                return None
+            t0 = time.perf_counter()
+            await asyncio.to_thread(promote, entry.module, self.device)
+            if entry.state == FILE:
+                self._spill_path(entry).unlink(missing_ok=True)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            entry.state = DEVICE
+            entry.promotions += 1
+            entry.last_promotion_ms = elapsed_ms
+            entry.total_promotion_ms += elapsed_ms
+            entry.last_used = time.monotonic()
+        logger.info(f"[residency] {kind}:{name} promoted to {self.device} in {elapsed_ms:.1f}ms")
+        return elapsed_ms
+
+    def _spill_path(self, entry: _Resident) -> Path:
+        safe = "".join(c if c.isalnum() or c in "._-" else "-" for c in entry.name)
+        return self.spill_dir / f"{os.getpid()}-{entry.kind}-{safe}.bin"
+
+    async def offload(self, kind: str, name: str, unless: Callable[[], bool] | None = None) -> bool:
+        """Offload one model now (host RAM on GPU hosts, mmap-backed file on CPU).
+
+        `unless` is re-checked once the model's lock is held, so a request
+        that arrived in the meantime keeps it on the device.
+        """
+        entry = self._models.get((kind, name))
+        if entry is None:
+            return False
+        async with entry.lock:
+            if entry.state != DEVICE or (unless is not None and unless()):
+                return False
+            t0 = time.perf_counter()
+            if self.device.type == "cpu":
+                await asyncio.to_thread(spill_to_file, entry.module, self._spill_path(entry))
+                entry.state = FILE
+            else:
+                await asyncio.to_thread(offload_to_host, entry.module)
+                entry.state = HOST
+            entry.offloads += 1
+        logger.info(
+            f"[residency] {kind}:{name} offloaded to {entry.state} "
+            f"({entry.bytes / 2**20:.0f} MB in {(time.perf_counter() - t0) * 1000:.0f}ms)"
+        )
+        return True
+
+    async def offload_idle(self, is_busy: Callable[[str, str], bool]) -> list[str]:
+        """Offload every model idle for longer than `idle_seconds`; returns their keys."""
+        moved = []
+        for (kind, name), entry in list(self._models.items()):
+
+            def in_use(entry=entry, kind=kind, name=name) -> bool:
+                return time.monotonic() - entry.last_used < self.idle_seconds or is_busy(kind, name)
+
+            if entry.state == DEVICE and not in_use() and await self.offload(kind, name, unless=in_use):
+                moved.append(f"{kind}:{name}")
+        return moved
+
+    async def run(self, is_busy: Callable[[str, str], bool], interval: float = SWEEP_SECONDS) -> None:
+        """Background sweep; cancel the task to stop it."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.offload_idle(is_busy)
+            except Exception as exc:  # keep sweeping; the model just stays where it is
+                logger.warning(f"[residency] offload failed: {exc}")
+
+    def status(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "model": f"{entry.kind}:{entry.name}",
+                "state": entry.state,
+                "size_mb": round(entry.bytes / 2**20, 1),
+                "idle_seconds": round(now - entry.last_used, 1),
+                "offloads": entry.offloads,
+                "promotions": entry.promotions,
+                "last_promotion_ms": round(entry.last_promotion_ms, 2) if entry.last_promotion_ms is not None else None,
+                "mean_promotion_ms": (
+                    round(entry.total_promotion_ms / entry.promotions, 2) if entry.promotions else None
+                ),
+            }
+            for entry in self._models.values()
+        ]
+
+    def close(self) -> None:
+        """Remove this process's spill files."""
+        for entry in self._models.values():
+            if entry.state == FILE:
+                self._spill_path(entry).unlink(missing_ok=True)
@@ -0,0 +1,100 @@
+"""Fast JSON encoding for large numeric responses.
+
+`/embed` and `/bertscore` return NumPy/torch results. Wrapping those in a
+Pydantic model means building millions of Python floats, re-validating them
+against the response model and encoding them on the event loop thread. The
+helpers here serialize arrays straight to JSON bytes (orjson when installed)
+and move large payloads to a worker thread.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any
+
+import numpy as np
+from fastapi.responses import Response
+
+try:  # Optional fast path; the stdlib fallback keeps the service usable without it.
+    import orjson
+except ImportError:  # pragma: no cover - exercised only when orjson is missing
+    orjson = None
+
+# Payloads whose array data exceeds this many bytes are encoded off the event loop.
+SERIALIZE_THREAD_BYTES = int(os.environ.get("GPU_SERIALIZE_THREAD_BYTES", str(256 * 1024)))
+
+
+def _to_plain(value: Any) -> Any:
+    """Convert arrays/tensors nested in `value` to objects the stdlib encoder accepts."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "detach") and hasattr(value, "cpu"):
+        return value.detach().cpu().numpy().tolist()
+    if isinstance(value, dict):
+        return {k: _to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+def _prepare(value: Any) -> Any:
+    """Turn torch tensors into contiguous NumPy arrays orjson can encode natively."""
+    if hasattr(value, "detach") and hasattr(value, "cpu"):
+        value = value.detach().cpu().numpy()
+    if isinstance(value, np.ndarray):
+        if value.dtype not in (np.float32, np.float64, np.int32, np.int64, np.bool_):
+            value = value.astype(np.float32)
+        return np.ascontiguousarray(value)
+    if isinstance(value, dict):
+        return {k: _prepare(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_prepare(v) for v in value]
+    return value
+
+
+def encode_json(payload: Any) -> bytes:
+    """Serialize `payload` (which may contain NumPy arrays or tensors) to JSON bytes."""
+    payload = _prepare(payload)
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(_to_plain(payload), separators=(",", ":")).encode("utf-8")
+
+
+def payload_nbytes(payload: Any) -> int:
+    """Approximate size of the array data carried by `payload`."""
+    if isinstance(payload, np.ndarray):
+        return int(payload.nbytes)
+    if hasattr(payload, "element_size") and hasattr(payload, "nelement"):
+        return int(payload.element_size() * payload.nelement())
+    if isinstance(payload, dict):
+        return sum(payload_nbytes(v) for v in payload.values())
+    if isinstance(payload, (list, tuple)):
+        return sum(payload_nbytes(v) for v in payload)
+    return 0
+
+
+class FastJSONResponse(Response):
+    """JSON response whose body is already-encoded bytes.
+
+    Returning a `Response` from a FastAPI handler bypasses `response_model`
+    validation and the default encoder, so the declared model is used for the
+    OpenAPI schema only.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return encode_json(content)
+
+
+async def render_json(payload: Any, status_code: int = 200, headers: dict | None = None) -> FastJSONResponse:
+    """Encode `payload` into a `FastJSONResponse`, in a worker thread when it is large."""
+    if payload_nbytes(payload) >= SERIALIZE_THREAD_BYTES:
+        body = await asyncio.to_thread(encode_json, payload)
+    else:
+        body = encode_json(payload)
+    return FastJSONResponse(content=body, status_code=status_code, headers=headers)
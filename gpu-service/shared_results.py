@@ -0,0 +1,176 @@
+"""Shared-memory handoff of `/embed` results for co-located clients.
+
+When the client runs on the same machine, sending vectors through JSON and
+the loopback TCP stack costs more than computing some of them. With
+`"output": "shm"` the service instead writes the result array as a `.npy`
+file under `GPU_SHM_DIR` (a tmpfs, `/dev/shm`, where one exists). The
+response carries only the handle, path, shape, dtype and data offset, and the
+client maps the file directly. Every segment is leased for `GPU_SHM_TTL`
+seconds. The client releases it with `DELETE /shm/{handle}` once read, and a
+background sweep removes segments whose lease ran out, so a client that dies
+mid-read does not leak memory.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("gpu-service")
+
+_TMPFS = "/dev/shm"
+SHM_DIR = os.environ.get("GPU_SHM_DIR") or (
+    os.path.join(_TMPFS, "gpu-bridge")
+    if os.path.isdir(_TMPFS)
+    else os.path.join(tempfile.gettempdir(), "gpu-bridge-shm")
+)
+SHM_TTL = float(os.environ.get("GPU_SHM_TTL", "60"))
+SHM_MAX_MB = float(os.environ.get("GPU_SHM_MAX_MB", "1024"))
+
+HANDLE_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class UnknownSegment(KeyError):
+    """No live segment with this handle (never created, released or expired)."""
+
+
+class SegmentBudgetExceeded(RuntimeError):
+    """Writing the segment would exceed `GPU_SHM_MAX_MB`."""
+
+
+def is_local_client(host: str | None) -> bool:
+    """True for loopback peers; a shared-memory path means nothing to a remote client."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host or "").is_loopback
+    except ValueError:
+        return False
+
+
+@dataclass
+class Segment:
+    handle: str
+    path: Path
+    nbytes: int
+    expires: float  # time.monotonic() deadline
+    expires_at: float  # wall-clock deadline reported to the client
+
+
+class SharedResultStore:
+    """Leased `.npy` segments on a shared filesystem, bounded by a byte budget."""
+
+    def __init__(self, root: str | os.PathLike = SHM_DIR, ttl: float = SHM_TTL, budget_bytes: int | None = None):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.budget_bytes = int(SHM_MAX_MB * 2**20) if budget_bytes is None else budget_bytes
+        self._segments: dict[str, Segment] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.leased = 0
+        self.released = 0
+        self.expired = 0
+
+    @classmethod
+    def from_env(cls) -> "SharedResultStore | None":
+        if SHM_MAX_MB <= 0:
+            return None
+        return cls()
+
+    def put(self, array: np.ndarray) -> dict:
+        """Write `array` to a new segment and return its lease."""
+        self.purge_expired()
+        array = np.ascontiguousarray(array)
+        with self._lock:
+            if self.bytes + array.nbytes > self.budget_bytes:
+                raise SegmentBudgetExceeded(
+                    f"shared-memory budget of {self.budget_bytes / 2**20:.0f} MB is in use; release segments first"
+                )
+            handle = uuid.uuid4().hex
+            segment = Segment(handle, self.root / f"{handle}.npy", int(array.nbytes), 0.0, 0.0)
+            self._segments[handle] = segment  # reserve the bytes before writing outside the lock
+            self.bytes += segment.nbytes
+        try:
+            self.root.mkdir(parents=True, exist_ok=True, mode=0o700)
+            try:  # mkdir's mode is masked by the umask and not applied to an existing directory
+                os.chmod(self.root, 0o700)
+            except PermissionError:
+                pass  # not ours (e.g. GPU_SHM_DIR=/dev/shm); the segment files are still owner-only
+            # Create the file owner-only up front; np.save on a path would use the umask (usually 0644).
+            fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array)
+                offset = f.tell() - array.nbytes  # the data follows the .npy header
+        except Exception:
+            self._drop(handle)
+            raise
+        segment.expires = time.monotonic() + self.ttl
+        segment.expires_at = time.time() + self.ttl
+        self.leased += 1
+        return {
+            "handle": handle,
+            "path": str(segment.path),
+            "shape": list(array.shape),
+            "dtype": array.dtype.name,
+            "offset": offset,
+            "expires_at": round(segment.expires_at, 3),
+        }
+
+    def _drop(self, handle: str) -> Segment | None:
+        with self._lock:
+            segment = self._segments.pop(handle, None)
+            if segment is not None:
+                self.bytes -= segment.nbytes
+        if segment is not None:
+            segment.path.unlink(missing_ok=True)
+        return segment
+
+    def release(self, handle: str) -> None:
+        if not HANDLE_PATTERN.fullmatch(handle) or self._drop(handle) is None:
+            raise UnknownSegment(handle)
+        self.released += 1
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            stale = [h for h, s in self._segments.items() if s.expires and s.expires <= now]
+        dropped = sum(self._drop(handle) is not None for handle in stale)
+        self.expired += dropped
+        return dropped
+
+    async def run(self, interval: float | None = None) -> None:
+        """Background sweep of expired leases; cancel the task to stop it."""
+        interval = interval or max(1.0, self.ttl / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                dropped = await asyncio.to_thread(self.purge_expired)
+                if dropped:
+                    logger.info(f"[shm] removed {dropped} expired segment(s)")
+            except Exception as exc:  # keep sweeping; a failed unlink only leaves a stray file
+                logger.warning(f"[shm] sweep failed: {exc}")
+
+    def close(self) -> None:
+        for handle in list(self._segments):
+            self._drop(handle)
+
+    def status(self) -> dict:
+        return {
+            "dir": str(self.root),
+            "segments": len(self._segments),
+            "bytes": self.bytes,
+            "budget_bytes": self.budget_bytes,
+            "ttl_seconds": self.ttl,
+            "leased": self.leased,
+            "released": self.released,
+            "expired": self.expired,
+        }
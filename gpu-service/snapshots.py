@@ -0,0 +1,207 @@
+"""Local model snapshot store.
+
+Loading a model by hub name goes through Hugging Face resolution (and, on a
+cold host, a download) on every start. The first time a model is loaded, the
+store freezes it under `GPU_SNAPSHOT_DIR` as safetensors plus config and
+tokenizer files. Later loads read that directory directly, which also works
+with `GPU_OFFLINE=1`.
+
+On CPU the loaded weights are then re-pointed at a private memory map of the
+safetensors file. The page cache holds one copy of the weights, and every
+worker process that maps the same snapshot shares those pages.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import torch
+
+from layers import TOTAL_LAYERS_ATTR
+
+logger = logging.getLogger("gpu-service")
+
+SNAPSHOT_DIR = os.environ.get("GPU_SNAPSHOT_DIR")
+AUTO_FREEZE = os.environ.get("GPU_SNAPSHOT_FREEZE", "1").lower() not in ("0", "false", "no")
+OFFLINE = os.environ.get("GPU_OFFLINE", "0").lower() in ("1", "true", "yes")
+
+MANIFEST = "snapshot.json"
+
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def apply_offline_mode() -> None:
+    """Stop the Hugging Face libraries from touching the network (call before importing them)."""
+    if OFFLINE:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+
+def mmap_safetensors(path: str | Path) -> dict[str, torch.Tensor]:
+    """Return the tensors of a safetensors file as views of one private memory map.
+
+    Pages are read on first touch and stay shared with every other process
+    mapping the same file until written to.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=size)
+    base = 8 + header_len
+
+    tensors = {}
+    for name, meta in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES[meta["dtype"]]
+        begin, _ = meta["data_offsets"]
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        offset = base + begin
+        if offset % itemsize:
+            raise ValueError(f"{path}: tensor {name} is not aligned for {dtype}")
+        tensors[name] = torch.empty(0, dtype=dtype).set_(storage, offset // itemsize, meta["shape"])
+    return tensors
+
+
+def rebind_to_mmap(module: torch.nn.Module, directory: Path) -> int:
+    """Point `module`'s weights at memory-mapped snapshot files; returns the tensors rebound."""
+    rebound = 0
+    targets = [(module, directory)]
+    modules_json = directory / "modules.json"
+    if modules_json.exists():
+        # SentenceTransformer: each submodule saves its own weights under its own path.
+        targets = [
+            (module[int(entry["idx"])], directory / entry["path"])
+            for entry in json.loads(modules_json.read_text())
+        ]
+    for target, folder in targets:
+        for file in sorted(folder.glob("*.safetensors")):
+            tensors = mmap_safetensors(file)
+            for candidate in (target, getattr(target, "auto_model", None)):
+                if candidate is None or not set(tensors) <= set(candidate.state_dict()):
+                    continue
+                candidate.load_state_dict(tensors, strict=False, assign=True)
+                rebound += len(tensors)
+                break
+    return rebound
+
+
+def _safe_name(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "--", model)
+
+
+class SnapshotStore:
+    """Freeze loaded models to `root/<kind>/<model>` and load them back from there."""
+
+    def __init__(self, root: str | Path, auto_freeze: bool = True):
+        self.root = Path(root)
+        self.auto_freeze = auto_freeze
+
+    @classmethod
+    def from_env(cls) -> "SnapshotStore | None":
+        return cls(SNAPSHOT_DIR, auto_freeze=AUTO_FREEZE) if SNAPSHOT_DIR else None
+
+    def path(self, kind: str, model: str) -> Path:
+        return self.root / kind / _safe_name(model)
+
+    def manifest(self, kind: str, model: str) -> dict | None:
+        try:
+            return json.loads((self.path(kind, model) / MANIFEST).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def list(self) -> list[dict]:
+        manifests = []
+        for file in sorted(self.root.glob(f"*/*/{MANIFEST}")):
+            try:
+                manifests.append(json.loads(file.read_text()))
+            except ValueError:
+                continue
+        return manifests
+
+    def _freeze(self, kind: str, model: str, save: Callable[[Path], None], **extra: Any) -> Path:
+        """Write a snapshot into a temp dir and move it into place, so readers never see half of one."""
+        final = self.path(kind, model)
+        tmp = final.with_name(final.name + f".tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        t0 = time.time()
+        try:
+            save(tmp)
+            manifest = {"kind": kind, "model": model, "created_at": time.time(), **extra}
+            (tmp / MANIFEST).write_text(json.dumps(manifest, indent=2))
+            shutil.rmtree(final, ignore_errors=True)
+            os.replace(tmp, final)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        logger.info(f"[snapshot] froze {kind}:{model} in {time.time()-t0:.2f}s -> {final}")
+        return final
+
+    def freeze_embedder(self, model_name: str, embedder: Any) -> Path:
+        return self._freeze("embed", model_name, lambda path: embedder.save(str(path), safe_serialization=True))
+
+    def freeze_bertscorer(self, model_type: str, scorer: Any) -> Path:
+        model, num_layers = scorer._model, scorer.num_layers
+
+        def save(path: Path) -> None:
+            config = model.config
+            # BERTScorer already dropped the layers above num_layers; record that in the config
+            # so the snapshot loads without re-creating (and re-dropping) them.
+            if hasattr(model, "encoder") and hasattr(model.encoder, "layer"):
+                if config.num_hidden_layers != num_layers:
+                    setattr(config, TOTAL_LAYERS_ATTR, config.num_hidden_layers)
+                config.num_hidden_layers = num_layers
+            model.save_pretrained(str(path), safe_serialization=True)
+            scorer._tokenizer.save_pretrained(str(path))
+
+        return self._freeze("bertscore", model_type, save, num_layers=num_layers)
+
+    def _finish_load(self, kind: str, model: str, loaded: Any, module: Any, device: torch.device, t0: float) -> Any:
+        rebound = 0
+        if device.type == "cpu" and isinstance(module, torch.nn.Module):
+            rebound = rebind_to_mmap(module, self.path(kind, model))
+        logger.info(
+            f"[snapshot] loaded {kind}:{model} in {time.time()-t0:.2f}s "
+            f"({rebound} tensor(s) memory-mapped)"
+        )
+        return loaded
+
+    def load_embedder(self, model_name: str, factory: Callable, device: torch.device) -> Any | None:
+        if self.manifest("embed", model_name) is None:
+            return None
+        t0 = time.time()
+        embedder = factory(str(self.path("embed", model_name)), device=str(device))
+        return self._finish_load("embed", model_name, embedder, embedder, device, t0)
+
+    def load_bertscorer(self, model_type: str, factory: Callable, device: torch.device) -> Any | None:
+        manifest = self.manifest("bertscore", model_type)
+        if manifest is None:
+            return None
+        t0 = time.time()
+        scorer = factory(
+            model_type=str(self.path("bertscore", model_type)),
+            num_layers=manifest["num_layers"],
+            device=str(device),
+            lang="en",
+        )
+        return self._finish_load("bertscore", model_type, scorer, getattr(scorer, "_model", None), device, t0)
@@ -0,0 +1,202 @@
+"""Tests for token-weighted admission control."""
+
+import asyncio
+
+import pytest
+
+from admission import (
+    MAX_SEQ_TOKENS,
+    CapacityBudget,
+    CapacityTooSmall,
+    CostModel,
+    LaneRouter,
+    QueueFull,
+    estimate_tokens,
+    prior_factor,
+)
+
+
+class TestEstimates:
+    def test_estimate_tokens(self):
+        assert estimate_tokens(["abcdefgh"]) == 4  # 8 chars / 4 + 2 special tokens
+        assert estimate_tokens(["", ""]) == 4
+
+    def test_estimate_is_capped_at_max_sequence(self):
+        assert estimate_tokens(["x" * 100_000]) == MAX_SEQ_TOKENS
+
+    def test_prior_factor_by_model_size(self):
+        assert prior_factor("microsoft/deberta-xlarge-mnli") > prior_factor("roberta-large")
+        assert prior_factor("roberta-large") > prior_factor("bert-base-uncased")
+        assert prior_factor("all-MiniLM-L6-v2") == 1.0
+
+
+class TestCostModel:
+    def test_uses_prior_until_calibrated(self):
+        model = CostModel(reference_model="mini")
+        assert model.factor("mini") == 1.0
+        assert model.factor("deberta-xlarge") == prior_factor("deberta-xlarge")
+
+    def test_calibrates_relative_to_reference(self):
+        model = CostModel(reference_model="mini")
+        model.observe("mini", tokens=1000, seconds=0.1)
+        model.observe("big", tokens=1000, seconds=1.5)
+        assert model.factor("big") == pytest.approx(15.0)
+        assert model.snapshot() == {"big": 15.0, "mini": 1.0}
+
+    def test_observations_are_smoothed(self):
+        model = CostModel(reference_model="mini")
+        model.observe("mini", tokens=100, seconds=0.1)
+        model.observe("big", tokens=100, seconds=1.0)
+        model.observe("big", tokens=100, seconds=2.0)
+        assert 10.0 < model.factor("big") < 20.0
+
+    def test_overrides_win(self):
+        model = CostModel(reference_model="mini", overrides={"big": 3.0})
+        model.observe("big", tokens=10, seconds=10)
+        assert model.factor("big") == 3.0
+
+    def test_factor_is_capped_but_overrides_are_not(self):
+        model = CostModel(reference_model="mini", overrides={"pinned": 50.0}, max_factor=16.0)
+        model.observe("mini", tokens=1000, seconds=0.1)
+        model.observe("big", tokens=1000, seconds=5.0)
+        assert model.factor("big") == 16.0
+        assert model.factor("deberta-xlarge") == 16.0
+        assert model.factor("roberta-base") == 3.0
+        assert model.factor("pinned") == 50.0
+
+    def test_estimate(self):
+        model = CostModel(reference_model="mini", overrides={"big": 2.0})
+        assert model.estimate("big", ["abcd"]) == (3, 6.0)
+
+
+class TestCapacityBudget:
+    @pytest.mark.asyncio
+    async def test_cheap_requests_run_alongside_expensive_one(self):
+        budget = CapacityBudget(100)
+        await budget.acquire(80, timeout=0.1)
+        for _ in range(4):
+            await budget.acquire(5, timeout=0.1)
+        assert budget.in_use == 100
+        assert budget.jobs == 5
+
+    @pytest.mark.asyncio
+    async def test_times_out_when_full(self):
+        budget = CapacityBudget(10)
+        await budget.acquire(8, timeout=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await budget.acquire(5, timeout=0.05)
+        assert budget.queued == 0
+        assert budget.in_use == 8
+
+    @pytest.mark.asyncio
+    async def test_oversized_request_is_rejected_immediately(self):
+        budget = CapacityBudget(10)
+        with pytest.raises(CapacityTooSmall):
+            await budget.acquire(11, timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_waiter_admitted_on_release(self):
+        budget = CapacityBudget(10)
+        await budget.acquire(10, timeout=0.1)
+        waiter = asyncio.create_task(budget.acquire(4, timeout=1.0))
+        await asyncio.sleep(0)
+        assert budget.queued == 1
+        budget.release(10)
+        await waiter
+        assert budget.in_use == 4
+
+    @pytest.mark.asyncio
+    async def test_fifo_order_blocks_later_cheap_requests(self):
+        budget = CapacityBudget(10)
+        await budget.acquire(6, timeout=0.1)
+        big = asyncio.create_task(budget.acquire(8, timeout=1.0))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await budget.acquire(1, timeout=0.05)
+        budget.release(6)
+        await big
+        assert budget.in_use == 8
+
+    @pytest.mark.asyncio
+    async def test_max_jobs_cap(self):
+        budget = CapacityBudget(1000, max_jobs=2)
+        await budget.acquire(1, timeout=0.1)
+        await budget.acquire(1, timeout=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await budget.acquire(1, timeout=0.05)
+
+    @pytest.mark.asyncio
+    async def test_max_queue_rejects_instead_of_waiting(self):
+        budget = CapacityBudget(10, max_queue=1)
+        await budget.acquire(10, timeout=0.1)
+        waiter = asyncio.create_task(budget.acquire(5, timeout=1.0))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await budget.acquire(1, timeout=1.0)
+        budget.release(10)
+        await waiter
+        assert budget.in_use == 5
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_is_removed(self):
+        budget = CapacityBudget(10)
+        await budget.acquire(10, timeout=0.1)
+        waiter = asyncio.create_task(budget.acquire(5, timeout=5))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert budget.queued == 0
+        budget.release(10)
+        assert budget.in_use == 0
+
+
+class TestLaneRouter:
+    def test_model_lane_wins_over_kind_lane(self):
+        router = LaneRouter(
+            {"capacity": 100, "max_jobs": 4},
+            {"bertscore:big": {"max_jobs": 1, "timeout_s": 5}},
+            kinds=("embed", "bertscore"),
+        )
+        big = router.select("bertscore", "big")
+        assert big.name == "bertscore:big"
+        assert big.budget.max_jobs == 1
+        assert big.timeout == 5
+        assert router.select("bertscore", "small").name == "bertscore"
+        assert router.select("embed", "big").budget.capacity == 100
+        assert router.select("rerank", "x").name == "rerank"
+        assert [lane.name for lane in router.lanes()] == ["bertscore:big", "embed", "bertscore", "rerank"]
+
+    def test_unknown_setting_is_rejected(self):
+        with pytest.raises(ValueError, match="max_concurrency"):
+            LaneRouter({"capacity": 100}, {"embed": {"max_concurrency": 2}})
+
+    @pytest.mark.asyncio
+    async def test_lanes_are_independent(self):
+        router = LaneRouter({"capacity": 10, "max_jobs": 1})
+        await router.acquire(router.select("bertscore", "m"), 10, timeout=0.1)
+        await router.acquire(router.select("embed", "m"), 10, timeout=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await router.acquire(router.select("bertscore", "m"), 1, timeout=0.05)
+
+    @pytest.mark.asyncio
+    async def test_global_budget_failure_releases_lane(self):
+        router = LaneRouter({"capacity": 10}, global_budget=CapacityBudget(12))
+        await router.acquire(router.select("bertscore", "m"), 10, timeout=0.1)
+        embed = router.select("embed", "m")
+        with pytest.raises(asyncio.TimeoutError):
+            await router.acquire(embed, 5, timeout=0.05)
+        assert embed.budget.in_use == 0
+        await router.acquire(embed, 2, timeout=0.1)
+        router.release(embed, 2)
+        assert router.global_budget.in_use == 10
+
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("GPU_LANES", '{"embed": {"capacity_units": 50, "max_queue": 3}}')
+        monkeypatch.setenv("GPU_GLOBAL_CAPACITY_UNITS", "500")
+        router = LaneRouter.from_env(200, 8, 1.0, kinds=("embed", "bertscore"))
+        embed = router.select("embed", "m")
+        assert (embed.budget.capacity, embed.budget.max_jobs, embed.budget.max_queue) == (50, 8, 3)
+        assert router.select("bertscore", "m").budget.capacity == 200
+        assert router.global_budget.capacity == 500
+        assert router.global_budget.max_jobs is None
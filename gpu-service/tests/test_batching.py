@@ -0,0 +1,74 @@
+"""Tests for the micro-batcher used by the WebSocket endpoint."""
+
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class _Recorder:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.calls: list[tuple] = []
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, key, items):
+        self.calls.append((key, list(items)))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ValueError("boom")
+        return [f"{key}:{item}" for item in items]
+
+
+class TestMicroBatcher:
+    @pytest.mark.asyncio
+    async def test_concurrent_submissions_share_a_batch(self):
+        run = _Recorder()
+        batcher = MicroBatcher(run, max_items=10, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit("m", ["a"]), batcher.submit("m", ["b", "c"]), batcher.submit("m", ["d"])
+        )
+        assert results == [["m:a"], ["m:b", "m:c"], ["m:d"]]
+        assert run.calls == [("m", ["a", "b", "c", "d"])]
+
+    @pytest.mark.asyncio
+    async def test_keys_are_batched_separately(self):
+        run = _Recorder()
+        batcher = MicroBatcher(run, max_items=10, window=0.01)
+        await asyncio.gather(batcher.submit("x", ["1"]), batcher.submit("y", ["2"]))
+        assert sorted(run.calls) == [("x", ["1"]), ("y", ["2"])]
+
+    @pytest.mark.asyncio
+    async def test_full_batch_runs_without_waiting_for_window(self):
+        run = _Recorder()
+        batcher = MicroBatcher(run, max_items=2, window=10.0)
+        result = await asyncio.wait_for(
+            asyncio.gather(batcher.submit("m", ["a"]), batcher.submit("m", ["b"])), timeout=1.0
+        )
+        assert result == [["m:a"], ["m:b"]]
+
+    @pytest.mark.asyncio
+    async def test_batches_never_exceed_max_items(self):
+        run = _Recorder()
+        batcher = MicroBatcher(run, max_items=3, window=0.01)
+        await asyncio.gather(batcher.submit("m", ["a", "b"]), batcher.submit("m", ["c", "d"]))
+        assert [items for _, items in run.calls] == [["a", "b"], ["c", "d"]]
+
+    @pytest.mark.asyncio
+    async def test_failure_reaches_every_submitter(self):
+        batcher = MicroBatcher(_Recorder(fail=True), max_items=10, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit("m", ["a"]), batcher.submit("m", ["b"]), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_close_cancels_running_batches(self):
+        batcher = MicroBatcher(_Recorder(delay=10.0), max_items=1, window=0.01)
+        waiter = asyncio.ensure_future(batcher.submit("m", ["a"]))
+        await asyncio.sleep(0.01)
+        await batcher.close()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
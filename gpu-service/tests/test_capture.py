@@ -0,0 +1,60 @@
+"""Tests for sampled traffic capture."""
+
+import gzip
+import json
+
+import pytest
+
+from capture import TrafficCapture, read_trace, scrub_texts
+
+
+def test_scrub_modes():
+    texts = ["hello", ["hello", "bye"]]
+    assert scrub_texts(texts, "full", b"k") == texts
+    hashed = scrub_texts(texts, "hash", b"k")
+    assert hashed[0] == hashed[1][0] != hashed[1][1]
+    assert hashed[0]["len"] == 5 and len(hashed[0]["sha"]) == 16
+    assert scrub_texts(texts, "hash", b"other")[0] != hashed[0]
+    assert scrub_texts(texts, "redact", b"k") == [{"len": 5}, [{"len": 5}, {"len": 3}]]
+    with pytest.raises(ValueError):
+        TrafficCapture("unused.jsonl.gz", texts="plain")
+
+
+def test_capture_writes_scrubbed_records(tmp_path):
+    path = tmp_path / "trace.jsonl.gz"
+    capture = TrafficCapture(path, texts="redact")
+    body = json.dumps({"candidates": ["ab"], "references": [["abc", "d"]], "model": "m"}).encode()
+    capture.record("/bertscore", 100.5, body, 200, 0.0123, "250")
+    capture.record("/embed", 101.0, b"not json", 400, 0.001, None)
+    capture.record("/embed", 101.5, json.dumps({"texts": ["xyz"]}).encode(), 503, 0.002, None)
+    capture.close()
+    records = read_trace(path)
+    assert (capture.captured, capture.dropped) == (2, 1)
+    assert records[0] == {
+        "t": 100.5, "path": "/bertscore", "status": 200, "ms": 12.3, "deadline_ms": "250",
+        "body": {"candidates": [{"len": 2}], "references": [[{"len": 3}, {"len": 1}]], "model": "m"},
+    }
+    assert records[1]["body"] == {"texts": [{"len": 3}]} and records[1]["status"] == 503
+
+
+def test_trace_survives_truncated_tail_and_appends(tmp_path):
+    path = tmp_path / "trace.jsonl.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(b'{"t": 1, "path": "/embed", "body": {}}\n')
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b'{"t": 2, "path": "/embed", "body": {}}\n{"t": 3, "pa')[:-12])
+    assert [r["t"] for r in read_trace(path)] == [1, 2]  # the cut-off third line is dropped
+
+    path = tmp_path / "appended.jsonl.gz"
+    for t in (1, 2):
+        capture = TrafficCapture(path, texts="full")
+        capture.record("/embed", t, b'{"texts": ["a"]}', 200, 0.001, None)
+        capture.close()
+    assert [r["t"] for r in read_trace(path)] == [1, 2]
+
+
+def test_sampling_rate(tmp_path):
+    capture = TrafficCapture(tmp_path / "t.jsonl.gz", sample=0.25, seed=1)
+    hits = sum(capture.sampled() for _ in range(4000))
+    capture.close()
+    assert 800 < hits < 1200
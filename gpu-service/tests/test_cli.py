@@ -0,0 +1,161 @@
+"""Tests for the offline bulk embedding/scoring CLI."""
+
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+import cli
+from cli import Checkpoint, InputError, iter_rows
+
+
+def _vector(text: str) -> list[float]:
+    n = int(text.split()[-1])
+    return [float(n), float(n) * 2, 1.0]
+
+
+class _Embedder:
+    """Deterministic stand-in: one vector per text; can fail after `fail_after` calls."""
+
+    def __init__(self, fail_after=None):
+        self.seen: list[str] = []
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def encode(self, texts, convert_to_numpy=True):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("worker killed")
+        self.seen.extend(texts)
+        return np.array([_vector(t) for t in texts], dtype=np.float32)
+
+
+class _Scorer:
+    def score(self, cands, refs):
+        p = torch.tensor([float(len(c)) for c in cands])
+        r = torch.tensor([float(len(x)) for x in refs])
+        return p, r, p + r
+
+
+@pytest.fixture
+def service(monkeypatch):
+    state = SimpleNamespace(embedder=_Embedder(), scorer=_Scorer())
+    module = SimpleNamespace(
+        DEFAULT_EMBED_MODEL="embed-model",
+        DEFAULT_BERTSCORE_MODEL="score-model",
+        _load_embedder=lambda app, name: state.embedder,
+        _load_bertscorer=lambda app, name: state.scorer,
+    )
+    app = SimpleNamespace(state=SimpleNamespace(device=torch.device("cpu")))
+    monkeypatch.setattr(cli, "_service_state", lambda args: (module, app))
+    return state
+
+
+def _write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    return path
+
+
+class TestIterRows:
+    def test_jsonl_fields_skip_and_bare_strings(self, tmp_path):
+        path = tmp_path / "in.jsonl"
+        path.write_text('{"text": "a"}\n\n"b"\n{"text": "c"}\n')
+        assert list(iter_rows(path, ["text"])) == [("a",), ("b",), ("c",)]
+        assert list(iter_rows(path, ["text"], skip=2)) == [("c",)]
+        assert cli.count_rows(path) == 3
+
+    def test_missing_field_names_the_line(self, tmp_path):
+        path = _write_jsonl(tmp_path / "in.jsonl", [{"text": "a"}, {"body": "b"}])
+        with pytest.raises(InputError, match="in.jsonl:2"):
+            list(iter_rows(path, ["text"]))
+
+    def test_parquet_without_pyarrow_is_a_clear_error(self, tmp_path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            with pytest.raises(InputError, match="pyarrow"):
+                cli.count_rows(tmp_path / "in.parquet")
+        else:
+            pytest.skip("pyarrow is installed")
+
+
+class TestEmbedFile:
+    def test_writes_one_row_per_input(self, tmp_path, service):
+        src = _write_jsonl(tmp_path / "in.jsonl", [{"text": f"s {i % 4}"} for i in range(10)])
+        out = tmp_path / "v.npy"
+        assert cli.main(["embed-file", str(src), "--out", str(out), "--block-size", "3", "--batch-size", "2"]) == 0
+        vectors = np.load(out)
+        assert vectors.shape == (10, 3)
+        for i in range(10):
+            assert vectors[i].tolist() == _vector(f"s {i % 4}")
+        assert not (tmp_path / ("v.npy" + cli.CHECKPOINT_SUFFIX)).exists()
+
+    def test_resumes_from_last_checkpoint(self, tmp_path, service):
+        src = _write_jsonl(tmp_path / "in.jsonl", [{"text": f"s {i}"} for i in range(12)])
+        out = tmp_path / "v.npy"
+        args = ["embed-file", str(src), "--out", str(out), "--block-size", "4", "--batch-size", "4",
+                "--checkpoint-rows", "4"]
+        service.embedder = _Embedder(fail_after=2)
+        with pytest.raises(RuntimeError, match="worker killed"):
+            cli.main(args)
+        ckpt = json.loads((tmp_path / ("v.npy" + cli.CHECKPOINT_SUFFIX)).read_text())
+        assert ckpt["done"] == 8
+
+        service.embedder = _Embedder()
+        assert cli.main(args) == 0
+        assert service.embedder.seen == [f"s {i}" for i in range(8, 12)]
+        vectors = np.load(out)
+        assert [row.tolist() for row in vectors] == [_vector(f"s {i}") for i in range(12)]
+
+    def test_ctrl_c_saves_a_checkpoint_and_resumes(self, tmp_path, service, capsys):
+        import signal
+
+        src = _write_jsonl(tmp_path / "in.jsonl", [{"text": f"s {i}"} for i in range(12)])
+        out = tmp_path / "v.npy"
+        args = ["embed-file", str(src), "--out", str(out), "--block-size", "4", "--batch-size", "4"]
+        embedder = service.embedder
+        encode = embedder.encode
+
+        def interrupting_encode(texts, convert_to_numpy=True):
+            if embedder.calls == 1:
+                signal.raise_signal(signal.SIGINT)
+            return encode(texts, convert_to_numpy)
+
+        embedder.encode = interrupting_encode
+        assert cli.main(args) == 130
+        assert "rerun the same command to resume" in capsys.readouterr().err
+        ckpt = json.loads((tmp_path / ("v.npy" + cli.CHECKPOINT_SUFFIX)).read_text())
+        assert 4 <= ckpt["done"] < 12  # well before the first --checkpoint-rows checkpoint
+
+        service.embedder = _Embedder()
+        assert cli.main(args) == 0
+        assert service.embedder.seen == [f"s {i}" for i in range(ckpt["done"], 12)]
+        assert [row.tolist() for row in np.load(out)] == [_vector(f"s {i}") for i in range(12)]
+
+    def test_refuses_to_clobber_finished_output(self, tmp_path, service, capsys):
+        src = _write_jsonl(tmp_path / "in.jsonl", [{"text": "s 1"}])
+        out = tmp_path / "v.npy"
+        assert cli.main(["embed-file", str(src), "--out", str(out)]) == 0
+        assert cli.main(["embed-file", str(src), "--out", str(out)]) == 2
+        assert "--overwrite" in capsys.readouterr().err
+        assert cli.main(["embed-file", str(src), "--out", str(out), "--overwrite"]) == 0
+
+    def test_checkpoint_from_other_run_is_rejected(self, tmp_path, service):
+        src = _write_jsonl(tmp_path / "in.jsonl", [{"text": "s 1"}])
+        out = tmp_path / "v.npy"
+        Checkpoint(out, {"kind": "embed", "model": "other"}).save(1)
+        assert cli.main(["embed-file", str(src), "--out", str(out)]) == 2
+
+
+class TestBertScoreFile:
+    def test_writes_precision_recall_f1(self, tmp_path, service):
+        src = _write_jsonl(tmp_path / "pairs.jsonl", [
+            {"candidate": "ab", "reference": "abc"},
+            {"candidate": "a", "reference": "abcd"},
+            {"candidate": "ab", "reference": "abc"},
+        ])
+        out = tmp_path / "s.npy"
+        assert cli.main(["bertscore-file", str(src), "--out", str(out), "--batch-size", "1"]) == 0
+        assert np.load(out).tolist() == [[2, 3, 5], [1, 4, 5], [2, 3, 5]]
@@ -0,0 +1,142 @@
+"""Tests for request/response body compression."""
+
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from httpx import ASGITransport, AsyncClient
+
+import compression
+from compression import BodyTooLarge, CompressionMiddleware, compress, decompress, negotiate
+
+
+def _app(**options) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        payload = await request.json()
+        return {"texts": payload["texts"], "encoding": request.headers.get("content-encoding")}
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            yield "event: x\ndata: " + "y" * 500 + "\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app.add_middleware(CompressionMiddleware, **{"minimum_size": 100, **options})
+    return app
+
+
+async def _client(app: FastAPI) -> AsyncClient:
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+class TestCodec:
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_round_trip(self, encoding):
+        data = b"embedding " * 1000
+        packed = compress(data, encoding)
+        assert len(packed) < len(data)
+        assert decompress(packed, encoding) == data
+
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_decompression_bomb_is_rejected(self, encoding):
+        packed = compress(b"\0" * 100_000, encoding)
+        with pytest.raises(BodyTooLarge):
+            decompress(packed, encoding, limit=10_000)
+
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            decompress(b"x", "br")
+
+    def test_truncated_gzip(self):
+        with pytest.raises(ValueError):
+            decompress(gzip.compress(b"hello world" * 10)[:-8], "gzip")
+
+
+class TestNegotiate:
+    def test_prefers_zstd(self):
+        assert negotiate("gzip, deflate, br, zstd") == "zstd"
+
+    def test_respects_q_values(self):
+        assert negotiate("zstd;q=0.1, gzip") == "gzip"
+        assert negotiate("zstd;q=0, gzip;q=0") is None
+
+    def test_wildcard_and_none(self):
+        assert negotiate("*") == "zstd"
+        assert negotiate("") is None
+        assert negotiate("br, deflate") is None
+
+    def test_gzip_only_without_zstandard(self, monkeypatch):
+        monkeypatch.setattr(compression, "zstandard", None)
+        assert negotiate("zstd, gzip") == "gzip"
+
+
+class TestMiddleware:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    async def test_compressed_request_body_is_decoded(self, encoding):
+        body = json.dumps({"texts": ["hello"] * 50}).encode()
+        async with await _client(_app()) as c:
+            resp = await c.post(
+                "/echo",
+                content=compress(body, encoding),
+                headers={"Content-Encoding": encoding, "Content-Type": "application/json", "Accept-Encoding": "identity"},
+            )
+        assert resp.status_code == 200
+        assert resp.json() == {"texts": ["hello"] * 50, "encoding": None}
+
+    @pytest.mark.asyncio
+    async def test_unsupported_request_encoding_is_415(self):
+        async with await _client(_app()) as c:
+            resp = await c.post("/echo", content=b"xx", headers={"Content-Encoding": "br"})
+        assert resp.status_code == 415
+
+    @pytest.mark.asyncio
+    async def test_corrupt_body_is_400(self):
+        async with await _client(_app()) as c:
+            resp = await c.post("/echo", content=b"not gzip", headers={"Content-Encoding": "gzip"})
+        assert resp.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_oversized_body_is_413(self):
+        async with await _client(_app(max_request_bytes=1000)) as c:
+            resp = await c.post("/echo", content=compress(b"\0" * 5000, "gzip"), headers={"Content-Encoding": "gzip"})
+        assert resp.status_code == 413
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    async def test_large_response_is_compressed(self, encoding):
+        async with await _client(_app()) as c:
+            resp = await c.post("/echo", json={"texts": ["hello"] * 100}, headers={"Accept-Encoding": encoding})
+        assert resp.headers["content-encoding"] == encoding
+        assert "accept-encoding" in resp.headers["vary"].lower()
+        # httpx decodes gzip and (with zstandard installed) zstd transparently.
+        assert resp.json()["texts"] == ["hello"] * 100
+
+    @pytest.mark.asyncio
+    async def test_small_response_is_not_compressed(self):
+        async with await _client(_app()) as c:
+            resp = await c.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in resp.headers
+        assert resp.json() == {"ok": True}
+
+    @pytest.mark.asyncio
+    async def test_event_stream_is_not_compressed(self):
+        async with await _client(_app()) as c:
+            resp = await c.get("/stream", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in resp.headers
+        assert resp.text.startswith("event: x")
+
+    @pytest.mark.asyncio
+    async def test_disabled_passes_responses_through(self):
+        async with await _client(_app(enabled=False)) as c:
+            resp = await c.post("/echo", json={"texts": ["hello"] * 100}, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in resp.headers
@@ -0,0 +1,112 @@
+"""Tests for the CPU replica pool."""
+
+import asyncio
+import threading
+
+import pytest
+import torch
+
+from cpu_replicas import CpuReplicaPool, core_sets, numa_nodes, parse_cpulist, share_weights_copy
+
+
+class _Encoder:
+    """Small model object: weights in `_model`, plus per-instance mutable state."""
+
+    def __init__(self):
+        self._model = torch.nn.Linear(2, 2)
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(threading.current_thread().name)
+        return [len(t) for t in texts]
+
+
+class TestTopology:
+    def test_parse_cpulist(self):
+        assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+        assert parse_cpulist("") == []
+
+    def test_core_sets_are_disjoint_and_stay_in_one_node(self):
+        nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+        sets = core_sets(4, nodes)
+        assert sets == [[0, 1], [4, 5], [2, 3], [6, 7]]
+        assert core_sets(2, [list(range(8))]) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+    def test_more_replicas_than_cores_still_get_one_core_each(self):
+        assert core_sets(3, [[0, 1]]) == [[0], [1], [0]]
+
+    def test_numa_nodes_cover_allowed_cores(self):
+        nodes = numa_nodes()
+        assert nodes and all(nodes)
+
+
+class TestShareWeightsCopy:
+    def test_weights_shared_state_private(self):
+        original = _Encoder()
+        clone = share_weights_copy(original)
+        assert clone is not original
+        assert clone._model.weight is original._model.weight
+        assert clone.calls is not original.calls
+
+
+class TestCpuReplicaPool:
+    @pytest.mark.asyncio
+    async def test_map_keeps_order_and_spreads_work(self):
+        pool = CpuReplicaPool(2, threads=1, pin=False, nodes=[[0]])
+        encoder = _Encoder()
+        gate = threading.Barrier(2, timeout=5)
+
+        def run(model, texts):
+            gate.wait()  # both replicas must be busy at the same time
+            return model.encode(texts)
+
+        try:
+            results = await pool.map("k", encoder, run, [["a"], ["bb"], ["ccc"], ["dddd"]])
+        finally:
+            pool.close()
+        assert results == [[1], [2], [3], [4]]
+        status = pool.status()
+        assert [r["completed"] for r in status] == [2, 2]
+        assert all(r["inflight"] == 0 for r in status)
+        # Replica 0 runs the original object; replica 1 its own weight-sharing copy.
+        assert len(encoder.calls) == 2
+        assert all(name.startswith("cpu-replica-0") for name in encoder.calls)
+
+    @pytest.mark.asyncio
+    async def test_stats_record_busy_time_per_replica(self):
+        from pipeline import PipelineStats
+
+        pool = CpuReplicaPool(2, threads=1, pin=False, nodes=[[0]])
+        stats = PipelineStats(pool.names())
+        done = []
+        try:
+            await pool.map("k", _Encoder(), lambda m, t: m.encode(t), [["a"]] * 3, stats=stats, on_item=done.append)
+        finally:
+            pool.close()
+        assert sorted(done) == [0, 1, 2]
+        assert stats.completed_items == 3
+        assert set(stats.utilization()) == {"replica-0", "replica-1"}
+
+    @pytest.mark.asyncio
+    async def test_failure_propagates(self):
+        pool = CpuReplicaPool(2, threads=1, pin=False, nodes=[[0]])
+
+        def boom(model, item):
+            raise ValueError("bad batch")
+
+        try:
+            with pytest.raises(ValueError, match="bad batch"):
+                await pool.map("k", _Encoder(), boom, [1, 2, 3])
+            await asyncio.sleep(0.05)
+        finally:
+            pool.close()
+        assert all(r["inflight"] == 0 for r in pool.status())
+
+    @pytest.mark.asyncio
+    async def test_replica_threads_get_their_own_intra_op_size(self):
+        pool = CpuReplicaPool(2, threads=3, pin=True, nodes=[[0]])
+        try:
+            sizes = await asyncio.gather(*(pool.run("k", None, lambda m, _: torch.get_num_threads(), i) for i in range(2)))
+        finally:
+            pool.close()
+        assert sizes == [3, 3]
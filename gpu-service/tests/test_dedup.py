@@ -0,0 +1,231 @@
+"""Tests for in-request deduplication and in-flight request coalescing."""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from dedup import CallerGone, IdempotencyConflict, IdempotencyStore, InflightCoalescer, dedupe, payload_key
+
+
+class TestDedupe:
+    def test_collapses_repeats_in_first_occurrence_order(self):
+        unique, inverse = dedupe(["b", "a", "b", "c", "a"])
+        assert unique == ["b", "a", "c"]
+        assert [unique[i] for i in inverse] == ["b", "a", "b", "c", "a"]
+
+    def test_no_repeats_is_identity(self):
+        unique, inverse = dedupe(["x", "y"])
+        assert unique == ["x", "y"]
+        np.testing.assert_array_equal(inverse, [0, 1])
+
+    def test_pairs(self):
+        unique, inverse = dedupe([("c", "r"), ("c", "r2"), ("c", "r")])
+        assert unique == [("c", "r"), ("c", "r2")]
+        np.testing.assert_array_equal(inverse, [0, 1, 0])
+
+    def test_empty(self):
+        unique, inverse = dedupe([])
+        assert unique == []
+        assert inverse.shape == (0,)
+
+
+class TestPayloadKey:
+    def test_same_payload_same_key(self):
+        assert payload_key("embed", "m", ["a", "b"]) == payload_key("embed", "m", ["a", "b"])
+
+    def test_model_and_kind_are_part_of_key(self):
+        base = payload_key("embed", "m", ["a"])
+        assert payload_key("embed", "other", ["a"]) != base
+        assert payload_key("bertscore", "m", ["a"]) != base
+        assert payload_key("embed", "m", ["a", "a"]) != base
+
+
+class TestInflightCoalescer:
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_computation(self):
+        coalescer = InflightCoalescer()
+        calls = 0
+        release = asyncio.Event()
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "result"
+
+        first = asyncio.create_task(coalescer.run("k", compute))
+        second = asyncio.create_task(coalescer.run("k", compute))
+        await asyncio.sleep(0)
+        assert "k" in coalescer
+        release.set()
+        assert await first == ("result", False)
+        assert await second == ("result", True)
+        assert calls == 1
+        assert len(coalescer) == 0
+
+    @pytest.mark.asyncio
+    async def test_sequential_calls_recompute(self):
+        coalescer = InflightCoalescer()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await coalescer.run("k", compute) == (1, False)
+        assert await coalescer.run("k", compute) == (2, False)
+
+    @pytest.mark.asyncio
+    async def test_error_reaches_every_waiter(self):
+        coalescer = InflightCoalescer()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            raise ValueError("boom")
+
+        tasks = [asyncio.create_task(coalescer.run("k", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        for task in tasks:
+            with pytest.raises(ValueError, match="boom"):
+                await task
+
+    @pytest.mark.asyncio
+    async def test_cancelling_one_waiter_keeps_work_for_others(self):
+        coalescer = InflightCoalescer()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(coalescer.run("k", compute))
+        second = asyncio.create_task(coalescer.run("k", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == ("done", True)
+
+    @pytest.mark.asyncio
+    async def test_last_waiter_leaving_cancels_work(self):
+        coalescer = InflightCoalescer()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.create_task(coalescer.run("k", compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
+        await asyncio.sleep(0)
+        assert len(coalescer) == 0
+
+    @pytest.mark.asyncio
+    async def test_linger_lets_a_retry_join_then_cancels(self):
+        coalescer = InflightCoalescer()
+        release = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "done"
+
+        waiter = asyncio.create_task(coalescer.run("k", compute, linger=0.05))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0.02)
+        assert "k" in coalescer and not cancelled.is_set()
+        retry = asyncio.create_task(coalescer.run("k", compute))
+        await asyncio.sleep(0.1)  # past the grace period, but the retry is still waiting
+        assert not cancelled.is_set()
+        release.set()
+        assert await retry == ("done", True)
+
+        release.clear()
+        waiter = asyncio.create_task(coalescer.run("k2", compute, linger=0.05))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
+
+    @pytest.mark.asyncio
+    async def test_watch_reason_stops_waiting(self):
+        coalescer = InflightCoalescer()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def watch():
+            return "deadline"
+
+        with pytest.raises(CallerGone) as excinfo:
+            await coalescer.run("k", compute, watch=watch, poll_interval=0.01)
+        assert excinfo.value.reason == "deadline"
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
+
+    @pytest.mark.asyncio
+    async def test_watch_returning_none_keeps_waiting(self):
+        coalescer = InflightCoalescer()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def watch():
+            return None
+
+        assert await coalescer.run("k", compute, watch=watch, poll_interval=0.01) == ("ok", False)
+
+
+class TestIdempotencyStore:
+    def test_claim_then_replay(self):
+        store = IdempotencyStore(ttl=60, budget_bytes=2**20)
+        assert store.claim("k", "p1") is None
+        assert store.claim("k", "p1") is None  # still running: callers attach by payload
+        store.put("k", "p1", {"embeddings": np.zeros((2, 4), dtype=np.float32)}, seconds=1.5)
+        memo = store.claim("k", "p1")
+        assert memo.seconds == 1.5 and memo.result["embeddings"].shape == (2, 4)
+        assert store.bytes == 32
+
+    def test_key_reuse_for_another_payload_is_refused(self):
+        store = IdempotencyStore(ttl=60, budget_bytes=2**20)
+        store.claim("k", "p1")
+        with pytest.raises(IdempotencyConflict):
+            store.claim("k", "p2")
+        store.put("k", "p1", {}, seconds=0.0)
+        with pytest.raises(IdempotencyConflict):
+            store.claim("k", "p2")
+
+    def test_failed_requests_are_forgotten(self):
+        store = IdempotencyStore(ttl=60, budget_bytes=2**20)
+        store.claim("k", "p1")
+        store.discard("k")
+        assert store.claim("k", "p2") is None
+
+    def test_ttl_and_byte_budget(self):
+        store = IdempotencyStore(ttl=0, budget_bytes=2**20)
+        store.put("k", "p1", {}, seconds=0.0)
+        assert store.claim("k", "p1") is None and len(store) == 0
+
+        store = IdempotencyStore(ttl=60, budget_bytes=100)
+        for i in range(3):
+            store.put(f"k{i}", "p", np.zeros(10, dtype=np.float32), seconds=0.0)
+        assert len(store) == 2 and store.bytes == 80
+        assert store.claim("k0", "p") is None
@@ -0,0 +1,71 @@
+"""Tests for the SSE event bus."""
+
+import asyncio
+import json
+
+import pytest
+
+import events
+from events import EventBus, format_sse, sse_stream
+
+
+def _parse(chunk: str) -> tuple[str, dict]:
+    lines = chunk.strip().splitlines()
+    return lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))
+
+
+class TestEventBus:
+    def test_publish_reaches_every_subscriber(self):
+        bus = EventBus()
+        a, b = bus.subscribe(), bus.subscribe()
+        bus.publish("job_started", {"job": {"id": "1"}})
+        assert a.get_nowait() == ("job_started", {"job": {"id": "1"}})
+        assert b.get_nowait() == ("job_started", {"job": {"id": "1"}})
+
+    def test_slow_subscriber_drops_oldest(self, monkeypatch):
+        monkeypatch.setattr(events, "SUBSCRIBER_QUEUE_SIZE", 2)
+        bus = EventBus()
+        queue = bus.subscribe()
+        for i in range(3):
+            bus.publish("job_progress", {"n": i})
+        assert [queue.get_nowait()[1]["n"] for _ in range(2)] == [1, 2]
+
+    def test_unsubscribe(self):
+        bus = EventBus()
+        queue = bus.subscribe()
+        bus.unsubscribe(queue)
+        assert len(bus) == 0
+
+
+class TestSseStream:
+    def test_format(self):
+        assert format_sse("status", {"a": 1}) == 'event: status\ndata: {"a":1}\n\n'
+
+    @pytest.mark.asyncio
+    async def test_job_stream_filters_and_ends_on_finish(self):
+        bus = EventBus()
+        stream = sse_stream(bus, lambda: [("job_progress", {"job": {"id": "a"}})], job_id="a")
+        first = await stream.__anext__()
+        assert _parse(first)[0] == "job_progress"
+
+        bus.publish("job_progress", {"job": {"id": "other"}})
+        bus.publish("job_progress", {"job": {"id": "a", "progress": 0.5}})
+        bus.publish("job_finished", {"job": {"id": "a"}, "outcome": "done"})
+        rest = [chunk async for chunk in stream]
+        assert [_parse(c)[0] for c in rest] == ["job_progress", "job_finished"]
+        assert _parse(rest[0])[1]["job"]["progress"] == 0.5
+        assert len(bus) == 0
+
+    @pytest.mark.asyncio
+    async def test_already_finished_job_ends_immediately(self):
+        bus = EventBus()
+        stream = sse_stream(bus, lambda: [("job_finished", {"job": {"id": "a"}})], job_id="a")
+        assert [_parse(c)[0] async for c in stream] == ["job_finished"]
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_when_idle(self):
+        bus = EventBus()
+        stream = sse_stream(bus, lambda: [], heartbeat=0.01)
+        assert await asyncio.wait_for(stream.__anext__(), timeout=1.0) == ": keep-alive\n\n"
+        await stream.aclose()
+        assert len(bus) == 0
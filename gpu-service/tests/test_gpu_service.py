@@ -220,6 +220,47 @@ def _make_test_app(api_key: str | None = None):
     return app
 
 
+def _load_service_module():
+    """Import the real gpu_service module with the heavy ML libraries mocked out.
+
+    Only the mocked names are restored afterwards: `patch.dict` would also drop
+    every module first imported during the patch (fastapi/starlette internals),
+    and re-importing those later creates duplicate classes that break routing.
+    """
+    mocked = {"bert_score": MagicMock(), "sentence_transformers": MagicMock()}
+    saved = {name: sys.modules.get(name) for name in mocked}
+    sys.modules.update(mocked)
+    sys.modules.pop("gpu_service", None)
+    try:
+        import gpu_service
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return gpu_service
+
+
+def _make_service_app():
+    """Return (module, app) for the real gpu_service with mocked model state.
+
+    Unlike `_make_test_app`, this exercises the production handlers; state is
+    initialized through `_init_state` because ASGITransport skips the lifespan.
+    """
+    gpu_service = _load_service_module()
+    app = gpu_service.app
+    gpu_service._init_state(
+        app,
+        torch.device("cpu"),
+        MagicMock(return_value=_create_mock_scorer()),
+        MagicMock(return_value=_create_mock_embedder()),
+    )
+    app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = _create_mock_scorer()
+    app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL] = _create_mock_embedder()
+    return gpu_service, app
+
+
 # --- Fixtures ---
 
 
@@ -754,3 +795,1155 @@ class TestHelpers:
                 assert len(models) == 2
 
         asyncio.get_event_loop().run_until_complete(_check())
+
+
+class TestServiceFastResponses:
+    @pytest.mark.asyncio
+    async def test_embed_returns_prerendered_json(self):
+        """The real /embed handler serializes NumPy output without a response model pass."""
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        embedder.encode.return_value = np.array([[0.5, 0.25], [1.0, 2.0]], dtype=np.float32)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            with patch.object(gpu_service.EmbedResponse, "model_validate") as validate:
+                resp = await c.post("/embed", json={"texts": ["a", "b"]})
+        validate.assert_not_called()
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/json"
+        data = resp.json()
+        assert data["embeddings"] == [[0.5, 0.25], [1.0, 2.0]]
+        assert data["dimensions"] == 2
+        assert EmbedResponse(**data).model == "all-MiniLM-L6-v2"
+
+    @pytest.mark.asyncio
+    async def test_embed_empty_texts(self):
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": []})
+        assert resp.status_code == 200
+        assert resp.json() == {"embeddings": [], "model": "all-MiniLM-L6-v2", "dimensions": 0}
+
+    @pytest.mark.asyncio
+    async def test_bertscore_returns_tensor_scores_as_json(self):
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json={"candidates": ["a"], "references": ["b"]})
+        assert resp.status_code == 200
+        data = BertScoreResponse(**resp.json())
+        assert data.precision == pytest.approx([0.9])
+        assert data.f1 == pytest.approx([0.87])
+
+
+class TestServiceDeduplication:
+    @pytest.mark.asyncio
+    async def test_embed_computes_each_unique_text_once(self):
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        embedder.encode.return_value = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["a", "b", "a", "a"]})
+        assert resp.status_code == 200
+        embedder.encode.assert_called_once_with(["a", "b"], convert_to_numpy=True)
+        assert resp.json()["embeddings"] == [[1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [1.0, 0.0]]
+
+    @pytest.mark.asyncio
+    async def test_bertscore_scores_each_unique_pair_once(self):
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.return_value = (
+            torch.tensor([0.1, 0.2]),
+            torch.tensor([0.3, 0.4]),
+            torch.tensor([0.5, 0.6]),
+        )
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post(
+                "/bertscore",
+                json={"candidates": ["c1", "c2", "c1"], "references": ["r1", "r2", "r1"]},
+            )
+        assert resp.status_code == 200
+        scorer.score.assert_called_once_with(["c1", "c2"], ["r1", "r2"])
+        assert resp.json()["f1"] == pytest.approx([0.5, 0.6, 0.5])
+
+    @pytest.mark.asyncio
+    async def test_identical_concurrent_requests_are_coalesced(self):
+        import asyncio
+        import threading
+
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        gate = threading.Event()
+
+        def _slow_encode(texts, convert_to_numpy=True):
+            gate.wait(timeout=5)
+            return np.ones((len(texts), 2), dtype=np.float32)
+
+        embedder.encode.side_effect = _slow_encode
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            requests = [
+                asyncio.create_task(c.post("/embed", json={"texts": ["same", "payload"]}))
+                for _ in range(3)
+            ]
+            while len(app.state.coalescer) == 0:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            gate.set()
+            responses = await asyncio.gather(*requests)
+            metrics = (await c.get("/metrics")).json()
+
+        assert all(r.status_code == 200 for r in responses)
+        assert embedder.encode.call_count == 1
+        assert metrics["counters"]["coalesced_requests"] == 2
+        assert metrics["counters"]["dedup_items_submitted"] == 6
+        assert metrics["counters"]["dedup_items_computed"] == 2
+        assert metrics["dedup_ratio"] == pytest.approx(2 / 3, abs=1e-3)
+
+
+class TestServiceCancellation:
+    @staticmethod
+    def _slow_embedder(app, gpu_service, delay=0.05):
+        import time as _time
+
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+
+        def _slow_encode(texts, convert_to_numpy=True):
+            _time.sleep(delay)
+            return np.ones((len(texts), 2), dtype=np.float32)
+
+        embedder.encode.side_effect = _slow_encode
+        return embedder
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_remaining_batches(self, monkeypatch):
+        import asyncio
+
+        monkeypatch.setenv("GPU_EMBED_BATCH", "1")
+        gpu_service, app = _make_service_app()
+        embedder = self._slow_embedder(app, gpu_service)
+        texts = [f"text {i}" for i in range(20)]
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": texts}, headers={"X-Deadline-Ms": "150"})
+            await asyncio.sleep(0.2)
+            metrics = (await c.get("/metrics")).json()["counters"]
+
+        assert resp.status_code == 504
+        assert embedder.encode.call_count < len(texts)
+        assert app.state.active_jobs == {}
+        assert all(lane.budget.jobs == 0 and lane.budget.in_use == 0 for lane in app.state.lanes.lanes())
+        assert metrics["cancelled_jobs"] == 1
+        assert metrics["abandoned_requests_deadline"] == 1
+        assert metrics["cancelled_items_saved"] > 0
+        assert metrics["cancelled_items_wasted"] + metrics["cancelled_items_saved"] == len(texts)
+
+    @pytest.mark.asyncio
+    async def test_keyed_job_is_cancelled_after_the_grace_period(self, monkeypatch):
+        import asyncio
+
+        monkeypatch.setenv("GPU_EMBED_BATCH", "1")
+        gpu_service, app = _make_service_app()
+        monkeypatch.setattr(gpu_service, "IDEMPOTENCY_GRACE", 0.05)
+        embedder = self._slow_embedder(app, gpu_service)
+        texts = [f"text {i}" for i in range(20)]
+        headers = {"X-Deadline-Ms": "150", "Idempotency-Key": "k-1"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": texts}, headers=headers)
+            await asyncio.sleep(0.3)
+            metrics = (await c.get("/metrics")).json()["counters"]
+
+        assert resp.status_code == 504
+        assert embedder.encode.call_count < len(texts)
+        assert app.state.active_jobs == {}
+        assert metrics["cancelled_jobs"] == 1
+        assert len(app.state.idempotency) == 0
+
+    @pytest.mark.asyncio
+    async def test_client_disconnect_frees_slot(self, monkeypatch):
+        import asyncio
+        import json
+
+        monkeypatch.setenv("GPU_EMBED_BATCH", "1")
+        gpu_service, app = _make_service_app()
+        monkeypatch.setattr(gpu_service, "API_KEY", "secret")
+        embedder = self._slow_embedder(app, gpu_service)
+        body = json.dumps({"texts": [f"t{i}" for i in range(20)]}).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/embed", "raw_path": b"/embed", "query_string": b"",
+            "root_path": "", "server": ("test", 80), "client": ("127.0.0.1", 1234),
+            "headers": [(b"content-type", b"application/json"), (b"x-api-key", b"secret"),
+                        (b"content-length", str(len(body)).encode())],
+        }
+        gone = asyncio.Event()
+        sent = []
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        # A real disconnect through the whole middleware stack (compression, capture, auth).
+        request = asyncio.create_task(app(scope, receive, send))
+        await asyncio.sleep(0.2)
+        gone.set()
+        await asyncio.wait_for(request, timeout=5)
+        await asyncio.sleep(0.1)
+        assert sent[0]["status"] == 499
+        assert embedder.encode.call_count < 20
+        assert app.state.active_jobs == {}
+        assert all(lane.budget.jobs == 0 and lane.budget.in_use == 0 for lane in app.state.lanes.lanes())
+        assert app.state.metrics.get("abandoned_requests_disconnected") == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_header_validation(self):
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            bad = await c.post("/embed", json={"texts": ["a"]}, headers={"X-Deadline-Ms": "soon"})
+            expired = await c.post("/embed", json={"texts": ["a"]}, headers={"X-Deadline-Ms": "0"})
+            ok = await c.post("/embed", json={"texts": ["a"]}, headers={"X-Deadline-Ms": "5000"})
+        assert bad.status_code == 400
+        assert expired.status_code == 504
+        assert ok.status_code == 200
+
+
+class TestServiceAdmission:
+    @pytest.mark.asyncio
+    async def test_oversized_request_gets_413_with_estimated_cost(self):
+        from admission import LaneRouter
+
+        _, app = _make_service_app()
+        app.state.lanes = LaneRouter({"capacity": 10})
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["x" * 400]})
+        assert resp.status_code == 413
+        assert "estimated cost 102 units" in resp.json()["detail"]
+
+    @pytest.mark.asyncio
+    async def test_max_size_request_fits_after_upward_calibration(self):
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.side_effect = _scores_for
+        cost_model = app.state.cost_model
+        cost_model.observe(gpu_service.DEFAULT_EMBED_MODEL, tokens=1000, seconds=0.01)
+        cost_model.observe(gpu_service.DEFAULT_BERTSCORE_MODEL, tokens=1000, seconds=10.0)
+        n = gpu_service.MAX_BATCH_SIZE
+        body = {
+            "candidates": [f"{'c' * 4000}-{i}" for i in range(n)],
+            "references": [f"{'r' * 4000}-{i}" for i in range(n)],
+        }
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json=body)
+        assert resp.status_code == 200
+        assert len(resp.json()["f1"]) == n
+
+    @pytest.mark.asyncio
+    async def test_busy_budget_gets_503_with_cost(self):
+        gpu_service, app = _make_service_app()
+        lane = app.state.lanes.select("embed", gpu_service.DEFAULT_EMBED_MODEL)
+        lane.timeout = 0.05
+        await lane.budget.acquire(lane.budget.capacity, timeout=0.1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["hello"]})
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "5"
+        assert "lane embed: estimated cost" in resp.json()["detail"]
+
+    @pytest.mark.asyncio
+    async def test_cheap_embed_admitted_next_to_expensive_job(self):
+        gpu_service, app = _make_service_app()
+        budget = app.state.lanes.select("embed", gpu_service.DEFAULT_EMBED_MODEL).budget
+        # An expensive job holds most of the budget but leaves room for a small embed.
+        await budget.acquire(budget.capacity - 100, timeout=0.1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["hello"]})
+            status = (await c.get("/status")).json()["queue"]
+        assert resp.status_code == 200
+        lanes = {lane["name"]: lane for lane in status["lanes"]}
+        assert lanes["embed"]["in_use_units"] == pytest.approx(budget.capacity - 100)
+        assert lanes["embed"]["capacity_units"] == pytest.approx(budget.capacity)
+        assert status["in_use_units"] == pytest.approx(budget.capacity - 100)
+        assert "all-MiniLM-L6-v2" in status["cost_factors"]
+
+    @pytest.mark.asyncio
+    async def test_full_bertscore_lane_does_not_block_embed(self):
+        gpu_service, app = _make_service_app()
+        lane = app.state.lanes.select("bertscore", gpu_service.DEFAULT_BERTSCORE_MODEL)
+        lane.timeout = 0.05
+        await lane.budget.acquire(lane.budget.capacity, timeout=0.1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            embed = await c.post("/embed", json={"texts": ["hello"]})
+            score = await c.post("/bertscore", json={"candidates": ["a"], "references": ["b"]})
+            status = (await c.get("/status")).json()["queue"]
+        assert embed.status_code == 200
+        assert score.status_code == 503
+        lanes = {lane["name"]: lane for lane in status["lanes"]}
+        assert lanes["bertscore"]["jobs"] == 1
+        assert lanes["embed"]["jobs"] == 0
+        assert status["global_budget"] is None
+
+    @pytest.mark.asyncio
+    async def test_global_cap_is_shared_by_lanes(self, monkeypatch):
+        from admission import LaneRouter
+
+        monkeypatch.setenv("GPU_GLOBAL_MAX_JOBS", "1")
+        monkeypatch.setenv("GPU_LANES", '{"bertscore": {"max_jobs": 1, "timeout_s": 0.05}}')
+        gpu_service, app = _make_service_app()
+        app.state.lanes = LaneRouter.from_env(1e9, 16, 0.05, kinds=("embed", "bertscore"))
+        router = app.state.lanes
+        await router.acquire(router.select("bertscore", "m"), 1, timeout=0.1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["hello"]})
+            status = (await c.get("/status")).json()["queue"]
+        assert resp.status_code == 503
+        assert status["global_budget"]["jobs"] == 1
+        assert status["global_budget"]["capacity_units"] is None
+        assert router.select("embed", "m").budget.jobs == 0
+
+
+def _scores_for(cands, refs):
+    """Deterministic fake BERTScore: F1 encodes the candidate's numeric suffix."""
+    values = torch.tensor([float(c.rsplit("-", 1)[-1]) for c in cands])
+    return values / 10, values / 100, values
+
+
+class TestServiceBertScoreProgress:
+    @pytest.mark.asyncio
+    async def test_bertscore_runs_in_sub_batches(self, monkeypatch):
+        monkeypatch.setenv("GPU_BERTSCORE_BATCH", "2")
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.side_effect = _scores_for
+        cands = [f"c-{i}" for i in range(5)]
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json={"candidates": cands, "references": ["r"] * 5})
+        assert resp.status_code == 200
+        assert scorer.score.call_count == 3
+        assert resp.json()["f1"] == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    @pytest.mark.asyncio
+    async def test_job_event_stream_reports_progress(self, monkeypatch):
+        import asyncio
+        import json
+        import time as _time
+
+        monkeypatch.setenv("GPU_BERTSCORE_BATCH", "1")
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+
+        def _slow(cands, refs):
+            _time.sleep(0.05)
+            return _scores_for(cands, refs)
+
+        scorer.score.side_effect = _slow
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            job = asyncio.create_task(c.post(
+                "/bertscore",
+                json={"candidates": [f"c-{i}" for i in range(4)], "references": ["r"] * 4},
+                headers={"X-Job-Id": "job-1"},
+            ))
+            while "job-1" not in app.state.active_jobs:
+                await asyncio.sleep(0.005)
+            stream = await c.get("/jobs/job-1/events")
+            assert (await job).status_code == 200
+
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.splitlines()[0].removeprefix("event: "), json.loads(block.splitlines()[1].removeprefix("data: ")))
+            for block in stream.text.strip().split("\n\n")
+        ]
+        assert events[-1][0] == "job_finished"
+        assert events[-1][1]["outcome"] == "done"
+        progress = [data["job"] for name, data in events if name == "job_progress"]
+        assert progress[-1]["progress"] == 1.0
+        assert progress[-1]["items_per_sec"] > 0
+        assert progress[-1]["eta_seconds"] == 0
+
+    @pytest.mark.asyncio
+    async def test_unknown_job_stream_is_404(self, monkeypatch):
+        gpu_service, app = _make_service_app()
+        monkeypatch.setattr(gpu_service, "JOB_SUBSCRIBE_WAIT", 0.05)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.get("/jobs/nope/events")
+        assert resp.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_stream_can_subscribe_before_job_starts(self):
+        import asyncio
+
+        gpu_service, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            stream = asyncio.create_task(c.get("/jobs/early-1/events"))
+            while not len(app.state.events):
+                await asyncio.sleep(0.005)
+            resp = await c.post("/embed", json={"texts": ["hello"]}, headers={"X-Job-Id": "early-1"})
+            events = (await stream).text
+        assert resp.status_code == 200
+        assert events.index("event: job_started") < events.index("event: job_finished")
+        assert '"outcome":"done"' in events
+
+    def test_progress_without_subscribers_skips_snapshot(self, monkeypatch):
+        gpu_service, app = _make_service_app()
+        snapshot = MagicMock()
+        monkeypatch.setattr(gpu_service, "_queue_status", snapshot)
+        job = gpu_service._start_job(app, "quiet", "embed", 10, "m", 1.0)
+        gpu_service._report_progress(app, "quiet", 5, 10, 0.0)
+        gpu_service._finish_job(app, "quiet", "done")
+        assert snapshot.call_count == 0
+        assert job["progress"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_invalid_job_id_header(self):
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["a"]}, headers={"X-Job-Id": "bad id!"})
+        assert resp.status_code == 400
+
+
+class TestServiceResidency:
+    @pytest.mark.asyncio
+    async def test_offloaded_model_is_promoted_on_next_request(self, tmp_path):
+        from residency import ResidencyManager
+
+        gpu_service, app = _make_service_app()
+        manager = ResidencyManager(torch.device("cpu"), idle_seconds=0.0, spill_dir=tmp_path)
+        app.state.residency = manager
+        weights = torch.nn.Linear(4, 4)
+        manager.register("embed", gpu_service.DEFAULT_EMBED_MODEL, weights)
+        assert await manager.offload_idle(lambda kind, name: gpu_service._model_busy(app, kind, name))
+
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            before = (await c.get("/info")).json()
+            resp = await c.post("/embed", json={"texts": ["a"]})
+            after = (await c.get("/info")).json()
+        assert resp.status_code == 200
+        assert before["offload_idle_seconds"] is None  # no background sweep; offloaded by hand above
+        [entry] = before["residency"]
+        assert entry["model"] == f"embed:{gpu_service.DEFAULT_EMBED_MODEL}"
+        assert entry["state"] == "file"
+        [entry] = after["residency"]
+        assert entry["state"] == "device"
+        assert entry["promotions"] == 1
+        assert entry["last_promotion_ms"] is not None
+
+    def test_running_job_marks_model_busy(self):
+        gpu_service, app = _make_service_app()
+        gpu_service._start_job(app, "j1", "embed", 1, "m", 1.0)
+        assert gpu_service._model_busy(app, "embed", "m")
+        assert not gpu_service._model_busy(app, "bertscore", "m")
+
+
+class TestServiceCpuReplicas:
+    class _Embedder:
+        def encode(self, texts, convert_to_numpy=True):
+            return np.array([[float(len(t)), 0.0] for t in texts], dtype=np.float32)
+
+    class _Scorer:
+        def score(self, cands, refs):
+            values = torch.tensor([float(len(c)) for c in cands])
+            return values, values, values
+
+    @pytest.mark.asyncio
+    async def test_embed_and_bertscore_run_on_replicas(self, monkeypatch):
+        from cpu_replicas import CpuReplicaPool
+
+        monkeypatch.setenv("GPU_EMBED_BATCH", "1")
+        monkeypatch.setenv("GPU_BERTSCORE_BATCH", "1")
+        gpu_service, app = _make_service_app()
+        app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL] = self._Embedder()
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = self._Scorer()
+        pool = app.state.cpu_pool = CpuReplicaPool(2, threads=1, pin=False, nodes=[[0]])
+        transport = ASGITransport(app=app)
+        try:
+            async with AsyncClient(transport=transport, base_url="http://test") as c:
+                embed = await c.post("/embed", json={"texts": ["a", "bb", "ccc", "a"]})
+                score = await c.post("/bertscore", json={"candidates": ["x", "yy", "zzz"], "references": ["r"] * 3})
+                info = (await c.get("/info")).json()
+        finally:
+            pool.close()
+        assert embed.json()["embeddings"] == [[1.0, 0.0], [2.0, 0.0], [3.0, 0.0], [1.0, 0.0]]
+        assert score.json()["f1"] == [1.0, 2.0, 3.0]
+        assert [r["name"] for r in info["cpu_replicas"]] == ["replica-0", "replica-1"]
+        assert sum(r["completed"] for r in info["cpu_replicas"]) == 6
+
+
+class TestServiceRerank:
+    _VECTORS = {"q": [1.0, 0.0], "near": [0.9, 0.1], "close": [0.7, 0.3], "far": [0.0, 1.0], "away": [-1.0, 0.0]}
+    _F1 = {"near": 0.6, "close": 0.8, "far": 0.99, "away": 0.99}
+
+    class _Embedder:
+        def __init__(self):
+            self.seen: list[str] = []
+
+        def encode(self, texts, convert_to_numpy=True):
+            self.seen.extend(texts)
+            return np.array([TestServiceRerank._VECTORS[t] for t in texts], dtype=np.float32)
+
+    class _Scorer:
+        def __init__(self):
+            self.pairs: list[tuple[str, str]] = []
+
+        def score(self, cands, refs):
+            self.pairs.extend(zip(cands, refs))
+            f1 = torch.tensor([TestServiceRerank._F1[c] for c in cands])
+            return f1 + 0.01, f1 - 0.01, f1
+
+    def _app(self):
+        gpu_service, app = _make_service_app()
+        embedder, scorer = self._Embedder(), self._Scorer()
+        app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL] = embedder
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = scorer
+        return app, embedder, scorer
+
+    @pytest.mark.asyncio
+    async def test_prefilters_by_embedding_then_ranks_by_bertscore(self):
+        app, embedder, scorer = self._app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post(
+                "/rerank", json={"query": "q", "candidates": ["far", "near", "away", "close"], "top_k": 2}
+            )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert embedder.seen == ["q", "far", "near", "away", "close"]
+        # Only the embedding shortlist reaches BERTScore, scored against the query.
+        assert sorted(scorer.pairs) == [("close", "q"), ("near", "q")]
+        assert [r["index"] for r in data["results"]] == [3, 1]
+        assert data["results"][0]["score"] == pytest.approx(0.8)
+        assert data["results"][0]["precision"] == pytest.approx(0.81)
+        assert data["results"][1]["embed_score"] == pytest.approx(0.9 / np.hypot(0.9, 0.1))
+        assert (data["candidates"], data["shortlisted"]) == (4, 2)
+        assert set(data["timings_ms"]) == {"embed", "prefilter", "bertscore", "total"}
+        assert not app.state.active_jobs
+
+    @pytest.mark.asyncio
+    async def test_top_k_larger_than_pool_and_empty_pool(self):
+        app, _, scorer = self._app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            small = await c.post("/rerank", json={"query": "q", "candidates": ["near", "far"], "top_k": 10})
+            empty = await c.post("/rerank", json={"query": "q", "candidates": []})
+        assert [r["index"] for r in small.json()["results"]] == [1, 0]
+        assert empty.json()["results"] == []
+        assert empty.json()["shortlisted"] == 0
+        assert len(scorer.pairs) == 2
+
+    @pytest.mark.asyncio
+    async def test_counts_both_stages_in_dedup_metrics(self):
+        app, _, _ = self._app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.post("/rerank", json={"query": "q", "candidates": ["near", "far", "near"], "top_k": 2})
+            metrics = (await c.get("/metrics")).json()
+        # 4 texts embedded (3 unique) and a shortlist of 2 (1 unique) scored.
+        assert metrics["counters"]["dedup_items_submitted"] == 6
+        assert metrics["counters"]["dedup_items_computed"] == 4
+        assert 0 < metrics["dedup_ratio"] <= 1
+
+    @pytest.mark.asyncio
+    async def test_validates_candidate_count_and_top_k(self):
+        from models import MAX_BATCH_SIZE, MAX_RERANK_CANDIDATES
+
+        app, _, _ = self._app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            many = await c.post("/rerank", json={"query": "q", "candidates": ["near"] * (MAX_RERANK_CANDIDATES + 1)})
+            wide = await c.post("/rerank", json={"query": "q", "candidates": ["near"], "top_k": MAX_BATCH_SIZE + 1})
+        assert many.status_code == 422
+        assert wide.status_code == 422
+
+
+class TestServiceIdf:
+    class _Scorer:
+        def __init__(self):
+            from tests.test_idf import _Tokenizer
+
+            self._tokenizer = _Tokenizer()
+            self.plain_calls = 0
+
+        def score(self, cands, refs):
+            self.plain_calls += 1
+            ones = torch.ones(len(cands))
+            return ones, ones, ones
+
+    def _app(self, tmp_path, monkeypatch):
+        from idf import CorpusRegistry
+
+        gpu_service, app = _make_service_app()
+        scorer = self._Scorer()
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = scorer
+        app.state.corpora = CorpusRegistry(tmp_path)
+        weighted = []
+
+        def fake_score_with_idf(s, cands, refs, idf):
+            weighted.append(idf)
+            halves = torch.full((len(cands),), 0.5)
+            return halves, halves, halves
+
+        monkeypatch.setattr(gpu_service, "score_with_idf", fake_score_with_idf)
+        return app, scorer, weighted
+
+    @pytest.mark.asyncio
+    async def test_register_then_score_by_corpus_id(self, tmp_path, monkeypatch):
+        app, scorer, weighted = self._app(tmp_path, monkeypatch)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            reg = await c.post("/corpora", json={"texts": ["the cat sat", "the dog ran"]})
+            again = await c.post("/corpora", json={"texts": ["the cat sat", "the dog ran"]})
+            cid = reg.json()["id"]
+            listed = await c.get("/corpora")
+            scored = await c.post(
+                "/bertscore", json={"candidates": ["a", "b"], "references": ["c", "d"], "idf_corpus": cid}
+            )
+            scored_again = await c.post(
+                "/bertscore", json={"candidates": ["e"], "references": ["f"], "idf_corpus": cid}
+            )
+            plain = await c.post("/bertscore", json={"candidates": ["a"], "references": ["c"]})
+        assert reg.status_code == 200
+        assert reg.json()["created"] is True and again.json()["created"] is False
+        assert reg.json()["documents"] == 2
+        assert reg.json()["models"] == ["microsoft/deberta-xlarge-mnli"]
+        assert [info["id"] for info in listed.json()["corpora"]] == [cid]
+        assert scored.json()["f1"] == [0.5, 0.5]
+        assert scored_again.json()["f1"] == [0.5]
+        assert plain.json()["f1"] == [1.0]
+        # The corpus was tokenized once, at registration; scoring reused the cached table.
+        assert scorer._tokenizer.calls == 2
+        assert len(weighted) == 2
+        assert weighted[0][scorer._tokenizer.vocab["the"]] == pytest.approx(np.log(3 / 3))
+
+    @pytest.mark.asyncio
+    async def test_unknown_corpus_is_404_and_delete_removes_it(self, tmp_path, monkeypatch):
+        app, _, _ = self._app(tmp_path, monkeypatch)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            missing = await c.post(
+                "/bertscore", json={"candidates": ["a"], "references": ["b"], "idf_corpus": "0" * 32}
+            )
+            cid = (await c.post("/corpora", json={"texts": ["x y"]})).json()["id"]
+            deleted = await c.delete(f"/corpora/{cid}")
+            gone = await c.get(f"/corpora/{cid}")
+        assert missing.status_code == 404
+        assert deleted.status_code == 200
+        assert gone.status_code == 404
+        assert not app.state.active_jobs
+
+
+class TestServiceTokenCache:
+    @pytest.mark.asyncio
+    async def test_repeated_sentences_skip_the_forward_pass(self):
+        from tests.test_token_cache import tiny_scorer
+        from token_cache import TokenEmbeddingCache
+
+        gpu_service, app = _make_service_app()
+        scorer = tiny_scorer()
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = scorer
+        app.state.token_cache = TokenEmbeddingCache(2**20)
+        body = {"candidates": ["a cat sat", "the dog ran"], "references": ["the cat sat", "a dog"]}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            first = await c.post("/bertscore", json=body)
+            calls = scorer._model.encode_calls
+            second = await c.post(
+                "/bertscore", json={"candidates": body["candidates"][::-1], "references": body["references"][::-1]}
+            )
+            info = (await c.get("/info")).json()
+        assert first.status_code == second.status_code == 200
+        assert scorer._model.encode_calls == calls
+        assert second.json()["f1"][::-1] == pytest.approx(first.json()["f1"], abs=1e-3)
+        assert info["token_cache"]["entries"] == 4
+        assert info["token_cache"]["hits"] == 4
+
+
+class TestServiceLayers:
+    @pytest.mark.asyncio
+    async def test_num_layers_loads_a_separate_truncated_scorer(self):
+        gpu_service, app = _make_service_app()
+        model = gpu_service.DEFAULT_BERTSCORE_MODEL
+        body = {"candidates": ["a"], "references": ["b"], "num_layers": 3}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json=body)
+        assert resp.status_code == 200
+        assert resp.json()["model"] == f"{model}@3"
+        assert f"{model}@3" in app.state.bertscore_cache
+        app.state.BERTScorer.assert_called_once_with(model_type=model, device="cpu", lang="en", num_layers=3)
+
+
+class TestServiceMultiReference:
+    @pytest.mark.asyncio
+    async def test_scores_against_the_best_reference(self):
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.side_effect = lambda cands, refs: _scores_for(refs, cands)
+        body = {"candidates": ["a", "b"], "references": [["r-1", "r-5", "r-3"], ["r-2"]]}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json=body)
+            bad = await c.post("/bertscore", json={"candidates": ["a"], "references": [[]]})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["f1"] == [5.0, 2.0]
+        assert data["precision"] == pytest.approx([0.5, 0.2])
+        assert data["best_reference"] == [1, 0]
+        assert bad.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_shared_references_are_encoded_once(self):
+        from tests.test_token_cache import tiny_scorer
+        from token_cache import TokenEmbeddingCache
+
+        gpu_service, app = _make_service_app()
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = tiny_scorer()
+        app.state.token_cache = TokenEmbeddingCache(2**20, torch.float32)
+        refs = ["the cat sat on the mat", "a dog ran", "the mat"]
+        cands = ["a cat sat", "the dog ran far away"]
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            multi = (await c.post("/bertscore", json={"candidates": cands, "references": [refs, refs]})).json()
+            pairs = (await c.post("/bertscore", json={
+                "candidates": [c for c in cands for _ in refs], "references": refs * len(cands)
+            })).json()
+        assert app.state.token_cache.status()["entries"] == len(refs) + len(cands)
+        f1 = np.array(pairs["f1"]).reshape(len(cands), len(refs))
+        assert multi["best_reference"] == f1.argmax(axis=1).tolist()
+        assert multi["f1"] == pytest.approx(f1.max(axis=1).tolist(), abs=1e-6)
+        assert "best_reference" not in pairs
+
+
+    @pytest.mark.asyncio
+    async def test_without_the_shared_cache_each_sentence_is_encoded_once_per_job(self, monkeypatch):
+        from tests.test_token_cache import tiny_scorer
+        from token_cache import TokenEmbeddingCache
+
+        monkeypatch.setenv("GPU_BERTSCORE_BATCH", "1")
+        encoded = []
+        real_encode = TokenEmbeddingCache._encode
+
+        def counting_encode(self, scorer, sentences):
+            encoded.extend(sentences)
+            return real_encode(self, scorer, sentences)
+
+        monkeypatch.setattr(TokenEmbeddingCache, "_encode", counting_encode)
+        gpu_service, app = _make_service_app()
+        app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL] = tiny_scorer()
+        app.state.token_cache = None
+        refs = ["the cat sat on the mat", "a dog ran", "the mat"]
+        cands = ["a cat sat", "the dog ran far away"]
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json={"candidates": cands, "references": [refs, refs]})
+        assert resp.status_code == 200
+        assert sorted(encoded) == sorted(refs + cands)
+
+    @pytest.mark.asyncio
+    async def test_long_texts_with_several_references_are_admitted(self):
+        from models import MAX_BATCH_SIZE
+
+        gpu_service, app = _make_service_app()
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.side_effect = lambda cands, refs: _scores_for(refs, cands)
+        # Even at the highest factor calibration can reach, a maximum-size request must fit.
+        cost_model = app.state.cost_model
+        cost_model.overrides[gpu_service.DEFAULT_BERTSCORE_MODEL] = cost_model.max_factor
+        long_text = "word " * 400  # about 500 estimated tokens
+        cands = [f"{long_text} candidate {i}" for i in range(MAX_BATCH_SIZE)]
+        refs = [[f"{long_text} reference {i}.{k}-{k}" for k in range(3)] for i in range(MAX_BATCH_SIZE)]
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/bertscore", json={"candidates": cands, "references": refs})
+        assert resp.status_code == 200
+        assert resp.json()["best_reference"] == [2] * MAX_BATCH_SIZE
+        assert app.state.metrics.get("rejected_oversized") == 0
+        assert all(lane.budget.jobs == 0 and lane.budget.in_use == 0 for lane in app.state.lanes.lanes())
+
+
+class TestServiceSharedResults:
+    @pytest.mark.asyncio
+    async def test_embed_to_shared_memory_and_release(self, tmp_path):
+        from shared_results import SharedResultStore
+
+        gpu_service, app = _make_service_app()
+        app.state.shared_results = SharedResultStore(tmp_path, ttl=60, budget_bytes=2**20)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["hello"], "output": "shm"})
+            lease = resp.json()
+            vectors = np.load(lease["path"])
+            info = (await c.get("/info")).json()
+            released = await c.delete(f"/shm/{lease['handle']}")
+            again = await c.delete(f"/shm/{lease['handle']}")
+        assert resp.status_code == 200
+        assert "embeddings" not in lease
+        assert (lease["shape"], lease["dtype"], lease["dimensions"]) == ([1, 3], "float32", 3)
+        np.testing.assert_allclose(vectors, [[0.1, 0.2, 0.3]], rtol=1e-6)
+        assert info["shared_results"]["segments"] == 1
+        assert released.status_code == 204 and again.status_code == 404
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_remote_clients_are_refused(self, tmp_path):
+        from shared_results import SharedResultStore
+
+        _, app = _make_service_app()
+        app.state.shared_results = SharedResultStore(tmp_path)
+        transport = ASGITransport(app=app, client=("10.0.0.5", 40000))
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post("/embed", json={"texts": ["hello"], "output": "shm"})
+        assert resp.status_code == 403
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestServiceLoad:
+    @pytest.mark.asyncio
+    async def test_load_is_etag_cached_and_tracks_service_time(self):
+        _, app = _make_service_app()
+        app.state.load.interval = 60  # no rebuilds between requests unless asked
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            first = await c.get("/load")
+            etag = first.headers["etag"]
+            again = await c.get("/load", headers={"If-None-Match": etag})
+            await c.post("/embed", json={"texts": ["hello"]})
+            app.state.load.refresh(app.state.lanes)
+            after = await c.get("/load", headers={"If-None-Match": etag})
+        assert first.status_code == 200
+        assert first.json()["queued"] == 0 and first.json()["service_ms"] == {}
+        assert again.status_code == 304 and again.headers["etag"] == etag
+        assert after.status_code == 200
+        assert set(after.json()["service_ms"]) == {"embed"}
+
+
+class TestServiceReadiness:
+    @pytest.mark.asyncio
+    async def test_ready_only_after_default_models_warm(self):
+        gpu_service, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            before = await c.get("/ready")
+            for kind, model in app.state.readiness.required:
+                gpu_service._load_and_warm(app, kind, model)
+            after = await c.get("/ready")
+        assert before.status_code == 503 and before.json()["ready"] is False
+        assert after.status_code == 200
+        assert {m["state"] for m in after.json()["models"]} == {"ready"}
+
+    def test_on_demand_load_is_warmed_before_ready(self):
+        gpu_service, app = _make_service_app()
+        encoded = []
+
+        class Embedder(torch.nn.Linear):
+            def encode(self, texts, batch_size=32, **kwargs):
+                encoded.append((len(texts), app.state.readiness.status()[0]["state"]))
+                return np.zeros((len(texts), 4), dtype=np.float32)
+
+        app.state.SentenceTransformer = MagicMock(return_value=Embedder(4, 4))
+        app.state.warmup_grid = [(2, 8)]
+        gpu_service._load_and_warm(app, "embed", "org/new-model")
+        assert encoded == [(2, "warming"), (2, "warming")]
+        (entry,) = app.state.readiness.status()
+        assert entry["state"] == "ready"
+        assert entry["warmup"]["shapes"][0]["batch_size"] == 2
+
+        app.state.SentenceTransformer = MagicMock(side_effect=OSError("no such model"))
+        with pytest.raises(OSError):
+            gpu_service._load_and_warm(app, "embed", "org/missing")
+        assert [m["model"] for m in app.state.readiness.status()] == ["org/new-model"]
+
+
+class TestServiceProfile:
+    @pytest.mark.asyncio
+    async def test_profile_returns_zip_one_at_a_time(self):
+        import asyncio
+        import io
+        import zipfile
+
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            first = asyncio.ensure_future(c.get("/debug/profile", params={"seconds": 0.3}))
+            await asyncio.sleep(0.1)
+            busy = await c.get("/debug/profile", params={"seconds": 0.1})
+            resp = await first
+            bad = await c.get("/debug/profile", params={"seconds": 0})
+        assert busy.status_code == 409
+        assert bad.status_code == 422
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/zip"
+        assert "content-encoding" not in resp.headers  # already deflated, not compressed again
+        assert resp.headers["content-disposition"].startswith("attachment; filename=\"gpu-profile-")
+        assert "torch_trace.json" in zipfile.ZipFile(io.BytesIO(resp.content)).namelist()
+
+    @pytest.mark.asyncio
+    async def test_remote_profile_needs_api_key(self):
+        gpu_service, app = _make_service_app()
+        transport = ASGITransport(app=app, client=("10.0.0.7", 5000))
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.get("/debug/profile", params={"seconds": 0.1})
+        assert resp.status_code == 403
+        assert app.state.profiler.captures == 0
+
+
+class TestServiceCapture:
+    @pytest.mark.asyncio
+    async def test_captured_traffic_replays_against_service(self, tmp_path, monkeypatch):
+        from capture import TrafficCapture, read_trace
+        from replay import build_requests, replay
+
+        gpu_service, app = _make_service_app()
+        monkeypatch.setattr(gpu_service, "API_KEY", "secret")
+        app.state.capture = TrafficCapture(tmp_path / "trace.jsonl.gz", texts="hash", salt="s")
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        headers = {"X-API-Key": "secret"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test", headers=headers) as c:
+            await c.post("/embed", json={"texts": ["hello world"]}, headers={"X-Deadline-Ms": "5000"})
+            await c.post("/bertscore", json={"candidates": ["a"], "references": ["b"]})
+            await c.post("/embed", json={"texts": ["x"]}, headers={"X-API-Key": "wrong"})
+            await c.get("/health")
+            app.state.capture.close()
+            records = read_trace(tmp_path / "trace.jsonl.gz")
+            app.state.capture = None
+            requests = build_requests(records, speed=10)
+            results = await replay(requests, c)
+        assert [r["path"] for r in records] == ["/embed", "/bertscore"]
+        assert records[0]["body"]["texts"][0] == {"sha": records[0]["body"]["texts"][0]["sha"], "len": 11}
+        assert records[0]["deadline_ms"] == "5000"
+        assert [r.status for r in results] == [200, 200]
+        replayed = embedder.encode.call_args_list[-1].args[0]
+        assert [len(text) for text in replayed] == [11]
+
+
+class TestServiceIdempotency:
+    @pytest.mark.asyncio
+    async def test_repeat_key_returns_memoized_result(self):
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        headers = {"Idempotency-Key": "req-1"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            first = await c.post("/embed", json={"texts": ["hello"]}, headers=headers)
+            second = await c.post("/embed", json={"texts": ["hello"]}, headers=headers)
+            other = await c.post("/embed", json={"texts": ["bye"]}, headers=headers)
+            bertscore = await c.post("/bertscore", json={"candidates": ["a"], "references": ["b"]}, headers=headers)
+        assert first.status_code == second.status_code == bertscore.status_code == 200
+        assert second.json() == first.json()
+        assert embedder.encode.call_count == 1
+        assert other.status_code == 422
+        metrics = app.state.metrics
+        assert metrics.get("idempotent_replays") == 1
+        assert metrics.get("idempotent_seconds_saved") >= 0
+
+    @pytest.mark.asyncio
+    async def test_retry_after_a_timeout_gets_the_finished_result(self):
+        import asyncio
+        import threading
+
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        gate = threading.Event()
+
+        def slow_encode(texts, **_):
+            gate.wait(5)
+            return np.array([[1.0, 2.0]] * len(texts))
+
+        embedder.encode.side_effect = slow_encode
+        headers = {"Idempotency-Key": "req-2", "X-Deadline-Ms": "50"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            timed_out = await c.post("/embed", json={"texts": ["hello"]}, headers=headers)
+            gate.set()
+            for _ in range(100):  # the abandoned computation finishes and is stored
+                if len(app.state.idempotency):
+                    break
+                await asyncio.sleep(0.02)
+            retry = await c.post("/embed", json={"texts": ["hello"]}, headers={"Idempotency-Key": "req-2"})
+        assert timed_out.status_code == 504
+        assert retry.status_code == 200 and retry.json()["embeddings"] == [[1.0, 2.0]]
+        assert embedder.encode.call_count == 1
+        assert app.state.metrics.get("idempotent_replays") == 1
+
+
+class TestServiceMemory:
+    @pytest.mark.asyncio
+    async def test_finished_jobs_land_in_memory_history(self):
+        _, app = _make_service_app()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.post("/embed", json={"texts": ["a"]})
+            await c.post("/embed", json={"texts": ["a much longer text " * 20]})
+            resp = await c.get("/memory")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["device"] == "cpu"
+        assert [r["type"] for r in data["recent"]] == ["embed", "embed"]
+        assert all(r["peak_mb"] >= 0 for r in data["recent"])
+        [stats] = data["models"]
+        assert stats["samples"] == 2
+        assert stats["max_tokens"] == data["recent"][1]["tokens"]
+
+    @pytest.mark.asyncio
+    async def test_job_finished_event_carries_peak_memory(self):
+        _, app = _make_service_app()
+        queue = app.state.events.subscribe()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.post("/embed", json={"texts": ["a"]})
+        events = []
+        while not queue.empty():
+            events.append(queue.get_nowait())
+        name, data = events[-1]
+        assert name == "job_finished"
+        assert data["job"]["peak_memory_mb"] >= 0
+
+
+class TestServiceSnapshots:
+    def test_on_demand_load_freezes_then_loads_from_snapshot(self, tmp_path):
+        from snapshots import SnapshotStore
+
+        gpu_service, app = _make_service_app()
+        app.state.snapshots = SnapshotStore(tmp_path)
+        embedder = _create_mock_embedder()
+        embedder.save.side_effect = lambda path, safe_serialization=True: (tmp_path / "saved").touch()
+        app.state.SentenceTransformer = MagicMock(return_value=embedder)
+
+        gpu_service._load_embedder(app, "org/new-model")
+        app.state.SentenceTransformer.assert_called_once_with("org/new-model", device="cpu")
+        assert app.state.snapshots.manifest("embed", "org/new-model") is not None
+
+        app.state.SentenceTransformer.reset_mock()
+        gpu_service._load_embedder(app, "org/new-model")
+        app.state.SentenceTransformer.assert_called_once_with(str(tmp_path / "embed" / "org--new-model"), device="cpu")
+
+    def test_freeze_failure_does_not_fail_the_load(self, tmp_path):
+        from snapshots import SnapshotStore
+
+        gpu_service, app = _make_service_app()
+        app.state.snapshots = SnapshotStore(tmp_path)
+        embedder = _create_mock_embedder()
+        embedder.save.side_effect = OSError("read-only")
+        app.state.SentenceTransformer = MagicMock(return_value=embedder)
+        assert gpu_service._load_embedder(app, "m") is embedder
+        assert app.state.snapshots.manifest("embed", "m") is None
+
+
+class TestServiceCompression:
+    @pytest.mark.asyncio
+    async def test_gzip_request_and_response(self):
+        import gzip
+        import json
+
+        _, app = _make_service_app()
+        body = gzip.compress(json.dumps({"texts": ["compressed " * 200]}).encode())
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            resp = await c.post(
+                "/embed",
+                content=body,
+                headers={"Content-Encoding": "gzip", "Content-Type": "application/json", "Accept-Encoding": "gzip"},
+            )
+            health = await c.get("/health", headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.json()["embeddings"] == [[0.1, 0.2, 0.3]]
+        assert "content-encoding" not in health.headers
+        assert "gzip" in health.json()["request_encodings"]
+
+
+class TestServiceWebSocket:
+    @staticmethod
+    def _app(api_key=None):
+        from starlette.testclient import TestClient
+
+        gpu_service, app = _make_service_app()
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        embedder.encode.side_effect = lambda texts, **_: np.array([[float(len(t)), 0.0] for t in texts])
+        scorer = app.state.bertscore_cache[gpu_service.DEFAULT_BERTSCORE_MODEL]
+        scorer.score.side_effect = _scores_for
+        gpu_service.API_KEY = api_key
+        return gpu_service, app, TestClient(app)
+
+    def test_tagged_messages_are_batched_and_answered(self):
+        gpu_service, app, client = self._app()
+        try:
+            with client.websocket_connect("/ws/embed") as ws:
+                for i in range(3):
+                    ws.send_json({"type": "embed", "tag": f"e{i}", "texts": ["x" * (i + 1)]})
+                ws.send_json({"type": "bertscore", "tag": "b", "candidates": ["c-2"], "references": ["r"]})
+                ws.send_json({"type": "bertscore", "tag": "m", "candidates": ["c-4"], "references": [["r1", "r2"]]})
+                replies = {r["tag"]: r for r in (ws.receive_json() for _ in range(5))}
+        finally:
+            gpu_service.API_KEY = None
+        assert [replies[f"e{i}"]["embeddings"] for i in range(3)] == [[[1.0, 0.0]], [[2.0, 0.0]], [[3.0, 0.0]]]
+        assert replies["e0"]["dimensions"] == 2
+        assert replies["b"]["f1"] == [2.0]
+        assert (replies["m"]["f1"], replies["m"]["best_reference"]) == ([4.0], [0])
+        assert "best_reference" not in replies["b"]
+        embedder = app.state.embed_cache[gpu_service.DEFAULT_EMBED_MODEL]
+        assert embedder.encode.call_count == 1
+        assert app.state.metrics.get("ws_messages") == 5
+        assert all(lane.budget.in_use == 0 for lane in app.state.lanes.lanes())
+
+    def test_invalid_messages_get_tagged_errors(self):
+        gpu_service, _, client = self._app()
+        with client.websocket_connect("/ws/embed") as ws:
+            ws.send_text("not json")
+            assert ws.receive_json()["status"] == 400
+            ws.send_json({"type": "embed", "tag": "t1"})
+            reply = ws.receive_json()
+            assert (reply["tag"], reply["status"]) == ("t1", 422)
+            ws.send_json({"type": "bertscore", "tag": "t2", "candidates": ["a"], "references": []})
+            assert ws.receive_json() == {
+                "tag": "t2", "status": 400, "error": "candidates and references must have equal length"
+            }
+
+    def test_auth_once_via_header_or_first_message(self):
+        from starlette.websockets import WebSocketDisconnect
+
+        gpu_service, _, client = self._app(api_key="secret")
+        try:
+            for first in (
+                {"type": "embed", "tag": "x", "texts": ["a"]},
+                {"type": "auth", "api_key": "wrong"},
+            ):
+                with pytest.raises(WebSocketDisconnect) as exc:
+                    with client.websocket_connect("/ws/embed") as ws:
+                        ws.send_json(first)
+                        ws.receive_json()
+                assert exc.value.code == gpu_service.WS_POLICY_VIOLATION
+            # A key in the URL would leak into access logs, so it is not accepted.
+            with pytest.raises(WebSocketDisconnect):
+                with client.websocket_connect("/ws/embed?api_key=secret") as ws:
+                    ws.send_json({"type": "embed", "tag": "x", "texts": ["a"]})
+                    ws.receive_json()
+            with client.websocket_connect("/ws/embed") as ws:
+                ws.send_json({"type": "auth", "api_key": "secret"})
+                ws.send_json({"type": "embed", "tag": "m", "texts": ["a"]})
+                assert ws.receive_json()["tag"] == "m"
+            with client.websocket_connect("/ws/embed", headers={"X-API-Key": "secret"}) as ws:
+                ws.send_json({"type": "embed", "tag": "h", "texts": ["a"]})
+                assert ws.receive_json()["tag"] == "h"
+        finally:
+            gpu_service.API_KEY = None
@@ -0,0 +1,112 @@
+"""Tests for the IDF corpus registry."""
+
+import math
+
+import pytest
+
+from idf import CorpusRegistry, IdfTable, UnknownCorpus, corpus_id
+
+
+class _Tokenizer:
+    """Whitespace tokenizer with stable ids; 0 = [PAD], 1 = [CLS], 2 = [SEP]."""
+
+    pad_token_id = 0
+    cls_token_id = 1
+    sep_token_id = 2
+    model_max_length = 512
+
+    def __init__(self):
+        self.vocab: dict[str, int] = {}
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=True, max_length=None, truncation=False):
+        self.calls += 1
+        ids = [self.vocab.setdefault(word, len(self.vocab) + 10) for word in text.split()]
+        return [self.cls_token_id, *ids, self.sep_token_id]
+
+    def build_inputs_with_special_tokens(self, ids):
+        return [self.cls_token_id, *ids, self.sep_token_id]
+
+
+CORPUS = ["the cat sat", "the dog ran", "a cat ran"]
+
+
+class TestIdfTable:
+    def test_matches_document_frequencies(self):
+        tok = _Tokenizer()
+        table = IdfTable.compute(CORPUS, tok)
+        idf = table.idf_dict(tok)
+        assert idf[tok.vocab["the"]] == pytest.approx(math.log(4 / 3))
+        assert idf[tok.vocab["sat"]] == pytest.approx(math.log(4 / 2))
+        assert idf[999] == pytest.approx(math.log(4))  # unseen token
+        assert idf[tok.cls_token_id] == 0 and idf[tok.sep_token_id] == 0
+
+    def test_json_round_trip(self):
+        table = IdfTable.compute(CORPUS, _Tokenizer())
+        again = IdfTable.from_json(table.to_json())
+        assert again.documents == 3
+        assert again.weights == table.weights
+
+
+class TestCorpusRegistry:
+    def test_register_is_content_addressed(self, tmp_path):
+        registry = CorpusRegistry(tmp_path)
+        cid, created = registry.register(CORPUS)
+        assert created and cid == corpus_id(CORPUS)
+        assert registry.register(list(CORPUS)) == (cid, False)
+        assert registry.ids() == [cid]
+        assert registry.texts(cid) == CORPUS
+
+    def test_info_counts_documents_without_reading_the_texts(self, tmp_path, monkeypatch):
+        from idf import META_FILE
+
+        cid, _ = CorpusRegistry(tmp_path).register(CORPUS)
+        legacy = corpus_id(["old"])
+        CorpusRegistry(tmp_path).register(["old"])
+        (tmp_path / legacy / META_FILE).unlink()  # registered before counts were stored
+
+        restarted = CorpusRegistry(tmp_path)
+        assert restarted.info(legacy)["documents"] == 1
+        assert (tmp_path / legacy / META_FILE).is_file()
+
+        def no_texts(self, cid):
+            raise AssertionError("info() read the corpus texts")
+
+        monkeypatch.setattr(CorpusRegistry, "texts", no_texts)
+        assert CorpusRegistry(tmp_path).info(cid)["documents"] == 3
+        assert CorpusRegistry(tmp_path).info(legacy)["documents"] == 1
+        with pytest.raises(UnknownCorpus):
+            restarted.info("0" * 32)
+
+    @pytest.mark.asyncio
+    async def test_table_is_computed_once_then_cached_in_memory_and_on_disk(self, tmp_path):
+        tok = _Tokenizer()
+        registry = CorpusRegistry(tmp_path)
+        cid, _ = registry.register(CORPUS)
+        first = await registry.table(cid, "m/1", tok)
+        calls = tok.calls
+        assert await registry.table(cid, "m/1", tok) is first
+        assert tok.calls == calls
+        assert registry.info(cid) == {"id": cid, "documents": 3, "models": ["m/1"]}
+
+        restarted = CorpusRegistry(tmp_path)
+        again = await restarted.table(cid, "m/1", tok)
+        assert tok.calls == calls
+        assert again.weights == first.weights
+
+    @pytest.mark.asyncio
+    async def test_unknown_and_deleted_corpora(self, tmp_path):
+        registry = CorpusRegistry(tmp_path)
+        with pytest.raises(UnknownCorpus):
+            await registry.table("0" * 32, "m", _Tokenizer())
+        with pytest.raises(UnknownCorpus):
+            registry.texts("../etc")
+        assert not registry.exists("../etc")
+
+        cid, _ = registry.register(CORPUS)
+        await registry.table(cid, "m", _Tokenizer())
+        registry.delete(cid)
+        assert not registry.exists(cid)
+        assert registry.models(cid) == []
+        with pytest.raises(UnknownCorpus):
+            registry.delete(cid)
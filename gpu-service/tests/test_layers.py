@@ -0,0 +1,70 @@
+"""Tests for layer-truncated BERTScore models."""
+
+from types import SimpleNamespace
+
+import torch
+from transformers import BertConfig, BertModel
+
+from layers import bertscore_key, default_layers, layer_report, parse_bertscore_key, strip_unused
+
+
+def _bert(layers: int = 4) -> BertModel:
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=50, hidden_size=16, num_hidden_layers=layers, num_attention_heads=2, intermediate_size=32
+    )
+    return BertModel(config).eval()
+
+
+def _truncated(full: BertModel, keep: int) -> BertModel:
+    """What bert_score's get_model does: keep the first `keep` encoder layers."""
+    model = _bert(full.config.num_hidden_layers)
+    model.load_state_dict(full.state_dict())
+    model.encoder.layer = torch.nn.ModuleList(model.encoder.layer[:keep])
+    return model.eval()
+
+
+class TestKeys:
+    def test_default_layer_keeps_plain_name(self):
+        model = "microsoft/deberta-xlarge-mnli"
+        assert default_layers(model) == 40
+        assert bertscore_key(model) == model
+        assert bertscore_key(model, 40) == model
+        assert bertscore_key(model, 24) == f"{model}@24"
+
+    def test_parse_round_trip(self):
+        assert parse_bertscore_key("org/model@12") == ("org/model", 12)
+        assert parse_bertscore_key("org/model") == ("org/model", None)
+        assert parse_bertscore_key("org/model@v2") == ("org/model@v2", None)
+
+
+class TestTruncation:
+    def test_truncated_output_equals_full_model_hidden_state(self):
+        full = _bert(4)
+        truncated = _truncated(full, 2)
+        strip_unused(SimpleNamespace(_model=truncated))
+        ids = torch.tensor([[2, 11, 12, 13, 3]])
+        mask = torch.ones_like(ids)
+        with torch.no_grad():
+            expected = full(ids, attention_mask=mask, output_hidden_states=True).hidden_states[2]
+            got = truncated(ids, attention_mask=mask)[0]
+        assert torch.allclose(got, expected, atol=1e-6)
+
+    def test_strip_unused_drops_pooler_once(self):
+        scorer = SimpleNamespace(_model=_bert(2))
+        freed = strip_unused(scorer)
+        assert freed == (16 * 16 + 16) * 4
+        assert scorer._model.pooler is None
+        assert strip_unused(scorer) == 0
+        assert strip_unused(SimpleNamespace()) == 0
+
+    def test_layer_report_estimates_dropped_layers(self):
+        full = _bert(4)
+        per_layer = sum(p.numel() * p.element_size() for p in full.encoder.layer[0].parameters())
+        scorer = SimpleNamespace(_model=_truncated(full, 1))
+        stripped = strip_unused(scorer)
+        report = layer_report(scorer, "tiny@1", stripped)
+        assert report["model"] == "tiny@1"
+        assert (report["num_layers"], report["total_layers"]) == (1, 4)
+        assert report["saved_mb"] == round((3 * per_layer + stripped) / 2**20, 1)
+        assert layer_report(SimpleNamespace(), "none") is None
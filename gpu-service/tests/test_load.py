@@ -0,0 +1,71 @@
+"""Tests for the cached load snapshot."""
+
+import asyncio
+
+import pytest
+import torch
+
+from admission import LaneRouter
+from load import LoadMonitor, memory_headroom
+
+
+def _router() -> LaneRouter:
+    return LaneRouter({"capacity": 100.0, "max_jobs": 4, "timeout": 1.0}, kinds=("embed", "bertscore"))
+
+
+def test_snapshot_reports_lane_cost_and_queue():
+    router = _router()
+    monitor = LoadMonitor(torch.device("cpu"))
+
+    async def fill():
+        lane = router.select("embed", "m")
+        await router.acquire(lane, 60.0, timeout=1.0)
+        waiter = asyncio.ensure_future(router.acquire(lane, 60.0, timeout=5.0))
+        await asyncio.sleep(0)
+        return waiter
+
+    loop = asyncio.new_event_loop()
+    try:
+        waiter = loop.run_until_complete(fill())
+        snap = monitor.snapshot(router)
+        waiter.cancel()
+        loop.run_until_complete(asyncio.gather(waiter, return_exceptions=True))
+    finally:
+        loop.close()
+    assert (snap["queued"], snap["jobs"]) == (1, 1)
+    assert (snap["in_use_units"], snap["capacity_units"]) == (60.0, 200.0)
+    assert snap["utilization"] == 0.3
+    embed = next(lane for lane in snap["lanes"] if lane["name"] == "embed")
+    assert (embed["queued"], embed["in_use_units"]) == (1, 60.0)
+
+
+def test_service_time_ewma_skips_failed_jobs(monkeypatch):
+    clock = iter([0.0, 1.0, 10.0, 12.0, 20.0, 100.0])
+    monkeypatch.setattr("load.time.monotonic", lambda: next(clock))
+    monitor = LoadMonitor(torch.device("cpu"))
+    monitor.job_started("a")
+    monitor.job_finished("a", "embed", ok=True)  # 1s
+    monitor.job_started("b")
+    monitor.job_finished("b", "embed", ok=True)  # 2s
+    monitor.job_started("c")
+    monitor.job_finished("c", "embed", ok=False)  # ignored
+    assert monitor._service_s == {"embed": pytest.approx(0.8 * 1.0 + 0.2 * 2.0)}
+
+
+def test_etag_changes_only_with_content(monkeypatch):
+    monkeypatch.setattr("load.memory_headroom", lambda device: {"free_mb": 1024, "total_mb": 2048})
+    router = _router()
+    monitor = LoadMonitor(torch.device("cpu"), interval=60)
+    body, etag = monitor.current(router)
+    monitor.refresh(router)
+    assert monitor.current(router) == (body, etag)
+    router.select("embed", "m").budget._take(5.0)
+    monitor.refresh(router)
+    assert monitor.current(router)[1] != etag
+
+
+def test_memory_headroom_on_cpu():
+    memory = memory_headroom(torch.device("cpu"))
+    assert memory["total_mb"] > 0
+    assert 0 <= memory["free_mb"] <= memory["total_mb"]
+    assert memory["free_mb"] % 64 == 0
@@ -0,0 +1,111 @@
+"""Tests for per-job peak memory accounting."""
+
+import tracemalloc
+
+import torch
+
+import memory
+from memory import MemoryHistory, MemoryProbe, rss_bytes
+
+
+class TestRss:
+    def test_rss_bytes_positive(self):
+        rss = rss_bytes()
+        assert rss is None or rss > 0
+
+
+class TestMemoryProbe:
+    def test_cpu_probe_sees_rss_growth(self):
+        probe = MemoryProbe(torch.device("cpu")).start()
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])  # touch every page so it becomes resident
+        peak = probe.stop()
+        del block
+        assert peak >= 32
+
+    def test_peak_never_negative(self):
+        probe = MemoryProbe(torch.device("cpu")).start()
+        assert probe.peak_mb() >= 0
+        assert probe.stop() >= 0
+
+    def test_trace_records_hotspots(self):
+        tracemalloc.start()
+        try:
+            probe = MemoryProbe(torch.device("cpu"), trace=True).start()
+            keep = [bytes(1024) for _ in range(2000)]
+            probe.stop()
+        finally:
+            tracemalloc.stop()
+        assert keep
+        assert probe.hotspots
+        assert all(size > 0 for _, size in probe.hotspots)
+
+    def test_overlapping_cuda_probes_do_not_reset_each_other(self, monkeypatch):
+        mb = 1024 * 1024
+        state = {"allocated": 100 * mb, "peak": 100 * mb, "resets": 0}
+
+        def reset(device):
+            state["resets"] += 1
+            state["peak"] = state["allocated"]
+
+        monkeypatch.setattr(torch.cuda, "reset_peak_memory_stats", reset)
+        monkeypatch.setattr(torch.cuda, "memory_allocated", lambda device: state["allocated"])
+        monkeypatch.setattr(torch.cuda, "max_memory_allocated", lambda device: state["peak"])
+        device = torch.device("cuda")
+
+        first = MemoryProbe(device).start()
+        state["allocated"] = state["peak"] = 600 * mb
+        state["allocated"] = 200 * mb
+        second = MemoryProbe(device).start()  # must not wipe the first job's 600 MB peak
+        assert first.stop() == 500.0
+        assert second.stop() == 400.0
+        assert state["resets"] == 1
+        MemoryProbe(device).start().stop()
+        assert state["resets"] == 2
+
+    def test_trace_ignored_when_not_tracing(self):
+        probe = MemoryProbe(torch.device("cpu"), trace=True).start()
+        probe.stop()
+        assert probe.hotspots == []
+
+
+class TestMemoryHistory:
+    def test_stats_fit_mb_per_token(self):
+        h = MemoryHistory()
+        for tokens in (1000, 2000, 3000):
+            h.record("embed", "m", 10, tokens, 50 + tokens * 0.01)
+        [stats] = h.stats()
+        assert stats["samples"] == 3
+        assert stats["max_tokens"] == 3000
+        assert stats["max_peak_mb"] == 80
+        assert stats["mb_per_1k_tokens"] == 10.0
+        assert stats["intercept_mb"] == 50.0
+
+    def test_single_shape_has_no_fit(self):
+        h = MemoryHistory()
+        h.record("embed", "m", 1, 100, 5.0)
+        h.record("embed", "m", 1, 100, 7.0)
+        [stats] = h.stats()
+        assert stats["mean_peak_mb"] == 6.0
+        assert stats["mb_per_1k_tokens"] is None
+
+    def test_groups_by_type_and_model(self):
+        h = MemoryHistory()
+        h.record("embed", "a", 1, 10, 1.0)
+        h.record("bertscore", "b", 1, 10, 2.0)
+        assert [(s["type"], s["model"]) for s in h.stats()] == [("bertscore", "b"), ("embed", "a")]
+
+    def test_history_is_bounded(self):
+        h = MemoryHistory(size=3)
+        for i in range(5):
+            h.record("embed", "m", 1, i, 1.0)
+        assert [r["tokens"] for r in h.recent()] == [2, 3, 4]
+
+    def test_hotspots_aggregate(self):
+        h = MemoryHistory()
+        h.record("embed", "m", 1, 1, 1.0, [("a.py:1", 100), ("b.py:2", 10)])
+        h.record("embed", "m", 1, 1, 1.0, [("b.py:2", 200)])
+        assert h.top_hotspots() == [{"location": "b.py:2", "bytes": 210}, {"location": "a.py:1", "bytes": 100}]
+
+    def test_default_size_from_env(self):
+        assert MemoryHistory().records.maxlen == memory.HISTORY_SIZE
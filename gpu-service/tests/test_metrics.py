@@ -0,0 +1,20 @@
+"""Tests for the service counters."""
+
+from metrics import Metrics
+
+
+class TestMetrics:
+    def test_counters_accumulate(self):
+        m = Metrics()
+        m.inc("requests")
+        m.inc("requests", 2)
+        assert m.get("requests") == 3
+        assert m.get("missing") == 0
+        assert m.snapshot() == {"requests": 3}
+
+    def test_dedup_ratio(self):
+        m = Metrics()
+        assert m.dedup_ratio() == 0.0
+        m.inc("dedup_items_submitted", 10)
+        m.inc("dedup_items_computed", 4)
+        assert m.dedup_ratio() == 0.6
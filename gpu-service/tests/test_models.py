@@ -146,6 +146,7 @@ class TestHealthResponse:
     def test_default_status(self):
         resp = HealthResponse(device="cpu")
         assert resp.status == "ok"
+        assert resp.request_encodings == []
 
 
 # --- InfoResponse ---
@@ -0,0 +1,44 @@
+"""Tests for multi-reference BERTScore aggregation."""
+
+import numpy as np
+
+from multiref import best_reference, chunk_candidates, flatten_references, is_multi
+
+
+def test_is_multi():
+    assert not is_multi(["a", "b"])
+    assert is_multi([["a"], ["b", "c"]])
+    assert not is_multi([])
+
+
+def test_flatten_is_candidate_major():
+    cands, refs, offsets = flatten_references(["c0", "c1"], [["r0", "r1", "r2"], ["r3"]])
+    assert cands == ["c0", "c0", "c0", "c1"]
+    assert refs == ["r0", "r1", "r2", "r3"]
+    assert offsets.tolist() == [0, 3, 4]
+
+
+def test_best_reference_keeps_the_best_f1_pair():
+    scores = np.array([
+        [0.1, 0.9, 0.5, 0.4],  # P
+        [0.2, 0.1, 0.6, 0.3],  # R
+        [0.3, 0.2, 0.7, 0.35],  # F1
+    ])
+    columns, best = best_reference(scores, np.array([0, 3, 4]))
+    assert best.tolist() == [2, 0]
+    np.testing.assert_array_equal(columns, [[0.5, 0.4], [0.6, 0.3], [0.7, 0.35]])
+
+
+def test_best_reference_empty():
+    columns, best = best_reference(np.empty((3, 0)), np.array([0]))
+    assert columns.shape == (3, 0) and best.shape == (0,)
+
+
+def test_chunks_keep_candidates_with_their_references():
+    cands = ["c0", "c1", "c2", "c3"]
+    refs = [["r0", "r1"], ["r0", "r1"], ["r2", "r3", "r4"], ["r5"]]
+    chunks = chunk_candidates(cands, refs, max_texts=5)
+    assert chunks == [slice(0, 2), slice(2, 3), slice(3, 4)]
+    assert chunk_candidates(cands, refs, max_texts=100) == [slice(0, 4)]
+    assert chunk_candidates(["c"], [["r0", "r1", "r2"]], max_texts=2) == [slice(0, 1)]
+    assert chunk_candidates([], [], max_texts=5) == []
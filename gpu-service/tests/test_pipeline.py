@@ -0,0 +1,116 @@
+"""Tests for the pipelined embedding executor."""
+
+import threading
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+import torch
+
+from pipeline import PipelineStats, embed_stages, run_pipeline
+
+
+class _FakeSentenceTransformer(torch.nn.Module):
+    """Minimal module exposing the SentenceTransformer tokenize/forward contract."""
+
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(1, 2, bias=False)
+        torch.nn.init.ones_(self.proj.weight)
+
+    def tokenize(self, texts):
+        return {"input_ids": torch.tensor([[float(len(t))] for t in texts])}
+
+    def forward(self, features):
+        return {"sentence_embedding": self.proj(features["input_ids"])}
+
+
+class TestRunPipeline:
+    @pytest.mark.asyncio
+    async def test_results_in_input_order(self):
+        stages = [
+            ("a", lambda x: x + 1),
+            ("b", lambda x: (time.sleep(0.01 * (x % 3)), x * 10)[1]),
+            ("c", lambda x: x - 1),
+        ]
+        results = await run_pipeline(list(range(8)), stages)
+        assert results == [(i + 1) * 10 - 1 for i in range(8)]
+
+    @pytest.mark.asyncio
+    async def test_stages_overlap(self):
+        """With three 20ms stages, eight items finish well under the serial 480ms."""
+        active = set()
+        overlapped = threading.Event()
+        lock = threading.Lock()
+
+        def _stage(name):
+            def run(x):
+                with lock:
+                    active.add(name)
+                    if len(active) > 1:
+                        overlapped.set()
+                time.sleep(0.02)
+                with lock:
+                    active.discard(name)
+                return x
+            return run
+
+        stages = [(name, _stage(name)) for name in ("tokenize", "forward", "copy")]
+        stats = PipelineStats([name for name, _ in stages])
+        t0 = time.perf_counter()
+        await run_pipeline(list(range(8)), stages, stats=stats)
+        elapsed = time.perf_counter() - t0
+        assert overlapped.is_set()
+        assert elapsed < 0.40
+        assert all(util > 0.3 for util in stats.utilization().values())
+
+    @pytest.mark.asyncio
+    async def test_on_item_called_per_item(self):
+        seen = []
+        await run_pipeline([1, 2, 3], [("only", lambda x: x)], on_item=seen.append)
+        assert sorted(seen) == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_stage_error_propagates(self):
+        def _boom(x):
+            if x == 2:
+                raise RuntimeError("stage failed")
+            return x
+
+        with pytest.raises(RuntimeError, match="stage failed"):
+            await run_pipeline(list(range(6)), [("first", lambda x: x), ("boom", _boom)])
+
+    @pytest.mark.asyncio
+    async def test_empty_input(self):
+        assert await run_pipeline([], [("only", lambda x: x)]) == []
+
+
+class TestPipelineStats:
+    def test_bottleneck_is_busiest_stage(self):
+        stats = PipelineStats(["tokenize", "forward", "copy"])
+        stats.add("tokenize", 0.1)
+        stats.add("forward", 0.5)
+        stats.add("copy", 0.05)
+        assert stats.bottleneck() == "forward"
+        assert set(stats.utilization()) == {"tokenize", "forward", "copy"}
+
+
+class TestEmbedStages:
+    @pytest.mark.asyncio
+    async def test_sentence_transformer_is_split_into_three_stages(self):
+        model = _FakeSentenceTransformer()
+        stages = embed_stages(model, torch.device("cpu"))
+        assert [name for name, _ in stages] == ["tokenize", "forward", "copy"]
+        results = await run_pipeline([["ab", "abc"], ["a"]], stages)
+        np.testing.assert_allclose(results[0], [[2.0, 2.0], [3.0, 3.0]])
+        np.testing.assert_allclose(results[1], [[1.0, 1.0]])
+        assert results[0].dtype == np.float32
+
+    def test_non_module_embedder_uses_encode(self):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.zeros((1, 3))
+        stages = embed_stages(embedder, torch.device("cpu"))
+        assert [name for name, _ in stages] == ["encode"]
+        stages[0][1](["hello"])
+        embedder.encode.assert_called_once_with(["hello"], convert_to_numpy=True)
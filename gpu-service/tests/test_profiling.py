@@ -0,0 +1,96 @@
+"""Tests for on-demand profiling captures."""
+
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+import zipfile
+
+import pytest
+import torch
+
+from profiling import ProfileCapture, ProfilerBusy, StackSampler, fold_stack
+
+
+def _busy_matmul(stop: threading.Event) -> None:
+    x = torch.randn(64, 64)
+    while not stop.is_set():
+        torch.mm(x, x)
+        time.sleep(0.001)
+
+
+def test_fold_stack_is_root_first():
+    folded = fold_stack("main", sys._getframe())
+    frames = folded.split(";")
+    assert frames[0] == "main"
+    assert frames[-1].startswith("test_fold_stack_is_root_first (test_profiling.py:")
+
+
+def test_sampler_sees_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_matmul, args=(stop,), name="model-worker")
+    worker.start()
+    sampler = StackSampler(hz=200)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    stop.set()
+    worker.join()
+    assert sampler.samples > 0
+    assert any(stack.startswith("model-worker;") and "_busy_matmul" in stack for stack in sampler.counts)
+    assert "profile-sampler" not in sampler.folded()
+
+
+def test_capture_packages_trace_stacks_and_summary():
+    capture = ProfileCapture(torch.device("cpu"), sample_hz=200)
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_matmul, args=(stop,), name="model-worker")
+    worker.start()
+
+    async def run():
+        first = asyncio.ensure_future(capture.capture(0.2))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ProfilerBusy):
+            await capture.capture(0.1)
+        return await first
+
+    try:
+        data = asyncio.run(run())
+    finally:
+        stop.set()
+        worker.join()
+    assert not capture.running and capture.captures == 1
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert set(archive.namelist()) == {"torch_trace.json", "python_stacks.folded", "summary.txt"}
+    events = json.loads(archive.read("torch_trace.json"))["traceEvents"]
+    summary = archive.read("summary.txt").decode()
+    if "torch_all_threads: True" in summary:
+        assert any("mm" in event.get("name", "") for event in events)
+    assert "_busy_matmul" in archive.read("python_stacks.folded").decode()
+
+
+def test_capture_drives_the_profiler_off_the_event_loop(monkeypatch):
+    import profiling
+
+    threads = {}
+    real_torch_profiler = profiling.torch_profiler
+
+    def recording_profiler(device):
+        profiler, all_threads = real_torch_profiler(device)
+        for name in ("start", "stop", "export_chrome_trace"):
+            method = getattr(profiler, name)
+
+            def record(*args, _name=name, _method=method):
+                threads[_name] = threading.get_ident()
+                return _method(*args)
+
+            setattr(profiler, name, record)
+        return profiler, all_threads
+
+    monkeypatch.setattr(profiling, "torch_profiler", recording_profiler)
+    asyncio.run(ProfileCapture(torch.device("cpu"), sample_hz=50).capture(0.05))
+    assert set(threads) == {"start", "stop", "export_chrome_trace"}
+    assert threading.get_ident() not in threads.values()
+    assert threads["start"] == threads["stop"]
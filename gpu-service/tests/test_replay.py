@@ -0,0 +1,70 @@
+"""Tests for trace replay."""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+from replay import ReplayResult, build_requests, filler, replay, restore_texts, summarize
+
+
+def _record(t, path="/embed", status=200, **body):
+    return {"t": t, "path": path, "status": status, "ms": 5.0, "body": body or {"texts": ["a"]}}
+
+
+def test_filler_is_deterministic_and_exact():
+    assert len(filler(37, "abc")) == 37
+    assert filler(37, "abc") == filler(37, "abc") != filler(37, "abd")
+    assert filler(0, "abc") == ""
+
+
+def test_restore_keeps_hashed_repeats_and_separates_redacted():
+    counter = iter(range(100))
+    hashed = restore_texts([{"sha": "aa", "len": 20}, {"sha": "aa", "len": 20}, "kept"], counter)
+    assert hashed[0] == hashed[1] and hashed[2] == "kept"
+    redacted = restore_texts([{"len": 20}, {"len": 20}], counter)
+    assert redacted[0] != redacted[1]
+
+
+def test_build_requests_scales_filters_and_keeps_deadlines():
+    records = [
+        _record(10.0),
+        {**_record(10.5), "deadline_ms": "300"},
+        _record(11.0, status=422),
+        _record(12.0, path="/bertscore", candidates=["a"], references=["b"]),
+        _record(12.5, status=503),
+    ]
+    requests = build_requests(records, speed=2.0)
+    assert [r.offset for r in requests] == [0.0, 0.25, 1.0, 1.25]
+    assert requests[1].headers == {"X-Deadline-Ms": "300"}
+    assert [r.path for r in build_requests(records, paths=["/bertscore"])] == ["/bertscore"]
+    with pytest.raises(ValueError):
+        build_requests(records, speed=0)
+
+
+def test_replay_is_open_loop_and_summarized():
+    app = FastAPI()
+    seen = []
+
+    @app.post("/embed")
+    async def embed(request: Request):
+        seen.append(await request.json())
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    requests = build_requests([_record(0.0), _record(0.01), _record(0.02, status=503)])
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await replay(requests, client)
+
+    results = asyncio.run(run())
+    assert len(seen) == 3
+    assert all(r.status == 200 and r.latency_ms >= 50 for r in results)
+    summary = summarize(requests, results + [ReplayResult("/embed", 503, 1.0, 0.0)], 0.1)
+    stats = summary["paths"]["/embed"]
+    assert (stats["count"], stats["ok"]) == (4, 3)
+    assert stats["statuses"] == {"200": 3, "503": 1}
+    assert stats["latency_ms"]["p50"] >= 50
+    assert stats["captured_ms"]["p50"] == 5.0
@@ -0,0 +1,113 @@
+"""Tests for idle model offload and re-promotion."""
+
+import pytest
+import torch
+
+from residency import DEVICE, FILE, HOST, ResidencyManager, offload_to_host, promote, spill_to_file, torch_module
+
+
+class _Tied(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = torch.nn.Embedding(10, 4)
+        self.out = torch.nn.Linear(4, 10, bias=False)
+        self.out.weight = self.embed.weight
+        self.norm = torch.nn.BatchNorm1d(4)
+
+    def forward(self, ids):
+        return self.out(self.norm(self.embed(ids)))
+
+
+def _model():
+    torch.manual_seed(0)
+    return _Tied().eval()
+
+
+class _Scorer:
+    def __init__(self, model):
+        self._model = model
+
+
+class TestMoves:
+    def test_spill_and_promote_keep_outputs(self, tmp_path):
+        model = _model()
+        ids = torch.tensor([1, 2, 3])
+        expected = model(ids)
+        size = spill_to_file(model, tmp_path / "m.bin")
+        assert size >= sum(p.numel() * 4 for p in model.parameters())
+        assert torch.equal(model(ids), expected)
+        # Tied weights still share one tensor after the spill.
+        assert model.out.weight is model.embed.weight
+        promote(model, torch.device("cpu"))
+        (tmp_path / "m.bin").unlink()
+        assert torch.equal(model(ids), expected)
+
+    def test_offload_to_host_round_trip(self):
+        model = _model()
+        ids = torch.tensor([4, 5])
+        expected = model(ids)
+        assert offload_to_host(model) > 0
+        promote(model, torch.device("cpu"))
+        assert torch.equal(model(ids), expected)
+
+    def test_torch_module_finds_bertscorer_model(self):
+        model = _model()
+        assert torch_module(model) is model
+        assert torch_module(_Scorer(model)) is model
+        assert torch_module(object()) is None
+
+
+class TestResidencyManager:
+    @pytest.mark.asyncio
+    async def test_idle_model_spills_and_promotes_on_cpu(self, tmp_path):
+        manager = ResidencyManager(torch.device("cpu"), idle_seconds=0.0, spill_dir=tmp_path)
+        model = _model()
+        expected = model(torch.tensor([1]))
+        manager.register("bertscore", "m", _Scorer(model))
+
+        assert await manager.offload_idle(lambda kind, name: False) == ["bertscore:m"]
+        [status] = manager.status()
+        assert status["state"] == FILE
+        assert len(list(tmp_path.iterdir())) == 1
+
+        elapsed = await manager.ensure_resident("bertscore", "m")
+        assert elapsed is not None and elapsed >= 0
+        assert await manager.ensure_resident("bertscore", "m") is None
+        [status] = manager.status()
+        assert status["state"] == DEVICE
+        assert status["promotions"] == 1 and status["offloads"] == 1
+        assert status["last_promotion_ms"] == pytest.approx(elapsed, abs=0.01)
+        assert list(tmp_path.iterdir()) == []
+        assert torch.equal(model(torch.tensor([1])), expected)
+
+    @pytest.mark.asyncio
+    async def test_busy_or_recent_models_stay(self, tmp_path):
+        manager = ResidencyManager(torch.device("cpu"), idle_seconds=60, spill_dir=tmp_path)
+        manager.register("embed", "recent", _model())
+        assert await manager.offload_idle(lambda kind, name: False) == []
+
+        manager.idle_seconds = 0.0
+        assert await manager.offload_idle(lambda kind, name: True) == []
+        assert manager.status()[0]["state"] == DEVICE
+
+    @pytest.mark.asyncio
+    async def test_non_torch_models_are_ignored(self, tmp_path):
+        manager = ResidencyManager(torch.device("cpu"), idle_seconds=0.0, spill_dir=tmp_path)
+        manager.register("embed", "remote", object())
+        assert manager.status() == []
+        assert await manager.ensure_resident("embed", "remote") is None
+
+    @pytest.mark.asyncio
+    async def test_gpu_host_offloads_to_host_memory(self, tmp_path, monkeypatch):
+        import residency
+
+        manager = ResidencyManager(torch.device("cuda"), idle_seconds=0.0, spill_dir=tmp_path)
+        manager.register("embed", "m", _model())
+        moved = []
+        monkeypatch.setattr(residency, "offload_to_host", lambda module: moved.append(module) or 0)
+        monkeypatch.setattr(residency, "promote", lambda module, device: moved.append(device))
+        assert await manager.offload("embed", "m")
+        assert manager.status()[0]["state"] == HOST
+        await manager.ensure_resident("embed", "m")
+        assert moved[1] == torch.device("cuda")
+        assert list(tmp_path.iterdir()) == []
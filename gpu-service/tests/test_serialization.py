@@ -0,0 +1,64 @@
+"""Tests for the fast JSON response path."""
+
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import torch
+
+import serialization
+from serialization import FastJSONResponse, encode_json, payload_nbytes, render_json
+
+
+class TestEncodeJson:
+    def test_numpy_matrix_round_trips(self):
+        arr = np.array([[0.5, 0.25], [1.0, -2.0]], dtype=np.float32)
+        data = json.loads(encode_json({"embeddings": arr, "dimensions": 2}))
+        assert data == {"embeddings": [[0.5, 0.25], [1.0, -2.0]], "dimensions": 2}
+
+    def test_torch_tensor_is_encoded(self):
+        data = json.loads(encode_json({"f1": torch.tensor([0.5, 0.75])}))
+        assert data["f1"] == [0.5, 0.75]
+
+    def test_float16_is_upcast(self):
+        data = json.loads(encode_json(np.array([0.5, 1.5], dtype=np.float16)))
+        assert data == [0.5, 1.5]
+
+    def test_non_contiguous_array(self):
+        arr = np.arange(12, dtype=np.float32).reshape(3, 4)[:, ::2]
+        assert json.loads(encode_json(arr)) == arr.tolist()
+
+    def test_empty_matrix(self):
+        assert json.loads(encode_json({"embeddings": np.empty((0, 0))})) == {"embeddings": []}
+
+    def test_stdlib_fallback_matches(self):
+        arr = np.array([[0.5, 0.25]], dtype=np.float32)
+        with patch.object(serialization, "orjson", None):
+            data = json.loads(encode_json({"embeddings": arr, "f1": torch.tensor([0.5])}))
+        assert data == {"embeddings": [[0.5, 0.25]], "f1": [0.5]}
+
+
+class TestPayloadNbytes:
+    def test_counts_nested_arrays(self):
+        payload = {"a": np.zeros((4, 8), dtype=np.float32), "b": [torch.zeros(10)], "model": "x"}
+        assert payload_nbytes(payload) == 4 * 8 * 4 + 10 * 4
+
+
+class TestRenderJson:
+    @pytest.mark.asyncio
+    async def test_small_payload_encoded_inline(self):
+        with patch("serialization.asyncio.to_thread") as to_thread:
+            resp = await render_json({"embeddings": np.zeros((1, 2), dtype=np.float32)})
+        to_thread.assert_not_called()
+        assert isinstance(resp, FastJSONResponse)
+        assert resp.media_type == "application/json"
+        assert json.loads(resp.body) == {"embeddings": [[0.0, 0.0]]}
+
+    @pytest.mark.asyncio
+    async def test_large_payload_encoded_in_thread(self):
+        with patch.object(serialization, "SERIALIZE_THREAD_BYTES", 16):
+            with patch("serialization.asyncio.to_thread", wraps=serialization.asyncio.to_thread) as to_thread:
+                resp = await render_json({"embeddings": np.zeros((4, 4), dtype=np.float32)})
+        to_thread.assert_called_once()
+        assert len(json.loads(resp.body)["embeddings"]) == 4
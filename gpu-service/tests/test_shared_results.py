@@ -0,0 +1,65 @@
+"""Tests for the shared-memory result handoff."""
+
+import numpy as np
+import pytest
+
+from shared_results import SegmentBudgetExceeded, SharedResultStore, UnknownSegment, is_local_client
+
+
+def _read(lease: dict) -> np.ndarray:
+    """What a non-NumPy client does: map the raw data after `offset`."""
+    return np.fromfile(lease["path"], dtype=lease["dtype"], offset=lease["offset"]).reshape(lease["shape"])
+
+
+class TestSharedResultStore:
+    def test_put_writes_a_mappable_segment(self, tmp_path):
+        store = SharedResultStore(tmp_path, ttl=60, budget_bytes=2**20)
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        lease = store.put(vectors)
+        assert (lease["shape"], lease["dtype"]) == ([3, 4], "float32")
+        np.testing.assert_array_equal(_read(lease), vectors)
+        np.testing.assert_array_equal(np.load(lease["path"], mmap_mode="r"), vectors)
+        assert store.status()["segments"] == 1 and store.bytes == vectors.nbytes
+
+    def test_segments_are_owner_only(self, tmp_path):
+        import os
+        import stat
+
+        root = tmp_path / "segments"
+        root.mkdir(mode=0o755)
+        os.chmod(root, 0o755)
+        old_umask = os.umask(0o022)
+        try:
+            lease = SharedResultStore(root, ttl=60, budget_bytes=2**20).put(np.zeros(4, dtype=np.float32))
+        finally:
+            os.umask(old_umask)
+        assert stat.S_IMODE(os.stat(root).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(lease["path"]).st_mode) == 0o600
+
+    def test_release_removes_the_file_once(self, tmp_path):
+        store = SharedResultStore(tmp_path, ttl=60, budget_bytes=2**20)
+        lease = store.put(np.zeros((2, 2), dtype=np.float32))
+        store.release(lease["handle"])
+        assert not (tmp_path / f"{lease['handle']}.npy").exists()
+        assert store.bytes == 0 and store.released == 1
+        with pytest.raises(UnknownSegment):
+            store.release(lease["handle"])
+        with pytest.raises(UnknownSegment):
+            store.release("../../etc/passwd")
+
+    def test_budget_and_expiry(self, tmp_path):
+        store = SharedResultStore(tmp_path, ttl=0, budget_bytes=64)
+        store.put(np.zeros(16, dtype=np.float32))
+        # The first lease has already expired (ttl=0), so its bytes are reclaimed on the next put.
+        store.put(np.zeros(16, dtype=np.float32))
+        assert store.expired == 1 and len(list(tmp_path.iterdir())) == 1
+        with pytest.raises(SegmentBudgetExceeded):
+            SharedResultStore(tmp_path, ttl=60, budget_bytes=8).put(np.zeros(16, dtype=np.float32))
+        store.close()
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_is_local_client():
+    assert is_local_client("127.0.0.1") and is_local_client("::1") and is_local_client("localhost")
+    assert not is_local_client("10.0.0.5")
+    assert not is_local_client(None)
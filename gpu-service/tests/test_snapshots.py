@@ -0,0 +1,145 @@
+"""Tests for the local model snapshot store."""
+
+import json
+import os
+
+import pytest
+import torch
+from safetensors.torch import save_file
+
+import snapshots
+from snapshots import SnapshotStore, apply_offline_mode, mmap_safetensors, rebind_to_mmap
+
+
+class _FakeEmbedder:
+    def __init__(self, path=None, device=None):
+        self.path = path
+        self.device = device
+
+    def save(self, path, safe_serialization=True):
+        with open(os.path.join(path, "model.safetensors"), "wb") as f:
+            f.write(b"")
+
+
+class TestMmapSafetensors:
+    def test_round_trip_mixed_dtypes(self, tmp_path):
+        tensors = {
+            "a": torch.arange(6, dtype=torch.float32).reshape(2, 3),
+            "b": torch.tensor([1.5, -2.0], dtype=torch.float16),
+            "c": torch.tensor([7, 8, 9], dtype=torch.int64),
+        }
+        save_file(tensors, tmp_path / "w.safetensors")
+        loaded = mmap_safetensors(tmp_path / "w.safetensors")
+        assert set(loaded) == set(tensors)
+        for name, tensor in tensors.items():
+            assert loaded[name].dtype == tensor.dtype
+            assert torch.equal(loaded[name], tensor)
+
+    def test_views_share_one_mapping(self, tmp_path):
+        save_file({"a": torch.ones(4), "b": torch.zeros(4)}, tmp_path / "w.safetensors")
+        loaded = mmap_safetensors(tmp_path / "w.safetensors")
+        assert loaded["a"].untyped_storage().data_ptr() == loaded["b"].untyped_storage().data_ptr()
+
+
+class TestRebind:
+    def test_module_weights_point_at_file(self, tmp_path):
+        source = torch.nn.Linear(3, 2)
+        save_file(source.state_dict(), tmp_path / "model.safetensors")
+        target = torch.nn.Linear(3, 2)
+        assert rebind_to_mmap(target, tmp_path) == 2
+        assert torch.equal(target.weight, source.weight)
+        assert isinstance(target.weight, torch.nn.Parameter)
+        x = torch.randn(1, 3)
+        assert torch.allclose(target(x), source(x))
+
+    def test_sentence_transformer_layout(self, tmp_path):
+        class _Transformer(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.auto_model = torch.nn.Linear(2, 2)
+
+        source = torch.nn.Sequential(_Transformer(), torch.nn.Linear(2, 1))
+        (tmp_path / "1_Dense").mkdir()
+        save_file(source[0].auto_model.state_dict(), tmp_path / "model.safetensors")
+        save_file(source[1].state_dict(), tmp_path / "1_Dense" / "model.safetensors")
+        (tmp_path / "modules.json").write_text(json.dumps([
+            {"idx": 0, "name": "0", "path": ""},
+            {"idx": 1, "name": "1", "path": "1_Dense"},
+        ]))
+        target = torch.nn.Sequential(_Transformer(), torch.nn.Linear(2, 1))
+        assert rebind_to_mmap(target, tmp_path) == 4
+        assert torch.equal(target[0].auto_model.weight, source[0].auto_model.weight)
+        assert torch.equal(target[1].weight, source[1].weight)
+
+    def test_mismatched_file_is_skipped(self, tmp_path):
+        save_file({"other.weight": torch.ones(1)}, tmp_path / "model.safetensors")
+        assert rebind_to_mmap(torch.nn.Linear(1, 1), tmp_path) == 0
+
+
+class TestSnapshotStore:
+    def test_freeze_writes_manifest_atomically(self, tmp_path):
+        store = SnapshotStore(tmp_path)
+        path = store.freeze_embedder("org/model", _FakeEmbedder())
+        assert path == tmp_path / "embed" / "org--model"
+        assert store.manifest("embed", "org/model")["model"] == "org/model"
+        assert [m["model"] for m in store.list()] == ["org/model"]
+        assert not any(p.name.startswith("org--model.tmp") for p in (tmp_path / "embed").iterdir())
+
+    def test_failed_freeze_leaves_nothing(self, tmp_path):
+        store = SnapshotStore(tmp_path)
+        broken = _FakeEmbedder()
+        broken.save = lambda path, safe_serialization=True: (_ for _ in ()).throw(OSError("disk full"))
+        with pytest.raises(OSError):
+            store.freeze_embedder("m", broken)
+        assert store.manifest("embed", "m") is None
+        assert list((tmp_path / "embed").iterdir()) == []
+
+    def test_load_embedder_uses_snapshot_path(self, tmp_path):
+        store = SnapshotStore(tmp_path)
+        assert store.load_embedder("m", _FakeEmbedder, torch.device("cpu")) is None
+        store.freeze_embedder("m", _FakeEmbedder())
+        loaded = store.load_embedder("m", _FakeEmbedder, torch.device("cpu"))
+        assert loaded.path == str(tmp_path / "embed" / "m")
+
+    def test_from_env(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", None)
+        assert SnapshotStore.from_env() is None
+        monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+        assert SnapshotStore.from_env().root == tmp_path
+
+    def test_offline_mode_sets_hf_env(self, monkeypatch):
+        monkeypatch.delenv("HF_HUB_OFFLINE", raising=False)
+        monkeypatch.delenv("TRANSFORMERS_OFFLINE", raising=False)
+        monkeypatch.setattr(snapshots, "OFFLINE", True)
+        apply_offline_mode()
+        assert os.environ["HF_HUB_OFFLINE"] == "1"
+        assert os.environ["TRANSFORMERS_OFFLINE"] == "1"
+
+
+class TestBertScorerSnapshot:
+    def test_truncated_model_round_trips(self, tmp_path):
+        pytest.importorskip("bert_score")
+        transformers = pytest.importorskip("transformers")
+        from bert_score import BERTScorer
+
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "a", "b", "c"]
+        source = tmp_path / "source"
+        source.mkdir()
+        (source / "vocab.txt").write_text("\n".join(vocab))
+        config = transformers.BertConfig(
+            vocab_size=len(vocab), hidden_size=16, num_hidden_layers=3, num_attention_heads=2,
+            intermediate_size=32, max_position_embeddings=32,
+        )
+        torch.manual_seed(0)
+        transformers.BertModel(config).save_pretrained(source)
+        transformers.BertTokenizer(str(source / "vocab.txt"), model_max_length=32).save_pretrained(source)
+
+        scorer = BERTScorer(model_type=str(source), num_layers=2, lang="en")
+        store = SnapshotStore(tmp_path / "snapshots")
+        store.freeze_bertscorer("tiny-bert", scorer)
+        assert store.manifest("bertscore", "tiny-bert")["num_layers"] == 2
+
+        loaded = store.load_bertscorer("tiny-bert", BERTScorer, torch.device("cpu"))
+        assert len(loaded._model.encoder.layer) == 2
+        for expected, actual in zip(scorer.score(["a b"], ["a c"]), loaded.score(["a b"], ["a c"])):
+            assert torch.allclose(expected, actual)
@@ -0,0 +1,93 @@
+"""Tests for the BERTScore token-embedding cache."""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+from transformers import BertConfig, BertModel
+
+from idf import IdfTable, score_with_idf
+from tests.test_idf import _Tokenizer
+from token_cache import TokenEmbeddingCache, cacheable, default_idf
+
+REFS = ["the cat sat on the mat", "a dog ran", "the mat", "a dog ran"]
+CANDS = ["a cat sat", "the dog ran far away", "mat", "dog"]
+
+
+def tiny_scorer():
+    """A BERTScorer stand-in around a tiny random BERT, counting forward passes."""
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=100, hidden_size=16, num_hidden_layers=2, num_attention_heads=2, intermediate_size=32
+    )
+    model = BertModel(config).eval()
+    model.encode_calls = 0
+    forward = model.forward
+
+    def counting_forward(*args, **kwargs):
+        model.encode_calls += 1
+        return forward(*args, **kwargs)
+
+    model.forward = counting_forward
+    return SimpleNamespace(
+        _model=model,
+        _tokenizer=_Tokenizer(),
+        device="cpu",
+        batch_size=2,
+        num_layers=2,
+        all_layers=False,
+        rescale_with_baseline=False,
+    )
+
+
+@pytest.fixture
+def scorer():
+    return tiny_scorer()
+
+
+class TestTokenEmbeddingCache:
+    def test_float32_matches_uncached_scoring(self, scorer):
+        expected = score_with_idf(scorer, CANDS, REFS, default_idf(scorer._tokenizer))
+        cache = TokenEmbeddingCache(2**20, torch.float32)
+        for _ in range(2):
+            got = cache.score(scorer, "m", CANDS, REFS)
+            for a, b in zip(got, expected):
+                assert torch.allclose(a, b, atol=1e-6)
+
+    def test_idf_weights_are_applied_at_match_time(self, scorer):
+        idf = IdfTable.compute(REFS, scorer._tokenizer).idf_dict(scorer._tokenizer)
+        expected = score_with_idf(scorer, CANDS, REFS, idf)
+        cache = TokenEmbeddingCache(2**20, torch.float32)
+        cache.score(scorer, "m", CANDS, REFS)  # cached without IDF, reused with it
+        got = cache.score(scorer, "m", CANDS, REFS, idf)
+        assert torch.allclose(got[2], expected[2], atol=1e-6)
+
+    def test_hits_skip_the_forward_pass(self, scorer):
+        cache = TokenEmbeddingCache(2**20, torch.float16)
+        first = cache.score(scorer, "m", CANDS, REFS)
+        calls = scorer._model.encode_calls
+        again = cache.score(scorer, "m", list(reversed(CANDS)), list(reversed(REFS)))
+        assert scorer._model.encode_calls == calls
+        assert torch.allclose(again[2].flip(0), first[2], atol=1e-3)
+        status = cache.status()
+        assert status["entries"] == 7  # unique sentences
+        assert status["misses"] == 7 and status["hits"] == 7
+        assert status["dtype"] == "float16"
+
+    def test_byte_budget_evicts_least_recently_used(self, scorer):
+        cache = TokenEmbeddingCache(2**20, torch.float16)
+        cache.score(scorer, "m", ["a cat"], ["the cat"])
+        per_entry = cache.bytes // 2
+        small = TokenEmbeddingCache(per_entry * 3, torch.float16)
+        small.score(scorer, "m", ["a cat"], ["the cat"])
+        small.score(scorer, "m", ["a dog"], ["the dog"])
+        assert small.bytes <= small.budget_bytes
+        assert small.evictions >= 1
+        assert small.get(("m", 2, "missing")) is None
+
+    def test_only_real_single_layer_scorers_are_cacheable(self, scorer):
+        assert cacheable(scorer)
+        assert not cacheable(MagicMock())
+        scorer.all_layers = True
+        assert not cacheable(scorer)
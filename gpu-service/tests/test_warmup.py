@@ -0,0 +1,82 @@
+"""Tests for shape-aware warmup and model readiness."""
+
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from warmup import Readiness, parse_sizes, synthetic_texts, warm_model, warmup_grid
+
+
+class _Embedder(torch.nn.Linear):
+    """A SentenceTransformer stand-in with real weights that records the batches it encodes."""
+
+    def __init__(self, max_seq_length=None):
+        super().__init__(4, 4)
+        self.max_seq_length = max_seq_length
+        self.batches = []
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        self.batches.append((len(texts), len(texts[0].split()) + 2, batch_size))
+        return self(torch.zeros(len(texts), 4)).detach().numpy()
+
+
+def test_grid_runs_largest_shape_first():
+    grid = warmup_grid([1, 8], [16, 128])
+    assert grid == [(8, 128), (1, 128), (8, 16), (1, 16)]
+    assert parse_sizes("32, 1,8,8") == [1, 8, 32]
+    with pytest.raises(ValueError):
+        parse_sizes("8,0")
+
+
+def test_cpu_defaults_to_one_shape_unless_configured(monkeypatch):
+    monkeypatch.delenv("GPU_WARMUP_BATCH_SIZES", raising=False)
+    monkeypatch.delenv("GPU_WARMUP_SEQ_TOKENS", raising=False)
+    assert warmup_grid(device=torch.device("cpu")) == [(1, 128)]
+    assert len(warmup_grid(device=torch.device("cuda"))) == 9
+    monkeypatch.setenv("GPU_WARMUP_BATCH_SIZES", "1,8")
+    assert warmup_grid(device=torch.device("cpu")) == [(8, 128), (1, 128)]
+
+
+def test_synthetic_texts_are_distinct_and_sized():
+    texts = synthetic_texts(4, 10)
+    assert len(set(texts)) == 4
+    assert all(len(text.split()) == 8 for text in texts)
+
+
+def test_warm_model_primes_then_times_every_shape():
+    embedder = _Embedder(max_seq_length=64)
+    report = warm_model("embed", embedder, torch.device("cpu"), warmup_grid([2, 4], [16, 128, 512]))
+    shapes = [(s["batch_size"], s["tokens"]) for s in report["shapes"]]
+    # 128 and 512 both clamp to the model's 64-token limit and run once.
+    assert shapes == [(4, 64), (2, 64), (4, 16), (2, 16)]
+    assert [b[:2] for b in embedder.batches] == [shape for shape in shapes for _ in range(2)]
+    assert all(s["warm_ms"] >= 0 and s["first_ms"] >= 0 for s in report["shapes"])
+    assert report["seconds"] >= 0
+
+
+def test_warm_model_scores_bertscore_and_skips_stand_ins():
+    calls = []
+    scorer = SimpleNamespace(
+        _model=torch.nn.Linear(2, 2), score=lambda c, r, batch_size: calls.append((len(c), len(r), batch_size))
+    )
+    report = warm_model("bertscore", scorer, torch.device("cpu"), [(3, 8)])
+    assert calls == [(3, 3, 3), (3, 3, 3)]
+    assert len(report["shapes"]) == 1
+    assert warm_model("embed", SimpleNamespace(encode=lambda *a, **k: None), torch.device("cpu"), [(1, 8)]) is None
+    assert warm_model("embed", _Embedder(), torch.device("cpu"), []) is None
+
+
+def test_readiness_waits_for_required_models():
+    readiness = Readiness([("embed", "a"), ("bertscore", "b")])
+    assert not readiness.is_ready()
+    readiness.mark("embed", "a", "ready", {"seconds": 0.1, "shapes": []})
+    readiness.mark("bertscore", "b", "warming")
+    assert not readiness.is_ready()
+    readiness.mark("bertscore", "b", "ready")
+    readiness.mark("embed", "extra", "loading")
+    assert readiness.is_ready()
+    states = {(m["kind"], m["model"]): m["state"] for m in readiness.status()}
+    assert states == {("embed", "a"): "ready", ("bertscore", "b"): "ready", ("embed", "extra"): "loading"}
+    readiness.forget("embed", "extra")
+    assert len(readiness.status()) == 2
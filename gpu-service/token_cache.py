@@ -0,0 +1,184 @@
+"""Per-sentence contextual token-embedding cache for BERTScore.
+
+Evaluation loops send the same references (and often the same candidates)
+again and again, and `BERTScorer.score` runs the full forward pass for every
+sentence on every call. BERTScore only needs each sentence's token
+embeddings from one layer plus its token ids, and those depend on nothing but
+the model, the layer and the text. `TokenEmbeddingCache` keeps them in a
+byte-budgeted LRU in host memory (float16 by default), keyed by model, layer
+and text hash. `score()` encodes only the sentences it has not seen and goes
+straight to greedy matching for the rest.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+TOKEN_CACHE_MB = float(os.environ.get("GPU_TOKEN_CACHE_MB", "512"))
+TOKEN_CACHE_DTYPE = os.environ.get("GPU_TOKEN_CACHE_DTYPE", "float16")
+# Without the shared cache, each BERTScore job still gets one this large, so it encodes every sentence once
+JOB_CACHE_MB = float(os.environ.get("GPU_TOKEN_CACHE_JOB_MB", "256"))
+
+_DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16, "float32": torch.float32}
+
+
+def text_key(model: str, layer: int | None, text: str) -> tuple[str, int | None, str]:
+    return model, layer, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def default_idf(tokenizer: Any) -> dict:
+    """Uniform token weights with [SEP]/[CLS] zeroed, as `BERTScorer.score` uses without IDF."""
+    from collections import defaultdict
+
+    idf = defaultdict(lambda: 1.0)
+    idf[tokenizer.sep_token_id] = 0
+    idf[tokenizer.cls_token_id] = 0
+    return idf
+
+
+def cacheable(scorer: Any) -> bool:
+    """Single-layer scorers backed by a real module (not all_layers, not a stand-in)."""
+    from residency import torch_module
+
+    return torch_module(scorer) is not None and not getattr(scorer, "all_layers", False)
+
+
+class TokenEmbeddingCache:
+    """Byte-budgeted LRU of `(token embeddings, token ids)` per sentence."""
+
+    def __init__(self, budget_bytes: int, dtype: torch.dtype = torch.float16):
+        self.budget_bytes = budget_bytes
+        self.dtype = dtype
+        self._entries: OrderedDict[tuple, tuple[torch.Tensor, torch.Tensor]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "TokenEmbeddingCache | None":
+        if TOKEN_CACHE_MB <= 0:
+            return None
+        if TOKEN_CACHE_DTYPE not in _DTYPES:
+            raise ValueError(f"GPU_TOKEN_CACHE_DTYPE must be one of {', '.join(_DTYPES)}")
+        return cls(int(TOKEN_CACHE_MB * 2**20), _DTYPES[TOKEN_CACHE_DTYPE])
+
+    @classmethod
+    def for_job(cls) -> "TokenEmbeddingCache | None":
+        """A short-lived cache for one job, in float32 so scores match the uncached path exactly."""
+        return cls(int(JOB_CACHE_MB * 2**20), torch.float32) if JOB_CACHE_MB > 0 else None
+
+    def get(self, key: tuple) -> tuple[torch.Tensor, torch.Tensor] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, embedding: torch.Tensor, ids: torch.Tensor) -> None:
+        entry = (embedding.detach().to("cpu", self.dtype, copy=True), ids.to("cpu", copy=True))
+        size = sum(t.numel() * t.element_size() for t in entry)
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= sum(t.numel() * t.element_size() for t in old)
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= sum(t.numel() * t.element_size() for t in evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "budget_bytes": self.budget_bytes,
+            "dtype": str(self.dtype).removeprefix("torch."),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _encode(self, scorer: Any, sentences: list[str]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        """Token embeddings and ids for `sentences`, batched longest first like bert_score."""
+        from bert_score.utils import bert_encode, padding, sent_encode
+
+        tokenizer = scorer._tokenizer
+        device = next(scorer._model.parameters()).device
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i].split(" ")), reverse=True)
+        out: list[tuple[torch.Tensor, torch.Tensor] | None] = [None] * len(sentences)
+        for start in range(0, len(order), scorer.batch_size):
+            batch = order[start:start + scorer.batch_size]
+            ids = [sent_encode(tokenizer, sentences[i]) for i in batch]
+            padded, lens, mask = padding(ids, tokenizer.pad_token_id, dtype=torch.long)
+            emb = bert_encode(scorer._model, padded.to(device), attention_mask=mask.to(device))
+            for j, i in enumerate(batch):
+                out[i] = (emb[j, :lens[j]], padded[j, :lens[j]])
+        return out
+
+    def score(
+        self, scorer: Any, model: str, cands: list[str], refs: list[str], idf: dict | None = None
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Same result as `scorer.score(cands, refs)` (or its IDF-weighted form), reusing cached sentences."""
+        from bert_score.utils import greedy_cos_idf
+
+        tokenizer = scorer._tokenizer
+        idf = idf if idf is not None else default_idf(tokenizer)
+        layer = scorer.num_layers
+        device = next(scorer._model.parameters()).device
+
+        # This call's sentences stay referenced here even if the LRU evicts them meanwhile.
+        found: dict[str, tuple[torch.Tensor, torch.Tensor]] = {}
+        missing: list[str] = []
+        for text in dict.fromkeys([*refs, *cands]):
+            entry = self.get(text_key(model, layer, text))
+            if entry is None:
+                missing.append(text)
+            else:
+                found[text] = entry
+        if missing:
+            for text, (emb, ids) in zip(missing, self._encode(scorer, missing)):
+                found[text] = (emb, ids)
+                self.put(text_key(model, layer, text), emb, ids)
+
+        def pad(texts: list[str]) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+            embs = [found[t][0].to(device, torch.float32) for t in texts]
+            ids = [found[t][1] for t in texts]
+            emb = pad_sequence(embs, batch_first=True, padding_value=2.0)
+            weights = pad_sequence(
+                [torch.tensor([idf[int(i)] for i in row], dtype=torch.float32) for row in ids], batch_first=True
+            ).to(device)
+            lens = torch.tensor([len(row) for row in ids])
+            mask = (torch.arange(int(lens.max())).expand(len(ids), -1) < lens.unsqueeze(1)).to(device)
+            return emb, mask, weights
+
+        preds = []
+        with torch.no_grad():
+            for start in range(0, len(refs), scorer.batch_size):
+                P, R, F = greedy_cos_idf(
+                    *pad(refs[start:start + scorer.batch_size]), *pad(cands[start:start + scorer.batch_size])
+                )
+                preds.append(torch.stack((P, R, F), dim=-1).cpu())
+        preds = torch.cat(preds, dim=0) if preds else torch.empty(0, 3)
+        if scorer.rescale_with_baseline:
+            preds = (preds - scorer.baseline_vals) / (1 - scorer.baseline_vals)
+        return preds[..., 0], preds[..., 1], preds[..., 2]
@@ -0,0 +1,159 @@
+"""Shape-aware warmup after a model load.
+
+A freshly loaded model is not yet fast. The first forward pass at a new
+batch size and sequence length pays for CUDA kernel selection (cuBLAS
+heuristics, cuDNN autotuning), lazy module initialization and the caching
+allocator growing its pool, so the first real request at that shape runs
+several times slower than the next one. `warm_model` runs synthetic batches
+over the `GPU_WARMUP_BATCH_SIZES` x `GPU_WARMUP_SEQ_TOKENS` grid, largest
+first so the allocator reserves its peak block once and smaller shapes reuse
+it. Each shape runs once to prime and once more to record its warm latency.
+On CPU there is no kernel selection to pay for, and the full grid would only
+delay startup, so unless the sizes are set explicitly a single small shape
+warms lazy initialization.
+
+`Readiness` tracks every model through `loading`, `warming` and `ready`.
+`/ready` answers 200 only once the default models have finished warming.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Sequence
+
+import torch
+
+from residency import torch_module
+
+logger = logging.getLogger("gpu-service")
+
+WARMUP_ENABLED = os.environ.get("GPU_WARMUP", "1").lower() not in ("0", "false", "no")
+_DEFAULT_BATCH_SIZES = "1,8,32"
+_DEFAULT_SEQ_TOKENS = "16,128,512"
+_CPU_BATCH_SIZES = "1"
+_CPU_SEQ_TOKENS = "128"
+
+# Distinct words, so batches are not collapsed by BERTScore's sentence deduplication.
+_WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike "
+    "november oscar papa quebec romeo sierra tango uniform victor whiskey yankee zulu"
+).split()
+
+
+def parse_sizes(text: str) -> list[int]:
+    """Parse a comma-separated list of positive integers such as `1,8,32`."""
+    sizes = sorted({int(part) for part in text.split(",") if part.strip()})
+    if any(size <= 0 for size in sizes):
+        raise ValueError(f"warmup sizes must be positive: {text!r}")
+    return sizes
+
+
+def warmup_grid(
+    batch_sizes: Sequence[int] | None = None,
+    seq_tokens: Sequence[int] | None = None,
+    device: torch.device | None = None,
+) -> list[tuple[int, int]]:
+    """All `(batch_size, tokens)` shapes, largest first; empty when warmup is disabled.
+
+    Sizes not given come from the environment, with a single-shape default on a CPU `device`.
+    """
+    cpu = device is not None and device.type == "cpu"
+    if batch_sizes is None:
+        if not WARMUP_ENABLED:
+            return []
+        default = _CPU_BATCH_SIZES if cpu else _DEFAULT_BATCH_SIZES
+        batch_sizes = parse_sizes(os.environ.get("GPU_WARMUP_BATCH_SIZES", default))
+    if seq_tokens is None:
+        default = _CPU_SEQ_TOKENS if cpu else _DEFAULT_SEQ_TOKENS
+        seq_tokens = parse_sizes(os.environ.get("GPU_WARMUP_SEQ_TOKENS", default))
+    shapes = [(batch, tokens) for batch in batch_sizes for tokens in seq_tokens]
+    return sorted(shapes, key=lambda shape: (shape[0] * shape[1], shape[1]), reverse=True)
+
+
+def synthetic_texts(batch_size: int, tokens: int) -> list[str]:
+    """`batch_size` distinct sentences of roughly `tokens` subword tokens each (including [CLS]/[SEP])."""
+    words = max(1, tokens - 2)
+    return [
+        " ".join(_WORDS[(row + i) % len(_WORDS)] for i in range(words))
+        for row in range(batch_size)
+    ]
+
+
+def _max_tokens(model) -> int | None:
+    limit = getattr(model, "max_seq_length", None)
+    if limit is None:
+        tokenizer = getattr(model, "_tokenizer", None)
+        limit = getattr(tokenizer, "model_max_length", None)
+    return limit if isinstance(limit, int) and limit < 10**6 else None
+
+
+def _run(kind: str, model, texts: list[str]) -> None:
+    if kind == "bertscore":
+        # Scoring a text against itself runs the candidate and reference passes at the same shape.
+        model.score(texts, texts, batch_size=len(texts))
+    else:
+        model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+
+
+def warm_model(kind: str, model, device: torch.device, grid: Sequence[tuple[int, int]]) -> dict | None:
+    """Prime `model` at every shape in `grid`; returns the per-shape warm latency, or None if skipped.
+
+    Stand-ins without torch weights (test doubles) are skipped.
+    """
+    if not grid or torch_module(model) is None:
+        return None
+    limit = _max_tokens(model)
+    shapes: list[dict] = []
+    t_start = time.perf_counter()
+    for batch_size, tokens in grid:
+        if limit is not None and tokens > limit:
+            tokens = limit
+        if any(s["batch_size"] == batch_size and s["tokens"] == tokens for s in shapes):
+            continue
+        texts = synthetic_texts(batch_size, tokens)
+        t0 = time.perf_counter()
+        _run(kind, model, texts)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        cold_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        _run(kind, model, texts)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        shapes.append({
+            "batch_size": batch_size,
+            "tokens": tokens,
+            "first_ms": round(cold_ms, 1),
+            "warm_ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+    return {"seconds": round(time.perf_counter() - t_start, 3), "shapes": shapes}
+
+
+class Readiness:
+    """Per-model `loading` -> `warming` -> `ready` state, plus the warmup report once ready."""
+
+    def __init__(self, required: Sequence[tuple[str, str]] = ()):
+        self.required = list(required)
+        self._models: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, kind: str, model: str, state: str, report: dict | None = None) -> None:
+        with self._lock:
+            entry = self._models.setdefault((kind, model), {"kind": kind, "model": model})
+            entry["state"] = state
+            if state == "ready":
+                entry["warmup"] = report
+
+    def forget(self, kind: str, model: str) -> None:
+        """Drop a model whose load failed, so it does not read as loading forever."""
+        with self._lock:
+            self._models.pop((kind, model), None)
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(self._models.get(key, {}).get("state") == "ready" for key in self.required)
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            return [dict(entry) for _, entry in sorted(self._models.items())]
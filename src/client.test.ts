@@ -1,3 +1,6 @@
+import { mkdtempSync, writeFileSync } from "fs";
+import { tmpdir } from "os";
+import { join } from "path";
 import { GpuBridgeClient, InputValidationError } from "./client";
 import { vi } from 'vitest'
 
@@ -87,6 +90,107 @@ describe("GpuBridgeClient multi-host", () => {
   });
 });
 
+describe("GpuBridgeClient least-busy via /load", () => {
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  const load = (queued: number, utilization: number) => ({
+    queued, jobs: 1, in_use_units: 0, capacity_units: 100, utilization,
+    service_ms: {}, memory: { free_mb: 1024, total_mb: 2048 }, lanes: [],
+  });
+
+  test("prefers the host with fewer queued requests and revalidates with the ETag", async () => {
+    const loadCalls: Array<{ url: string; etag?: string }> = [];
+    const fetchMock = vi.fn(async (url: string, init?: RequestInit) => {
+      if (url.endsWith("/load")) {
+        const etag = (init?.headers as Record<string, string> | undefined)?.["If-None-Match"];
+        loadCalls.push({ url, etag });
+        if (etag) {
+          return { ok: false, status: 304, headers: { get: () => etag } };
+        }
+        const body = url.startsWith("http://host-a") ? load(3, 0.2) : load(0, 0.9);
+        return { ok: true, status: 200, headers: { get: () => `"${url}"` }, json: async () => body };
+      }
+      if (url.endsWith("/embed")) {
+        return {
+          ok: true,
+          json: async () => ({ embeddings: [[1, 2]], model: "all-MiniLM-L6-v2", dimensions: 2 }),
+        };
+      }
+      return { ok: true, json: async () => ({ status: "ok", device: "cuda" }) };
+    });
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({
+      hosts: [{ url: "http://host-a:8765" }, { url: "http://host-b:8765" }],
+      loadBalancing: "least-busy",
+    });
+
+    await client.embed({ texts: ["hello"] });
+    await client.embed({ texts: ["hello"] });
+
+    const embeds = fetchMock.mock.calls.filter((c) => (c[0] as string).endsWith("/embed"));
+    expect(embeds.map((c) => c[0])).toEqual(["http://host-b:8765/embed", "http://host-b:8765/embed"]);
+    expect(fetchMock.mock.calls.some((c) => (c[0] as string).endsWith("/info"))).toBe(false);
+    expect(loadCalls.filter((c) => c.etag).map((c) => c.etag)).toEqual([
+      '"http://host-a:8765/load"',
+      '"http://host-b:8765/load"',
+    ]);
+  });
+});
+
+describe("GpuBridgeClient idempotency keys", () => {
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  test("a 503 retry reuses the request's Idempotency-Key", async () => {
+    const keys: string[] = [];
+    let embedCalls = 0;
+    const fetchMock = vi.fn(async (url: string, init?: RequestInit) => {
+      if (!url.endsWith("/embed")) {
+        return { ok: true, json: async () => ({ status: "ok", device: "cuda" }) };
+      }
+      keys.push((init?.headers as Record<string, string>)["Idempotency-Key"]);
+      embedCalls += 1;
+      if (embedCalls === 1) {
+        return { ok: false, status: 503, headers: { get: () => "0" }, text: async () => "busy" };
+      }
+      return {
+        ok: true,
+        status: 200,
+        json: async () => ({ embeddings: [[1]], model: "m", dimensions: 1 }),
+      };
+    });
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765", idempotencyKeys: true });
+    await client.embed({ texts: ["a"] });
+    await client.embed({ texts: ["a"] });
+
+    expect(keys).toHaveLength(3);
+    expect(keys[0]).toBe(keys[1]);
+    expect(keys[2]).not.toBe(keys[0]);
+  });
+
+  test("sends no key unless idempotencyKeys is enabled", async () => {
+    const fetchMock = vi.fn(async (url: string, _init?: RequestInit) => {
+      if (!url.endsWith("/embed")) {
+        return { ok: true, json: async () => ({ status: "ok", device: "cuda" }) };
+      }
+      return { ok: true, status: 200, json: async () => ({ embeddings: [[1]], model: "m", dimensions: 1 }) };
+    });
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await client.embed({ texts: ["a"] });
+
+    const init = fetchMock.mock.calls.find((c) => c[0].endsWith("/embed"))![1] as RequestInit;
+    expect((init.headers as Record<string, string>)["Idempotency-Key"]).toBeUndefined();
+  });
+});
+
 describe("GpuBridgeClient input validation", () => {
   afterEach(() => {
     vi.restoreAllMocks();
@@ -140,6 +244,21 @@ describe("GpuBridgeClient input validation", () => {
     ).rejects.toThrow("candidates array length 5 exceeds max batch size of 3");
   });
 
+  test("validates multi-reference bertscore groups", async () => {
+    const client = new GpuBridgeClient({
+      serviceUrl: "http://gpu:8765",
+      limits: { maxBatchSize: 3 },
+    });
+
+    await expect(
+      client.bertscore({ candidates: ["a"], references: [[]] })
+    ).rejects.toThrow("references[0] must hold 1 to 3 references");
+
+    await expect(
+      client.bertscore({ candidates: ["a"], references: [Array(4).fill("reference")] })
+    ).rejects.toThrow("references[0] array length 4 exceeds max batch size of 3");
+  });
+
   test("rejects text exceeding maxTextLength", async () => {
     const fetchMock = vi.fn().mockResolvedValue({
       ok: true,
@@ -196,6 +315,62 @@ describe("GpuBridgeClient input validation", () => {
       client.embed({ texts: Array(101).fill("ok") })
     ).rejects.toThrow("texts array length 101 exceeds max batch size of 100");
   });
+
+  test("embedShared reads the segment and releases it", async () => {
+    const path = join(mkdtempSync(join(tmpdir(), "shm-")), "seg.npy");
+    const header = Buffer.alloc(128, 0x20);
+    writeFileSync(path, Buffer.concat([header, Buffer.from(new Float32Array([1, 2, 3, 4]).buffer)]));
+    const fetchMock = vi.fn(async (url: string, _init?: RequestInit) => {
+      if (url.endsWith("/embed")) {
+        return {
+          ok: true,
+          status: 200,
+          json: async () => ({
+            handle: "h1", path, shape: [2, 2], dtype: "float32", offset: 128,
+            expires_at: 0, model: "m", dimensions: 2,
+          }),
+        };
+      }
+      return { ok: true, status: url.includes("/shm/") ? 204 : 200, json: async () => ({ status: "ok" }) };
+    });
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://127.0.0.1:8765" });
+    const result = await client.embedShared({ texts: ["a", "b"] });
+
+    expect(Array.from(result.vectors)).toEqual([1, 2, 3, 4]);
+    expect(result.shape).toEqual([2, 2]);
+    const release = fetchMock.mock.calls.find((c) => c[0] === "http://127.0.0.1:8765/shm/h1");
+    expect(release?.[1]?.method).toBe("DELETE");
+
+    const remote = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await expect(remote.embedShared({ texts: ["a"] })).rejects.toThrow("needs a GPU host on this machine");
+  });
+
+  test("rerank accepts candidate pools larger than the batch limit", async () => {
+    const fetchMock = vi.fn().mockResolvedValue({
+      ok: true,
+      json: async () => ({
+        results: [{ index: 3, score: 0.9, precision: 0.9, recall: 0.9, embed_score: 0.8 }],
+        model: "m",
+        embed_model: "e",
+        candidates: 1000,
+        shortlisted: 1,
+        timings_ms: { total: 12 },
+      }),
+    });
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+
+    const result = await client.rerank({ query: "q", candidates: Array(1000).fill("ok"), top_k: 1 });
+    expect(result.results[0].index).toBe(3);
+    expect(fetchMock.mock.calls.some((c) => c[0] === "http://gpu:8765/rerank")).toBe(true);
+
+    await expect(
+      client.rerank({ query: "q", candidates: Array(5001).fill("ok") })
+    ).rejects.toThrow("candidates array length 5001 exceeds max batch size of 5000");
+  });
 });
 
 describe("GpuBridgeClient Retry-After on 503", () => {
@@ -294,3 +469,85 @@ describe("GpuBridgeClient Retry-After on 503", () => {
     expect(result.dimensions).toBe(1);
   });
 });
+
+describe("GpuBridgeClient request compression", () => {
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  const embedOk = (requestEncodings?: string[], rejectGzip = false) =>
+    async (url: string, init?: RequestInit) => {
+      if (url.endsWith("/health")) {
+        return { ok: true, status: 200, json: async () => ({ status: "ok", device: "cuda", request_encodings: requestEncodings }) };
+      }
+      if (rejectGzip && (init?.headers as Record<string, string>)["Content-Encoding"]) {
+        return { ok: false, status: 415, headers: { get: () => null }, text: async () => "unsupported" };
+      }
+      return {
+        ok: true,
+        status: 200,
+        headers: { get: () => null },
+        json: async () => ({ embeddings: [[1]], model: "test", dimensions: 1 }),
+      };
+    };
+
+  const embedCalls = (fetchMock: ReturnType<typeof vi.fn>) =>
+    fetchMock.mock.calls.filter((c) => (c[0] as string).endsWith("/embed")).map((c) => c[1] as RequestInit);
+
+  const texts = Array.from({ length: 50 }, () => "x".repeat(1000));
+
+  test("gzips large request bodies once the host advertises gzip decoding", async () => {
+    const fetchMock = vi.fn(embedOk(["gzip"]));
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await new Promise((resolve) => setTimeout(resolve, 0));
+    await client.embed({ texts });
+
+    const [init] = embedCalls(fetchMock);
+    expect((init.headers as Record<string, string>)["Content-Encoding"]).toBe("gzip");
+    const { gunzipSync } = await import("zlib");
+    expect(JSON.parse(gunzipSync(init.body as Buffer).toString())).toEqual({ texts });
+  });
+
+  test("does not compress for hosts that do not advertise decoding", async () => {
+    const fetchMock = vi.fn(embedOk());
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await new Promise((resolve) => setTimeout(resolve, 0));
+    await client.embed({ texts });
+
+    const [init] = embedCalls(fetchMock);
+    expect((init.headers as Record<string, string>)["Content-Encoding"]).toBeUndefined();
+    expect(init.body).toBe(JSON.stringify({ texts }));
+  });
+
+  test("resends uncompressed when the host rejects a compressed body", async () => {
+    const fetchMock = vi.fn(embedOk(["gzip"], true));
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await new Promise((resolve) => setTimeout(resolve, 0));
+    const result = await client.embed({ texts });
+    await client.embed({ texts });
+
+    expect(result.dimensions).toBe(1);
+    const inits = embedCalls(fetchMock);
+    expect(inits.map((i) => (i.headers as Record<string, string>)["Content-Encoding"])).toEqual(["gzip", undefined, undefined]);
+    expect(inits[1].body).toBe(JSON.stringify({ texts }));
+  });
+
+  test("sends small request bodies as plain JSON", async () => {
+    const fetchMock = vi.fn(embedOk(["gzip"]));
+    global.fetch = fetchMock as unknown as typeof fetch;
+
+    const client = new GpuBridgeClient({ serviceUrl: "http://gpu:8765" });
+    await new Promise((resolve) => setTimeout(resolve, 0));
+    await client.embed({ texts: ["hello"] });
+
+    const [init] = embedCalls(fetchMock);
+    expect((init.headers as Record<string, string>)["Content-Encoding"]).toBeUndefined();
+    expect(init.body).toBe(JSON.stringify({ texts: ["hello"] }));
+  });
+});
@@ -1,5 +1,8 @@
 // GPU Bridge - HTTP Client with multi-host load balancing/failover
 
+import { randomUUID } from "crypto";
+import { readFile } from "fs/promises";
+import { gzipSync } from "zlib";
 import type {
   GpuBridgeConfig,
   GpuHostConfig,
@@ -7,15 +10,27 @@ import type {
   InfoResponse,
   BertScoreRequest,
   BertScoreResponse,
+  CorpusInfo,
+  CorpusRequest,
   EmbedRequest,
   EmbedResponse,
+  EmbedSharedResult,
+  EmbedShmResponse,
   LoadBalancingStrategy,
+  LoadResponse,
+  RerankRequest,
+  RerankResponse,
   StatusResponse,
 } from "./types.js";
 
 const DEFAULT_MAX_BATCH_SIZE = 100;
 const DEFAULT_MAX_TEXT_LENGTH = 10000;
+const MAX_RERANK_CANDIDATES = 5000;
+const MAX_CORPUS_DOCUMENTS = 100000;
 const MAX_503_RETRIES = 3;
+const LOAD_TIMEOUT_MS = 2000;
+// JSON request bodies at least this large are gzip-compressed for hosts that decode them
+const COMPRESS_REQUEST_BYTES = 16 * 1024;
 
 export class InputValidationError extends Error {
   constructor(message: string) {
@@ -24,6 +39,32 @@ export class InputValidationError extends Error {
   }
 }
 
+/** Serialize a request body; requestFromHost compresses it per host (responses are decompressed by fetch itself). */
+function jsonBody(req: unknown): RequestInit {
+  return { body: JSON.stringify(req) };
+}
+
+const LOOPBACK_HOSTNAMES = new Set(["localhost", "127.0.0.1", "[::1]"]);
+
+function isLocalHost(host: RuntimeHost): boolean {
+  return LOOPBACK_HOSTNAMES.has(new URL(host.url).hostname);
+}
+
+/**
+ * Tag a compute request so 503 retries and failovers of it reuse (not redo) the service's work.
+ * Opt-in (`idempotencyKeys`): the service keeps a keyed computation running briefly after its
+ * caller leaves, waiting for the retry.
+ */
+function idempotent(init: RequestInit, enabled: boolean): RequestInit {
+  if (!enabled) {
+    return init;
+  }
+  return {
+    ...init,
+    headers: { ...(init.headers as Record<string, string> | undefined), "Idempotency-Key": randomUUID() },
+  };
+}
+
 interface RuntimeHost {
   id: string;
   url: string;
@@ -33,7 +74,11 @@ interface RuntimeHost {
   consecutive503s: number;
   lastError?: string;
   lastInfo?: InfoResponse;
+  lastLoad?: LoadResponse;
+  loadEtag?: string;
   lastCheckedAt?: number;
+  /** Set from `/health`: the host decodes gzip request bodies. Older hosts do not advertise it. */
+  acceptsGzip?: boolean;
 }
 
 export class GpuBridgeClient {
@@ -44,6 +89,7 @@ export class GpuBridgeClient {
   private healthCheckIntervalMs: number;
   private maxBatchSize: number;
   private maxTextLength: number;
+  private idempotencyKeys: boolean;
 
   constructor(config: GpuBridgeConfig) {
     this.hosts = this.normalizeHosts(config);
@@ -52,6 +98,7 @@ export class GpuBridgeClient {
     this.healthCheckIntervalMs = (config.healthCheckIntervalSeconds ?? 30) * 1000;
     this.maxBatchSize = config.limits?.maxBatchSize ?? DEFAULT_MAX_BATCH_SIZE;
     this.maxTextLength = config.limits?.maxTextLength ?? DEFAULT_MAX_TEXT_LENGTH;
+    this.idempotencyKeys = config.idempotencyKeys ?? false;
 
     const timer = setInterval(() => {
       void this.runHealthChecks();
@@ -84,12 +131,19 @@ export class GpuBridgeClient {
   }
 
   private async requestFromHost<T>(host: RuntimeHost, path: string, options?: RequestInit): Promise<T> {
+    const timeoutMs = path === "/health" ? 5000 : this.timeout;
+
     const headers: Record<string, string> = {
       "Content-Type": "application/json",
+      // Lets the service cancel remaining GPU work once we have given up on the request
+      "X-Deadline-Ms": String(timeoutMs),
       ...(host.apiKey ? { "X-API-Key": host.apiKey } : {}),
     };
 
-    const timeoutMs = path === "/health" ? 5000 : this.timeout;
+    const plain = options?.body;
+    let compressed = host.acceptsGzip && typeof plain === "string" && Buffer.byteLength(plain) >= COMPRESS_REQUEST_BYTES
+      ? gzipSync(plain)
+      : undefined;
 
     for (let attempt = 0; attempt <= MAX_503_RETRIES; attempt += 1) {
       const controller = new AbortController();
@@ -98,10 +152,24 @@ export class GpuBridgeClient {
       try {
         const res = await fetch(`${host.url}${path}`, {
           ...options,
-          headers: { ...headers, ...(options?.headers as Record<string, string> | undefined) },
+          body: compressed ?? plain,
+          headers: {
+            ...headers,
+            ...(options?.headers as Record<string, string> | undefined),
+            ...(compressed ? { "Content-Encoding": "gzip" } : {}),
+          },
           signal: controller.signal,
         });
 
+        if (compressed && (res.status === 400 || res.status === 415)) {
+          // The host did not decode the body after all (e.g. a proxy in front of it): resend it
+          // uncompressed without spending a retry, and stop compressing for this host.
+          host.acceptsGzip = false;
+          compressed = undefined;
+          attempt -= 1;
+          continue;
+        }
+
         if (res.status === 503) {
           host.consecutive503s += 1;
           const retryAfter = res.headers.get("Retry-After");
@@ -156,6 +224,11 @@ export class GpuBridgeClient {
 
     if (this.strategy === "least-busy" && path !== "/health") {
       await Promise.all(pool.map(async (host) => {
+        if (await this.refreshLoad(host)) {
+          return;
+        }
+        // Hosts without /load (older services) are ranked by VRAM use from /info
+        host.lastLoad = undefined;
         try {
           const info = await this.requestFromHost<InfoResponse>(host, "/info");
           host.lastInfo = info;
@@ -166,7 +239,12 @@ export class GpuBridgeClient {
       }));
 
       const candidates = this.getHealthyHosts();
-      const byLeastBusy = [...candidates].sort((a, b) => this.vramLoad(a) - this.vramLoad(b));
+      const byLeastBusy = [...candidates].sort((a, b) => {
+        if (a.lastLoad && b.lastLoad) {
+          return this.queueLoad(a.lastLoad) - this.queueLoad(b.lastLoad) || this.vramLoad(a) - this.vramLoad(b);
+        }
+        return this.vramLoad(a) - this.vramLoad(b);
+      });
       return byLeastBusy[0];
     }
 
@@ -175,7 +253,50 @@ export class GpuBridgeClient {
     return host;
   }
 
+  /** Poll `/load`, revalidating with the last ETag; false when the host has no usable `/load`. */
+  private async refreshLoad(host: RuntimeHost): Promise<boolean> {
+    const controller = new AbortController();
+    const timer = setTimeout(() => controller.abort(), LOAD_TIMEOUT_MS);
+    try {
+      const res = await fetch(`${host.url}/load`, {
+        headers: {
+          ...(host.apiKey ? { "X-API-Key": host.apiKey } : {}),
+          ...(host.loadEtag && host.lastLoad ? { "If-None-Match": host.loadEtag } : {}),
+        },
+        signal: controller.signal,
+      });
+      if (res.status === 304 && host.lastLoad) {
+        host.lastCheckedAt = Date.now();
+        return true;
+      }
+      if (!res.ok) {
+        return false;
+      }
+      const load = (await res.json()) as LoadResponse;
+      if (typeof load?.queued !== "number") {
+        return false;
+      }
+      host.lastLoad = load;
+      host.loadEtag = res.headers?.get?.("ETag") ?? undefined;
+      host.lastCheckedAt = Date.now();
+      return true;
+    } catch {
+      return false;
+    } finally {
+      clearTimeout(timer);
+    }
+  }
+
+  /** Waiting requests dominate; the share of the admission budget in use breaks ties. */
+  private queueLoad(load: LoadResponse): number {
+    return load.queued + load.utilization;
+  }
+
   private vramLoad(host: RuntimeHost): number {
+    const memory = host.lastLoad?.memory;
+    if (memory?.total_mb && memory.free_mb !== null && memory.free_mb !== undefined) {
+      return 1 - memory.free_mb / memory.total_mb;
+    }
     const total = host.lastInfo?.vram_total_mb;
     const used = host.lastInfo?.vram_used_mb;
     if (!total || total <= 0 || used === undefined) {
@@ -209,17 +330,18 @@ export class GpuBridgeClient {
   private async runHealthChecks(): Promise<void> {
     await Promise.all(this.hosts.map(async (host) => {
       try {
-        await this.requestFromHost<HealthResponse>(host, "/health");
+        const health = await this.requestFromHost<HealthResponse>(host, "/health");
+        host.acceptsGzip = health.request_encodings?.includes("gzip") ?? false;
       } catch {
         // already tracked as unhealthy
       }
     }));
   }
 
-  private validateTexts(texts: string[], fieldName: string): void {
-    if (texts.length > this.maxBatchSize) {
+  private validateTexts(texts: string[], fieldName: string, maxItems = this.maxBatchSize): void {
+    if (texts.length > maxItems) {
       throw new InputValidationError(
-        `${fieldName} array length ${texts.length} exceeds max batch size of ${this.maxBatchSize}`
+        `${fieldName} array length ${texts.length} exceeds max batch size of ${maxItems}`
       );
     }
     for (let i = 0; i < texts.length; i += 1) {
@@ -231,6 +353,24 @@ export class GpuBridgeClient {
     }
   }
 
+  private validateReferences(references: string[] | string[][]): void {
+    if (references.every((ref) => typeof ref === "string")) {
+      this.validateTexts(references as string[], "references");
+      return;
+    }
+    if (references.length > this.maxBatchSize) {
+      throw new InputValidationError(
+        `references array length ${references.length} exceeds max batch size of ${this.maxBatchSize}`
+      );
+    }
+    references.forEach((group, i) => {
+      if (typeof group === "string" || group.length === 0) {
+        throw new InputValidationError(`references[${i}] must hold 1 to ${this.maxBatchSize} references`);
+      }
+      this.validateTexts(group, `references[${i}]`);
+    });
+  }
+
   async health(): Promise<HealthResponse> {
     return this.requestWithFailover<HealthResponse>("/health");
   }
@@ -241,21 +381,74 @@ export class GpuBridgeClient {
 
   async bertscore(req: BertScoreRequest): Promise<BertScoreResponse> {
     this.validateTexts(req.candidates, "candidates");
-    this.validateTexts(req.references, "references");
-    return this.requestWithFailover<BertScoreResponse>("/bertscore", {
+    this.validateReferences(req.references);
+    return this.requestWithFailover<BertScoreResponse>("/bertscore", idempotent({
       method: "POST",
-      body: JSON.stringify(req),
-    });
+      ...jsonBody(req),
+    }, this.idempotencyKeys));
   }
 
   async embed(req: EmbedRequest): Promise<EmbedResponse> {
     this.validateTexts(req.texts, "texts");
-    return this.requestWithFailover<EmbedResponse>("/embed", {
+    return this.requestWithFailover<EmbedResponse>("/embed", idempotent({
+      method: "POST",
+      ...jsonBody(req),
+    }, this.idempotencyKeys));
+  }
+
+  /**
+   * Embed on a GPU host running on this machine and read the vectors from the
+   * shared-memory segment it writes, skipping JSON for the result. The segment
+   * is released as soon as it has been read.
+   */
+  async embedShared(req: EmbedRequest): Promise<EmbedSharedResult> {
+    this.validateTexts(req.texts, "texts");
+    const host = this.getHealthyHosts().find(isLocalHost) ?? this.hosts.find(isLocalHost);
+    if (!host) {
+      throw new Error("embedShared needs a GPU host on this machine (localhost URL)");
+    }
+    const lease = await this.requestFromHost<EmbedShmResponse>(host, "/embed", {
+      method: "POST",
+      ...jsonBody({ ...req, output: "shm" }),
+    });
+    try {
+      const data = await readFile(lease.path);
+      // Copy out of the file buffer so the vectors are 4-byte aligned and outlive the segment
+      const bytes = data.buffer.slice(data.byteOffset + lease.offset, data.byteOffset + data.byteLength);
+      return { vectors: new Float32Array(bytes), shape: lease.shape, model: lease.model, dimensions: lease.dimensions };
+    } finally {
+      await this.releaseShared(host, lease.handle);
+    }
+  }
+
+  private async releaseShared(host: RuntimeHost, handle: string): Promise<void> {
+    try {
+      await fetch(`${host.url}/shm/${handle}`, {
+        method: "DELETE",
+        headers: host.apiKey ? { "X-API-Key": host.apiKey } : {},
+      });
+    } catch {
+      // the lease expires on its own after GPU_SHM_TTL
+    }
+  }
+
+  async registerCorpus(req: CorpusRequest): Promise<CorpusInfo> {
+    this.validateTexts(req.texts, "texts", MAX_CORPUS_DOCUMENTS);
+    return this.requestWithFailover<CorpusInfo>("/corpora", {
       method: "POST",
-      body: JSON.stringify(req),
+      ...jsonBody(req),
     });
   }
 
+  async rerank(req: RerankRequest): Promise<RerankResponse> {
+    this.validateTexts([req.query], "query");
+    this.validateTexts(req.candidates, "candidates", MAX_RERANK_CANDIDATES);
+    return this.requestWithFailover<RerankResponse>("/rerank", idempotent({
+      method: "POST",
+      ...jsonBody(req),
+    }, this.idempotencyKeys));
+  }
+
   async status(): Promise<StatusResponse> {
     return this.requestWithFailover<StatusResponse>("/status");
   }
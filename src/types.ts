@@ -27,6 +27,8 @@ export interface GpuBridgeConfig {
   timeout?: number;
   healthCheckIntervalSeconds?: number;
   loadBalancing?: LoadBalancingStrategy;
+  /** Send an `Idempotency-Key` with compute calls so retries join the running work (default false) */
+  idempotencyKeys?: boolean;
   models?: {
     embed?: string;
     bertscore?: string;
@@ -41,6 +43,23 @@ export interface GpuBridgeConfig {
 export interface HealthResponse {
   status: "ok" | "error";
   device: string;
+  /** `Content-Encoding`s the host decodes on request bodies; absent on hosts that decode none */
+  request_encodings?: string[];
+}
+
+/** `GET /ready`: 200 once the default models are loaded and warmed, 503 before */
+export interface ReadyResponse {
+  ready: boolean;
+  models: Array<{
+    kind: "bertscore" | "embed";
+    model: string;
+    state: "loading" | "warming" | "ready";
+    /** Per-shape latencies of the post-load warmup; null when warmup is off */
+    warmup?: {
+      seconds: number;
+      shapes: Array<{ batch_size: number; tokens: number; first_ms: number; warm_ms: number }>;
+    } | null;
+  }>;
 }
 
 export interface InfoResponse {
@@ -51,13 +70,103 @@ export interface InfoResponse {
   pytorch_version: string;
   cuda_version: string | null;
   loaded_models: string[];
+  /** Seconds of idleness before a model is offloaded; null when offload is off */
+  offload_idle_seconds?: number | null;
+  residency?: Array<{
+    model: string;
+    state: "device" | "host" | "file";
+    size_mb: number;
+    idle_seconds: number;
+    offloads: number;
+    promotions: number;
+    last_promotion_ms?: number | null;
+    mean_promotion_ms?: number | null;
+  }>;
+  /** CPU replicas (GPU_CPU_REPLICAS > 1 on CPU hosts) */
+  cpu_replicas?: Array<{
+    name: string;
+    cores: number[];
+    threads: number;
+    inflight: number;
+    completed: number;
+    busy_seconds: number;
+  }>;
+  /** BERTScore token-embedding cache (null when GPU_TOKEN_CACHE_MB=0) */
+  token_cache?: {
+    entries: number;
+    bytes: number;
+    budget_bytes: number;
+    dtype: string;
+    hits: number;
+    misses: number;
+    evictions: number;
+    hit_ratio: number;
+  } | null;
+  bertscore_layers?: Array<{
+    model: string;
+    num_layers: number;
+    total_layers: number;
+    size_mb: number;
+    saved_mb: number;
+  }>;
+  shared_results?: {
+    dir: string;
+    segments: number;
+    bytes: number;
+    budget_bytes: number;
+    ttl_seconds: number;
+    leased: number;
+    released: number;
+    expired: number;
+  } | null;
+}
+
+/** `/load`: cheap, ETag-cached load snapshot used by the least-busy strategy */
+export interface LoadResponse {
+  /** Requests waiting for admission, all lanes */
+  queued: number;
+  /** Running jobs */
+  jobs: number;
+  in_use_units: number;
+  capacity_units: number;
+  /** in_use_units / capacity_units, 0..1 */
+  utilization: number;
+  /** EWMA job duration per kind ("embed", "bertscore") */
+  service_ms: Record<string, number>;
+  memory: { free_mb: number | null; total_mb: number | null };
+  lanes: Array<{
+    name: string;
+    queued: number;
+    jobs: number;
+    in_use_units: number;
+    capacity_units: number | null;
+  }>;
 }
 
 export interface BertScoreRequest {
   candidates: string[];
-  references: string[];
+  /** One reference per candidate, or several per candidate (scored against the best) */
+  references: string[] | string[][];
   lang?: string;
   model_type?: string;
+  /** Id from `registerCorpus()`; weights tokens by that corpus's IDF */
+  idf_corpus?: string;
+  /** Scoring layer; a non-default layer loads a separate `<model>@<n>` scorer */
+  num_layers?: number;
+}
+
+export interface CorpusRequest {
+  texts: string[];
+  model_type?: string;
+}
+
+export interface CorpusInfo {
+  /** Content hash of the corpus texts */
+  id: string;
+  documents: number;
+  /** Models whose IDF table for this corpus is loaded */
+  models: string[];
+  created?: boolean;
 }
 
 export interface BertScoreResponse {
@@ -65,11 +174,37 @@ export interface BertScoreResponse {
   recall: number[];
   f1: number[];
   model: string;
+  /** Index of each candidate's best-matching reference (multi-reference requests only) */
+  best_reference?: number[];
 }
 
 export interface EmbedRequest {
   texts: string[];
   model?: string;
+  /** "shm": return a shared-memory segment handle instead of the vectors (local clients only) */
+  output?: "json" | "shm";
+}
+
+/** `/embed` reply for `output: "shm"` */
+export interface EmbedShmResponse {
+  handle: string;
+  /** `.npy` file holding the vectors; raw float32 data starts at `offset` */
+  path: string;
+  shape: number[];
+  dtype: string;
+  offset: number;
+  /** Unix time after which the service removes the segment */
+  expires_at: number;
+  model: string;
+  dimensions: number;
+}
+
+/** Result of `embedShared()`: row-major vectors in one buffer */
+export interface EmbedSharedResult {
+  vectors: Float32Array;
+  shape: number[];
+  model: string;
+  dimensions: number;
 }
 
 export interface EmbedResponse {
@@ -78,12 +213,63 @@ export interface EmbedResponse {
   dimensions: number;
 }
 
+export interface RerankRequest {
+  query: string;
+  candidates: string[];
+  /** Shortlist size kept by the embedding prefilter and scored with BERTScore */
+  top_k?: number;
+  model_type?: string;
+  embed_model?: string;
+  /** BERTScore scoring layer, as in `BertScoreRequest` */
+  num_layers?: number;
+}
+
+export interface RerankResult {
+  /** Index into the request's `candidates` */
+  index: number;
+  /** BERTScore F1 against the query */
+  score: number;
+  precision: number;
+  recall: number;
+  /** Cosine similarity from the embedding prefilter */
+  embed_score: number;
+}
+
+export interface RerankResponse {
+  results: RerankResult[];
+  model: string;
+  embed_model: string;
+  candidates: number;
+  shortlisted: number;
+  timings_ms: { embed?: number; prefilter?: number; bertscore?: number; total?: number };
+}
+
+/** One admission lane (or the shared global budget) on `/status`. */
+export interface LaneStatus {
+  name: string;
+  capacity_units?: number | null;
+  in_use_units: number;
+  available_units?: number | null;
+  jobs: number;
+  max_jobs?: number | null;
+  queued: number;
+  max_queue?: number | null;
+  timeout_s?: number | null;
+}
+
 export interface StatusResponse {
   queue: {
     max_concurrent: number;
     in_flight: number;
     available_slots: number;
     waiting_estimate: number;
+    capacity_units?: number | null;
+    in_use_units?: number | null;
+    available_units?: number | null;
+    cost_factors?: Record<string, number>;
+    /** Per-kind (or per-model) execution lanes */
+    lanes?: LaneStatus[];
+    global_budget?: LaneStatus | null;
   };
   active_jobs: Array<{
     id: string;
@@ -92,5 +278,13 @@ export interface StatusResponse {
     items: number;
     model: string;
     progress: number;
+    /** Estimated cost units charged against the admission budget */
+    cost?: number | null;
+    items_per_sec?: number | null;
+    eta_seconds?: number | null;
+    /** Busy fraction per pipeline stage (tokenize/forward/copy) for embed jobs */
+    stage_utilization?: Record<string, number> | null;
+    /** Peak memory growth (MB) since the job started: device memory on CUDA, RSS on CPU */
+    peak_memory_mb?: number | null;
   }>;
 }